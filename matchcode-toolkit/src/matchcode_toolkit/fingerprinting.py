@@ -9,6 +9,8 @@
 
 import binascii
 
+import numpy
+
 from matchcode_toolkit.halohash import BitAverageHaloHash
 
 
@@ -17,10 +19,17 @@ def _create_directory_fingerprint(inputs):
     Return a 128-bit BitAverageHaloHash fingerprint in hex from `inputs`
     """
     inputs = [i.encode('utf-8') for i in inputs if i]
-    bah128 = BitAverageHaloHash(inputs, size_in_bits=128).hexdigest()
-    inputs_count = len(inputs)
+    bah128 = BitAverageHaloHash(inputs, size_in_bits=128)
+    return _get_directory_fingerprint(bah128, len(inputs))
+
+
+def _get_directory_fingerprint(bah128, inputs_count):
+    """
+    Return a directory fingerprint string from the `bah128`
+    BitAverageHaloHash and the `inputs_count` number of inputs hashed in it
+    """
     inputs_count_hex_str = '%08x' % inputs_count
-    bah128 = bah128.decode('utf-8')
+    bah128 = bah128.hexdigest().decode('utf-8')
     directory_fingerprint = inputs_count_hex_str + bah128
     return directory_fingerprint
 
@@ -45,11 +54,27 @@ def _get_resource_subpath(resource, top):
 
     The subpath returned would be 'baz.c'
     """
-    _, _, subpath = resource.path.partition(top.path)
+    return _get_subpath(resource.path, top.path)
+
+
+def _get_subpath(path, top_path):
+    """
+    Return the subpath of `path` relative to `top_path`
+    """
+    _, _, subpath = path.partition(top_path)
     subpath = subpath.lstrip('/')
     return subpath
 
 
+def _get_rounded_size(size):
+    """
+    Return `size` rounded down to the nearest ten
+    """
+    if not size:
+        return 0
+    return int(size / 10) * 10
+
+
 def create_structure_fingerprint(directory, children):
     """
     Collect the subpaths of children Resources of Resource `directory` and
@@ -60,42 +85,282 @@ def create_structure_fingerprint(directory, children):
         if not child.path:
             continue
         child_subpath = _get_resource_subpath(child, directory)
-        if not child.size:
-            rounded_child_size = 0
-        else:
-            rounded_child_size = int(child.size / 10) * 10
+        rounded_child_size = _get_rounded_size(child.size)
         path_feature = str(rounded_child_size) + child_subpath
         features.append(path_feature)
     return _create_directory_fingerprint(features)
 
 
-def compute_directory_fingerprints(codebase):
+class _DirectoryFeatures:
+    """
+    Features of all the files under a directory, accumulated from the bottom
+    up to compute the fingerprints of that directory.
+    """
+
+    def __init__(self):
+        self.files_count = 0
+        # Number of files with a SHA1 and the BitAverageHaloHash of their SHA1s
+        self.sha1s_count = 0
+        self.content_bah128 = BitAverageHaloHash(size_in_bits=128)
+        # list of (rounded size string, path) for all files with a path
+        self.structure_features = []
+
+    @classmethod
+    def from_file(cls, resource):
+        features = cls()
+        features.files_count = 1
+        if resource.sha1:
+            features.sha1s_count = 1
+            features.content_bah128.update(resource.sha1.encode('utf-8'))
+        if resource.path:
+            rounded_size = str(_get_rounded_size(resource.size))
+            features.structure_features.append((rounded_size, resource.path))
+        return features
+
+    def add(self, other):
+        """
+        Add the features of `other` to these features.
+        """
+        self.files_count += other.files_count
+        self.sha1s_count += other.sha1s_count
+        self.content_bah128 = BitAverageHaloHash.combine(
+            [self.content_bah128, other.content_bah128]
+        )
+        self.structure_features.extend(other.structure_features)
+
+    def get_directory_columns(self, directory_path):
+        """
+        Return the DirectoryColumns of these features for the directory at
+        `directory_path`.
+        """
+        structure_features = [
+            (rounded_size + _get_subpath(path, directory_path)).encode('utf-8')
+            for rounded_size, path in self.structure_features
+        ]
+        structure_bah128 = BitAverageHaloHash(structure_features, size_in_bits=128)
+        return DirectoryColumns(
+            files_count=self.files_count,
+            content_count=self.sha1s_count,
+            content_columns=self.content_bah128.columns,
+            structure_count=len(structure_features),
+            structure_columns=structure_bah128.columns,
+        )
+
+
+class DirectoryColumns:
+    """
+    The counts and the sums of the BitAverageHaloHash columns of the content
+    and structure features of all the files under a directory.
+
+    The fingerprints of a directory are computed from these column sums. The
+    column sums are additive: when a file is added to or removed from a
+    directory tree, the fingerprints of each of its ancestor directories can
+    be updated by adding or subtracting the columns of this single file
+    rather than hashing again all the files of these directories.
+    """
+
+    def __init__(
+        self,
+        files_count=0,
+        content_count=0,
+        content_columns=None,
+        structure_count=0,
+        structure_columns=None,
+    ):
+        self.files_count = files_count
+        self.content_count = content_count
+        self.content_columns = _as_columns(content_columns)
+        self.structure_count = structure_count
+        self.structure_columns = _as_columns(structure_columns)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, DirectoryColumns)
+            and self.files_count == other.files_count
+            and self.content_count == other.content_count
+            and self.structure_count == other.structure_count
+            and numpy.array_equal(self.content_columns, other.content_columns)
+            and numpy.array_equal(self.structure_columns, other.structure_columns)
+        )
+
+    def __repr__(self):
+        return (
+            f'DirectoryColumns(files_count={self.files_count}, '
+            f'content_count={self.content_count}, '
+            f'structure_count={self.structure_count})'
+        )
+
+    def add_file(self, directory_path, path, sha1, size, sign=1):
+        """
+        Add the features of the file at `path` with `sha1` and `size` to these
+        columns of the directory at `directory_path`. The features are
+        subtracted if `sign` is -1.
+        """
+        self.files_count += sign
+        if sha1:
+            self.content_count += sign
+            self.content_columns += sign * _get_feature_columns(sha1)
+        if path:
+            rounded_size = str(_get_rounded_size(size))
+            self.structure_count += sign
+            self.structure_columns += sign * _get_feature_columns(
+                rounded_size + _get_subpath(path, directory_path)
+            )
+
+    def remove_file(self, directory_path, path, sha1, size):
+        """
+        Subtract the features of the file at `path` with `sha1` and `size` from
+        these columns of the directory at `directory_path`.
+        """
+        self.add_file(directory_path, path, sha1, size, sign=-1)
+
+    @property
+    def has_fingerprints(self):
+        """
+        Return True if fingerprints are computed for a directory with these
+        columns. Directories with a single file are not fingerprinted as they
+        are matched by the exact file match.
+        """
+        return self.files_count != 1
+
+    def get_content_fingerprint(self):
+        """
+        Return a content fingerprint from the SHA1 of the files.
+        """
+        return _get_columns_fingerprint(self.content_columns, self.content_count)
+
+    def get_structure_fingerprint(self):
+        """
+        Return a structure fingerprint from the size and subpath of the files.
+        """
+        return _get_columns_fingerprint(self.structure_columns, self.structure_count)
+
+
+def _as_columns(columns):
+    """
+    Return a new int64 numpy array of 128 BitAverageHaloHash columns from the
+    `columns` sequence of integers or zeros if `columns` is None.
+    """
+    if columns is None:
+        return numpy.zeros(128, dtype=numpy.int64)
+    return numpy.array(columns, dtype=numpy.int64)
+
+
+def _get_feature_columns(feature):
+    """
+    Return the BitAverageHaloHash columns of the single string `feature`.
+    """
+    return BitAverageHaloHash([feature.encode('utf-8')], size_in_bits=128).columns
+
+
+def _get_columns_fingerprint(columns, inputs_count):
+    """
+    Return a directory fingerprint string from the `columns` sums of a 128-bit
+    BitAverageHaloHash of `inputs_count` inputs.
+    """
+    bah128 = BitAverageHaloHash(size_in_bits=128)
+    bah128.columns = columns
+    return _get_directory_fingerprint(bah128, inputs_count)
+
+
+def compute_directory_fingerprints(codebase, directory_columns=None):
     """
     Compute fingerprints for a directory from `codebase`
+
+    This is done in a single bottom-up pass over `codebase`: the features of
+    the files of a directory are accumulated from its children rather than
+    walking each directory subtree again. The SHA1 of each file is hashed only
+    once and the BitAverageHaloHash columns are combined to compute the
+    content fingerprints. The structure fingerprints depend on the subpath of each
+    file relative to a directory and are hashed for each directory.
+
+    If a `directory_columns` mapping is provided, it is updated with the
+    {directory path: DirectoryColumns} of each directory of `codebase`.
     """
+    # mapping of {directory path: _DirectoryFeatures} accumulated from the
+    # children processed so far
+    features_by_path = {}
     for resource in codebase.walk(topdown=False):
-        if resource.is_file or not resource.path:
-            continue
-        children = [r for r in resource.walk(codebase) if r.is_file]
-        if len(children) == 1:
-            continue
-
-        directory_content_fingerprint = create_content_fingerprint(children)
-        if hasattr(resource, 'directory_content_fingerprint'):
-            resource.directory_content_fingerprint = directory_content_fingerprint
+        if resource.is_file:
+            features = _DirectoryFeatures.from_file(resource)
         else:
-            resource.extra_data['directory_content'] = directory_content_fingerprint
+            features = features_by_path.pop(resource.path, None) or _DirectoryFeatures()
+            if resource.path and (directory_columns is not None or features.files_count != 1):
+                columns = features.get_directory_columns(resource.path)
+                if directory_columns is not None:
+                    directory_columns[resource.path] = columns
+                if columns.has_fingerprints:
+                    _set_directory_fingerprints(resource, codebase, columns)
 
-        directory_structure_fingerprint = create_structure_fingerprint(resource, children)
-        if hasattr(resource, 'directory_structure_fingerprint'):
-            resource.directory_structure_fingerprint = directory_structure_fingerprint
-        else:
-            resource.extra_data['directory_structure'] = create_structure_fingerprint(resource, children)
+        parent_path = resource.parent_path()
+        if parent_path:
+            parent_features = features_by_path.get(parent_path)
+            if parent_features is None:
+                parent_features = features_by_path[parent_path] = _DirectoryFeatures()
+            parent_features.add(features)
 
-        resource.save(codebase)
     return codebase
 
 
+def get_parent_paths(path):
+    """
+    Return a list of the paths of the ancestor directories of `path`, from the
+    closest to the root.
+
+    For example:
+    >>> get_parent_paths('root/dir/file.c')
+    ['root/dir', 'root']
+    >>> get_parent_paths('root')
+    []
+    """
+    segments = path.split('/')
+    return ['/'.join(segments[:end]) for end in range(len(segments) - 1, 0, -1)]
+
+
+def update_directory_columns(directory_columns, added_files=(), removed_files=()):
+    """
+    Update the `directory_columns` mapping of {directory path:
+    DirectoryColumns} with the `added_files` and `removed_files` iterables of
+    (path, sha1, size) tuples of files. A modified file is both removed with
+    its previous SHA1 and size and added with its new ones.
+
+    The columns of the ancestor directories of each file are updated and are
+    created if they do not exist yet.
+
+    Return a set of the paths of the updated directories.
+    """
+    updated_paths = set()
+    changes = [(file, -1) for file in removed_files] + [(file, 1) for file in added_files]
+    for (path, sha1, size), sign in changes:
+        for directory_path in get_parent_paths(path):
+            columns = directory_columns.get(directory_path)
+            if columns is None:
+                columns = directory_columns[directory_path] = DirectoryColumns()
+            columns.add_file(directory_path, path, sha1, size, sign=sign)
+            updated_paths.add(directory_path)
+    return updated_paths
+
+
+def _set_directory_fingerprints(resource, codebase, columns):
+    """
+    Set the directory fingerprints computed from the `columns` DirectoryColumns
+    on the directory `resource` from `codebase` and save it.
+    """
+    directory_content_fingerprint = columns.get_content_fingerprint()
+    if hasattr(resource, 'directory_content_fingerprint'):
+        resource.directory_content_fingerprint = directory_content_fingerprint
+    else:
+        resource.extra_data['directory_content'] = directory_content_fingerprint
+
+    directory_structure_fingerprint = columns.get_structure_fingerprint()
+    if hasattr(resource, 'directory_structure_fingerprint'):
+        resource.directory_structure_fingerprint = directory_structure_fingerprint
+    else:
+        resource.extra_data['directory_structure'] = directory_structure_fingerprint
+
+    resource.save(codebase)
+
+
 def split_fingerprint(directory_fingerprint):
     """
     Given a string `directory_fingerprint`, return the indexed elements count as
@@ -11,6 +11,7 @@ import binascii
 
 from bitarray import bitarray
 from bitarray.util import count_xor
+import numpy
 
 from commoncode import codec
 from commoncode import hash as commoncode_hash
@@ -161,14 +162,11 @@ class BitAverageHaloHash(object):
     46
     """
 
-    # TODO: Keep state, keep 1 position per column
-
-    # TODO: create method to aggregate multiple BitAverageHaloHashes together
-    # TODO: refactor this, don't keep all hashes
-    # TODO: keep only a list of columns
     def __init__(self, msg=None, size_in_bits=128):
         self.size_in_bits = size_in_bits
-        self.columns = [0] * size_in_bits
+        # The sum of each bit column, where a zero bit counts as 1 and a one
+        # bit counts as -1
+        self.columns = numpy.zeros(size_in_bits, dtype=numpy.int64)
 
         # TODO: pick one hash module instead of selecting from multiple hash modules
         self.hashmodule = lambda x: x
@@ -191,18 +189,35 @@ class BitAverageHaloHash(object):
         if not msg:
             return
         if isinstance(msg, (list, tuple,)):
-            for m in msg:
-                self.__hashup(m)
+            self.update_many(msg)
         else:
-            self.__hashup(msg)
+            self.update_many([msg])
+
+    def update_many(self, msgs):
+        """
+        Append an iterable of bytestrings to the hash.
+
+        The hashes of all `msgs` are stacked in a bit matrix and their columns
+        are summed in a single vectorized operation.
 
-    def __hashup(self, msg):
-        assert isinstance(msg, bytes)
-        hsh = self.hashmodule(msg).digest()
-        bits = bitarray_from_bytes(hsh)
-        normalized = (-1 if v else 1 for v in bits)
-        for i, column in enumerate(normalized):
-            self.columns[i] += column
+        For example:
+        >>> a = BitAverageHaloHash(size_in_bits=128)
+        >>> a.update_many([b'The', b'value', b'specified'])
+        >>> b = BitAverageHaloHash([b'The', b'value', b'specified'], size_in_bits=128)
+        >>> assert a.hexdigest() == b.hexdigest()
+        """
+        digests = []
+        for msg in msgs:
+            assert isinstance(msg, bytes)
+            digests.append(self.hashmodule(msg).digest())
+        if not digests:
+            return
+
+        matrix = numpy.frombuffer(b''.join(digests), dtype=numpy.uint8)
+        matrix = matrix.reshape(len(digests), -1)
+        ones = numpy.unpackbits(matrix, axis=1).sum(axis=0, dtype=numpy.int64)
+        zeroes = len(digests) - ones
+        self.columns += zeroes - ones
 
     def hexdigest(self):
         """
@@ -220,9 +235,7 @@ class BitAverageHaloHash(object):
         """
         Return a binary string representing this hash.
         """
-        flattened = [1 if col > 0 else 0 for col in self.columns]
-        bits = bitarray(flattened)
-        return bits.tobytes()
+        return numpy.packbits(self.columns > 0).tobytes()
 
     def distance(self, other):
         """
@@ -239,15 +252,22 @@ class BitAverageHaloHash(object):
         Return a BitAverageHaloHash by summing and averaging the columns of the
         BitAverageHaloHashes in `hashes` together, putting the resulting
         columns into a new BitAverageHaloHash and returning it
+
+        For example:
+        >>> m1 = b'The value specified for size must be at least as large'.split()
+        >>> m2 = b'as for the smallest bit vector possible for intVal'.split()
+        >>> a = BitAverageHaloHash(m1)
+        >>> b = BitAverageHaloHash(m2)
+        >>> c = BitAverageHaloHash.combine([a, b])
+        >>> assert c.hexdigest() == BitAverageHaloHash(m1 + m2).hexdigest()
         """
         size_in_bits = hashes[0].size_in_bits
         for h in hashes:
-            assert isinstance(hash, cls), 'all hashes should be a BitAverageHaloHash, not {}'.format(type(h))
+            assert isinstance(h, cls), 'all hashes should be a BitAverageHaloHash, not {}'.format(type(h))
             assert h.size_in_bits == size_in_bits
 
-        all_columns = [h.columns for h in hashes]
-        b = cls()
-        b.columns = [sum(col) for col in zip(*all_columns)]
+        b = cls(size_in_bits=size_in_bits)
+        b.columns = numpy.sum([h.columns for h in hashes], axis=0, dtype=numpy.int64)
         return b
 
 
@@ -19,6 +19,7 @@ from matchcode_toolkit.fingerprinting import create_content_fingerprint
 from matchcode_toolkit.fingerprinting import create_halohash_chunks
 from matchcode_toolkit.fingerprinting import create_structure_fingerprint
 from matchcode_toolkit.fingerprinting import split_fingerprint
+from matchcode_toolkit.fingerprinting import update_directory_columns
 
 
 class Resource():
@@ -105,3 +106,59 @@ class TestFingerprintingFunctions(FileBasedTesting):
         expected_directory_structure = '000000034f9bf110673bdf06197cd514a799a66c'
         self.assertEqual(expected_directory_content, directory_content)
         self.assertEqual(expected_directory_structure, directory_structure)
+
+    def test_compute_directory_fingerprints_same_as_per_directory_fingerprints(self):
+        scan_loc = self.get_test_loc('abbrev-1.0.3-i.json')
+        vc = VirtualCodebase(location=scan_loc)
+        vc = compute_directory_fingerprints(vc)
+        for resource in vc.walk(topdown=True):
+            if resource.is_file:
+                continue
+            children = [r for r in resource.walk(vc) if r.is_file]
+            if len(children) == 1:
+                self.assertNotIn('directory_content', resource.extra_data)
+                continue
+            expected_directory_content = create_content_fingerprint(children)
+            expected_directory_structure = create_structure_fingerprint(resource, children)
+            self.assertEqual(expected_directory_content, resource.extra_data['directory_content'])
+            self.assertEqual(expected_directory_structure, resource.extra_data['directory_structure'])
+
+    def test_update_directory_columns_same_as_compute_directory_fingerprints(self):
+        scan_loc = self.get_test_loc('abbrev-1.0.3-i.json')
+        vc = VirtualCodebase(location=scan_loc)
+        directory_columns = {}
+        compute_directory_fingerprints(vc, directory_columns=directory_columns)
+        for resource in vc.walk(topdown=True):
+            if resource.is_file:
+                continue
+            columns = directory_columns[resource.path]
+            if not columns.has_fingerprints:
+                continue
+            self.assertEqual(resource.extra_data['directory_content'], columns.get_content_fingerprint())
+            self.assertEqual(resource.extra_data['directory_structure'], columns.get_structure_fingerprint())
+
+        files = [
+            (resource.path, resource.sha1, resource.size)
+            for resource in vc.walk() if resource.is_file
+        ]
+        path, sha1, size = files[0]
+        modified_file = (path, '0' * 40, size + 100)
+        added_file = ('package/lib/new.js', 'a' * 40, 42)
+        updated_paths = update_directory_columns(
+            directory_columns,
+            added_files=[modified_file, added_file],
+            removed_files=[files[0], files[1]],
+        )
+        self.assertIn('package/lib', updated_paths)
+
+        expected_files = [
+            dict(path=p, type='file', sha1=s, size=z)
+            for p, s, z in [modified_file, added_file] + files[2:]
+        ]
+        expected_vc = VirtualCodebase(location=dict(files=expected_files))
+        expected_columns = {}
+        compute_directory_fingerprints(expected_vc, directory_columns=expected_columns)
+        for directory_path, columns in expected_columns.items():
+            self.assertEqual(columns, directory_columns[directory_path])
+            self.assertEqual(columns.get_content_fingerprint(), directory_columns[directory_path].get_content_fingerprint())
+            self.assertEqual(columns.get_structure_fingerprint(), directory_columns[directory_path].get_structure_fingerprint())
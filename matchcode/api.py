@@ -7,24 +7,39 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+import json
+import time
+
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.forms import widgets
 from django.forms.fields import MultipleChoiceField
 from django_filters.filters import MultipleChoiceFilter
 from django_filters.rest_framework import FilterSet
+from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.serializers import CharField
+from rest_framework.serializers import FloatField
 from rest_framework.serializers import HyperlinkedRelatedField
+from rest_framework.serializers import IntegerField
+from rest_framework.serializers import ListField
 from rest_framework.serializers import ModelSerializer
 from rest_framework.serializers import ReadOnlyField
+from rest_framework.serializers import RegexField
 from rest_framework.serializers import Serializer
 from rest_framework.viewsets import ReadOnlyModelViewSet
+from rest_framework.viewsets import ViewSet
 
 from matchcode_toolkit.fingerprinting import create_halohash_chunks
 from matchcode_toolkit.fingerprinting import hexstring_to_binarray
 from matchcode_toolkit.fingerprinting import split_fingerprint
+from matchcode.cache import get_match_cache
+from matchcode.hamming import DEFAULT_THRESHOLD
+from matchcode.hamming import MAX_THRESHOLD
+from matchcode.match import get_package_scores
 from matchcode.models import ExactFileIndex
+from matchcode.models import ExactGitBlobIndex
 from matchcode.models import ExactPackageArchiveIndex
 from matchcode.models import ApproximateDirectoryContentIndex
 from matchcode.models import ApproximateDirectoryStructureIndex
@@ -57,6 +72,15 @@ class ExactPackageArchiveIndexSerializer(BaseFileIndexSerializer):
         )
 
 
+class ExactGitBlobIndexSerializer(BaseFileIndexSerializer):
+    class Meta:
+        model = ExactGitBlobIndex
+        fields = (
+            'sha1',
+            'package'
+        )
+
+
 class BaseDirectoryIndexSerializer(ModelSerializer):
     fingerprint = ReadOnlyField()
     package = HyperlinkedRelatedField(
@@ -86,6 +110,7 @@ class ApproximateDirectoryStructureIndexSerializer(BaseDirectoryIndexSerializer)
 class BaseDirectoryIndexMatchSerializer(Serializer):
     fingerprint = CharField()
     matched_fingerprint = CharField()
+    hamming_distance = IntegerField()
     package = HyperlinkedRelatedField(
         view_name='api:package-detail',
         lookup_field='uuid',
@@ -93,6 +118,82 @@ class BaseDirectoryIndexMatchSerializer(Serializer):
     )
 
 
+# Maximum number of SHA1s or fingerprints of each kind in a batch match request
+MAX_BATCH_MATCH_SIZE = 50000
+
+# Maximum number of Packages scored in a batch match request
+MAX_TOP_PACKAGES = 1000
+
+
+class BatchMatchSerializer(Serializer):
+    """
+    Validate the JSON body of a batch match request.
+    """
+    archive_sha1s = ListField(
+        child=RegexField(r'^[0-9a-fA-F]{40}$'),
+        max_length=MAX_BATCH_MATCH_SIZE,
+        required=False,
+        default=list,
+        help_text='SHA1s of package archives to match to the exact package archive index.',
+    )
+    file_sha1s = ListField(
+        child=RegexField(r'^[0-9a-fA-F]{40}$'),
+        max_length=MAX_BATCH_MATCH_SIZE,
+        required=False,
+        default=list,
+        help_text='SHA1s of files to match to the exact file index.',
+    )
+    git_blob_sha1s = ListField(
+        child=RegexField(r'^[0-9a-fA-F]{40}$'),
+        max_length=MAX_BATCH_MATCH_SIZE,
+        required=False,
+        default=list,
+        help_text='Git blob SHA1s of files to match to the exact git blob index.',
+    )
+    directory_content_fingerprints = ListField(
+        child=RegexField(r'^[0-9a-fA-F]{40}$'),
+        max_length=MAX_BATCH_MATCH_SIZE,
+        required=False,
+        default=list,
+        help_text='Directory content fingerprints to match to the approximate '
+                  'directory content index.',
+    )
+    directory_structure_fingerprints = ListField(
+        child=RegexField(r'^[0-9a-fA-F]{40}$'),
+        max_length=MAX_BATCH_MATCH_SIZE,
+        required=False,
+        default=list,
+        help_text='Directory structure fingerprints to match to the approximate '
+                  'directory structure index.',
+    )
+    threshold = IntegerField(
+        min_value=0,
+        max_value=MAX_THRESHOLD,
+        default=DEFAULT_THRESHOLD,
+        help_text='Maximum Hamming distance of an approximate directory match.',
+    )
+    top_packages = IntegerField(
+        min_value=0,
+        max_value=MAX_TOP_PACKAGES,
+        default=0,
+        help_text='If set, return the scores of the top N Packages that contain '
+                  'the most file SHA1s instead of each exact file match.',
+    )
+
+
+class PackageScoreSerializer(Serializer):
+    package = HyperlinkedRelatedField(
+        view_name='api:package-detail',
+        lookup_field='uuid',
+        read_only=True
+    )
+    purl = CharField(source='package.package_url')
+    matched_files_count = IntegerField()
+    package_files_count = IntegerField()
+    coverage = FloatField()
+    containment = FloatField()
+
+
 class CharMultipleWidget(widgets.TextInput):
     """
     Enables the support for `MultiValueDict` `?field=a&field=b`
@@ -138,10 +239,12 @@ class MultipleSHA1Filter(MultipleCharFilter):
         if not value:
             return qs
 
-        q = Q()
-        for val in value:
-            v = hexstring_to_binarray(val)
-            q.add(Q(sha1=v), Q.OR)
+        # Skip the SHA1s that are certainly not indexed
+        q = Q(pk__in=[])
+        for sha1s, extra_filter in qs.model.get_sha1_lookups(value):
+            if sha1s:
+                sha1s = [hexstring_to_binarray(sha1) for sha1 in sha1s]
+                q.add(Q(extra_filter, sha1__in=sha1s), Q.OR)
 
         return qs.filter(q)
 
@@ -198,6 +301,14 @@ class ExactPackageArchiveFilterSet(BaseFileIndexFilterSet):
         )
 
 
+class ExactGitBlobIndexFilterSet(BaseFileIndexFilterSet):
+    class Meta:
+        model = ExactGitBlobIndex
+        fields = (
+            'sha1',
+        )
+
+
 class BaseDirectoryIndexFilterSet(FilterSet):
     fingerprint = MultipleFingerprintFilter()
 
@@ -234,25 +345,49 @@ class ExactPackageArchiveIndexViewSet(BaseFileIndexViewSet):
     filterset_class = ExactPackageArchiveFilterSet
 
 
+class ExactGitBlobIndexViewSet(BaseFileIndexViewSet):
+    queryset = ExactGitBlobIndex.objects.all()
+    serializer_class = ExactGitBlobIndexSerializer
+    filterset_class = ExactGitBlobIndexFilterSet
+
+
 class BaseDirectoryIndexViewSet(ReadOnlyModelViewSet):
     lookup_field = 'fingerprint'
 
     @action(detail=False)
     def match(self, request):
+        """
+        Return the matches for the directory fingerprints passed in the
+        `fingerprint` query parameters.
+
+        The optional `threshold` query parameter is the maximum Hamming
+        distance of a match, from 0 to 16.
+        """
         fingerprints = request.query_params.getlist('fingerprint')
         if not fingerprints:
             return Response()
 
+        threshold = request.query_params.get('threshold') or DEFAULT_THRESHOLD
+        try:
+            threshold = int(threshold)
+            if not 0 <= threshold <= MAX_THRESHOLD:
+                raise ValueError
+        except ValueError:
+            message = {
+                'status': f'threshold must be an integer between 0 and {MAX_THRESHOLD}'
+            }
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+
         model_class = self.get_serializer().Meta.model
         results = []
-        unique_fingerprints = set(fingerprints)
-        for fingerprint in unique_fingerprints:
-            matches = model_class.match(fingerprint)
+        matches_by_fingerprint = model_class.match_many(fingerprints, threshold=threshold)
+        for fingerprint, matches in matches_by_fingerprint.items():
             for match in matches:
                 results.append(
                     {
                         'fingerprint': fingerprint,
                         'matched_fingerprint': match.fingerprint(),
+                        'hamming_distance': match.hamming_distance,
                         'package': match.package,
                     }
                 )
@@ -275,3 +410,166 @@ class ApproximateDirectoryStructureIndexViewSet(BaseDirectoryIndexViewSet):
     queryset = ApproximateDirectoryStructureIndex.objects.all()
     serializer_class = ApproximateDirectoryStructureIndexSerializer
     filterset_class = ApproximateDirectoryStructureFilterSet
+
+
+class MatchViewSet(ViewSet):
+    """
+    Match in a single request many package archive and file SHA1s and
+    directory fingerprints, such as all the ones of a scanned codebase.
+    """
+
+    def create(self, request):
+        """
+        Return the matches of the SHA1s and directory fingerprints of the JSON
+        request body as newline-delimited JSON, streamed as they are found.
+
+        For example, this request body:
+
+            {
+                "archive_sha1s": ["<sha1>", ...],
+                "file_sha1s": ["<sha1>", ...],
+                "git_blob_sha1s": ["<sha1>", ...],
+                "directory_content_fingerprints": ["<fingerprint>", ...],
+                "directory_structure_fingerprints": ["<fingerprint>", ...],
+                "threshold": 10
+            }
+
+        returns one line for each match:
+
+            {"match_type": "exact-file", "sha1": "<sha1>", "package": "<package url>"}
+            {"match_type": "approximate-content", "fingerprint": "<fingerprint>",
+             "matched_fingerprint": "<fingerprint>", "hamming_distance": 2,
+             "package": "<package url>"}
+
+        SHA1s of very common files found in too many Packages are not matched
+        and are returned with their number of Packages instead:
+
+            {"low_signal": {"match_type": "exact-file", "sha1": "<sha1>",
+             "packages_count": 1234}}
+
+        and a last summary line with the number of matches, the number of
+        low-signal SHA1s and the duration in seconds of each match type and of
+        the whole request.
+
+        With a "top_packages" count, the scores of the top Packages that
+        contain the most file SHA1s are returned instead of each file match:
+
+            {"package_score": {"package": "<package url>", "purl": "<purl>",
+             "matched_files_count": 10, "package_files_count": 12,
+             "coverage": 0.8333, "containment": 0.5}}
+        """
+        serializer = BatchMatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return StreamingHttpResponse(
+            iter_batch_matches(request, **serializer.validated_data),
+            content_type='application/x-ndjson',
+        )
+
+    @action(detail=False)
+    def cache_stats(self, request):
+        """
+        Return the statistics of the match results cache of the process that
+        handles this request.
+        """
+        match_cache = get_match_cache()
+        if not match_cache:
+            return Response({'status': 'Match results are not cached.'})
+        return Response(match_cache.get_stats())
+
+
+def iter_batch_matches(
+    request,
+    archive_sha1s=(),
+    file_sha1s=(),
+    git_blob_sha1s=(),
+    directory_content_fingerprints=(),
+    directory_structure_fingerprints=(),
+    threshold=DEFAULT_THRESHOLD,
+    top_packages=0,
+):
+    """
+    Yield newline-delimited JSON lines of the matches of the SHA1s and directory
+    fingerprints, then of a summary of the matching.
+
+    If `top_packages` is set, the scores of the top Packages that contain the
+    `file_sha1s` are yielded instead of each exact file match.
+    """
+    start = time.time()
+    context = {'request': request}
+    matches_counts = {}
+    low_signal_counts = {}
+    durations = {}
+
+    sha1_batches = [
+        ('exact-archive', ExactPackageArchiveIndex, ExactPackageArchiveIndexSerializer, archive_sha1s),
+    ]
+    if top_packages:
+        match_start = time.time()
+        package_scores = get_package_scores(
+            [sha1.lower() for sha1 in file_sha1s],
+            limit=top_packages,
+        )
+        for package_score in package_scores:
+            data = PackageScoreSerializer(package_score, context=context).data
+            yield json.dumps(dict(package_score=data)) + '\n'
+        matches_counts['package-score'] = len(package_scores)
+        durations['package-score'] = round(time.time() - match_start, 3)
+    else:
+        sha1_batches.append(
+            ('exact-file', ExactFileIndex, ExactFileIndexSerializer, file_sha1s)
+        )
+    sha1_batches.append(
+        ('exact-git-blob', ExactGitBlobIndex, ExactGitBlobIndexSerializer, git_blob_sha1s)
+    )
+    for match_type, model_class, serializer_class, sha1s in sha1_batches:
+        match_start = time.time()
+        matches_count = 0
+        sha1s = [sha1.lower() for sha1 in sha1s]
+        matches_by_sha1, low_signal_sha1s = model_class.match_many_with_low_signal(sha1s)
+        for matches in matches_by_sha1.values():
+            for match in matches:
+                data = dict(match_type=match_type)
+                data.update(serializer_class(match, context=context).data)
+                matches_count += 1
+                yield json.dumps(data) + '\n'
+        for sha1, packages_count in sorted(low_signal_sha1s.items()):
+            low_signal = dict(match_type=match_type, sha1=sha1, packages_count=packages_count)
+            yield json.dumps(dict(low_signal=low_signal)) + '\n'
+        matches_counts[match_type] = matches_count
+        if low_signal_sha1s:
+            low_signal_counts[match_type] = len(low_signal_sha1s)
+        durations[match_type] = round(time.time() - match_start, 3)
+
+    fingerprint_batches = [
+        ('approximate-content', ApproximateDirectoryContentIndex, directory_content_fingerprints),
+        ('approximate-structure', ApproximateDirectoryStructureIndex, directory_structure_fingerprints),
+    ]
+    for match_type, model_class, fingerprints in fingerprint_batches:
+        match_start = time.time()
+        matches_count = 0
+        fingerprints = [fingerprint.lower() for fingerprint in fingerprints]
+        matches_by_fingerprint = model_class.match_many(fingerprints, threshold=threshold)
+        for fingerprint, matches in matches_by_fingerprint.items():
+            for match in matches:
+                result = {
+                    'fingerprint': fingerprint,
+                    'matched_fingerprint': match.fingerprint(),
+                    'hamming_distance': match.hamming_distance,
+                    'package': match.package,
+                }
+                data = dict(match_type=match_type)
+                data.update(BaseDirectoryIndexMatchSerializer(result, context=context).data)
+                matches_count += 1
+                yield json.dumps(data) + '\n'
+        matches_counts[match_type] = matches_count
+        durations[match_type] = round(time.time() - match_start, 3)
+
+    summary = dict(
+        matches_counts=matches_counts,
+        low_signal_counts=low_signal_counts,
+        durations=durations,
+        total_duration=round(time.time() - start, 3),
+    )
+    yield json.dumps(dict(summary=summary)) + '\n'
@@ -0,0 +1,575 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+"""
+A benchmark suite of the fingerprinting, indexing and matching of matchcode
+run on a synthetic corpus.
+
+The corpus is made of generated Packages with random files and of a codebase
+that vendors copies of some of these Packages, some of them with a modified
+file, next to its own unique files. The corpus is fully determined by its
+parameters and random seed so that the results of different runs can be
+compared.
+
+Each benchmark is run for a number of rounds and its timing statistics are
+reported in a JSON document similar to the one of pytest-benchmark.
+"""
+
+from datetime import datetime
+from datetime import timezone
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import time
+
+import attr
+from commoncode.resource import VirtualCodebase
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from matchcode_toolkit.fingerprinting import compute_directory_fingerprints
+from matchcode.hamming import MAX_THRESHOLD
+from matchcode.indexing import bulk_index_packages
+from matchcode.indexing import index_package_directories
+from matchcode.management.commands.match_scan import match_codebase
+from matchcode.models import ApproximateDirectoryContentIndex
+from matchcode.models import ApproximateDirectoryStructureIndex
+from matchcode.models import ExactFileIndex
+from matchcode.models import ExactFilePackageSet
+from matchcode.models import ExactPackageArchiveIndex
+from packagedb.models import Package
+from packagedb.models import Resource
+
+
+BENCHMARK_RESULTS_VERSION = 1
+
+BENCHMARK_PACKAGE_TYPE = 'generic'
+BENCHMARK_PACKAGE_NAMESPACE = 'matchcode-benchmark'
+
+# Average number of files in a generated directory
+FILES_PER_DIRECTORY = 8
+
+
+@attr.s
+class SyntheticCorpus:
+    """
+    A synthetic corpus of Packages files and of a codebase files. Files are
+    mappings of ScanCode-like Resource fields.
+    """
+    # List of (Package name, list of files) of each Package
+    packages = attr.ib(default=attr.Factory(list))
+    # List of the files of the codebase to match
+    codebase_files = attr.ib(default=attr.Factory(list))
+    # List of the names of the Packages vendored in the codebase
+    vendored_package_names = attr.ib(default=attr.Factory(list))
+
+    @property
+    def codebase_sha1s(self):
+        return [f['sha1'] for f in self.codebase_files if f.get('sha1')]
+
+    def get_codebase(self):
+        """
+        Return a new VirtualCodebase of the codebase files, ready for matching.
+        """
+        return VirtualCodebase(
+            location=dict(files=[dict(f) for f in self.codebase_files]),
+            codebase_attributes=dict(
+                matches=attr.ib(default=attr.Factory(list))
+            ),
+            resource_attributes=dict(
+                matched_to=attr.ib(default=attr.Factory(list))
+            )
+        )
+
+
+def generate_sha1(rng):
+    """
+    Return a random SHA1 hex string from the `rng` Random.
+    """
+    return hashlib.sha1(rng.getrandbits(64).to_bytes(8, 'little')).hexdigest()
+
+
+def generate_files(rng, root, files_count, depth):
+    """
+    Return a list of the files and directories of a random tree of
+    `files_count` files under the `root` directory, nested at most `depth`
+    directories deep below `root`.
+    """
+    directories = [root]
+    directories_count = max(1, files_count // FILES_PER_DIRECTORY)
+    for index in range(directories_count):
+        parent = rng.choice(directories)
+        if parent.count('/') - root.count('/') >= depth:
+            parent = root
+        directories.append(f'{parent}/dir{index}')
+
+    files = [dict(path=path, type='directory') for path in directories]
+    for index in range(files_count):
+        directory = rng.choice(directories)
+        files.append(
+            dict(
+                path=f'{directory}/file{index}.c',
+                type='file',
+                size=rng.randint(1, 100000),
+                sha1=generate_sha1(rng),
+                is_archive=False,
+            )
+        )
+    return files
+
+
+def relocate_files(files, source_root, target_root):
+    """
+    Return a copy of the `files` list of files with their path `source_root`
+    prefix replaced by `target_root`.
+    """
+    relocated = []
+    for f in files:
+        f = dict(f)
+        f['path'] = target_root + f['path'][len(source_root):]
+        relocated.append(f)
+    return relocated
+
+
+def generate_corpus(
+    packages_count=10,
+    files_count=100,
+    depth=3,
+    overlap=0.5,
+    modified_ratio=0.5,
+    seed=42,
+):
+    """
+    Return a SyntheticCorpus of `packages_count` Packages of `files_count`
+    files nested at most `depth` directories deep, and a codebase of about
+    `files_count` times `packages_count` files.
+
+    About an `overlap` ratio of the codebase files are copies of whole
+    Packages vendored in the codebase. A `modified_ratio` of these copies have
+    one of their files modified so they are only approximate matches.
+    """
+    rng = random.Random(seed)
+    corpus = SyntheticCorpus()
+    for index in range(packages_count):
+        name = f'package{index}'
+        corpus.packages.append((name, generate_files(rng, name, files_count, depth)))
+
+    codebase_root = 'codebase'
+    codebase_files_count = files_count * packages_count
+    vendored_files_count = 0
+    vendored_files = []
+    for name, files in corpus.packages:
+        if vendored_files_count >= overlap * codebase_files_count:
+            break
+        copy = relocate_files(files, name, f'{codebase_root}/vendor/{name}')
+        if rng.random() < modified_ratio:
+            modified = rng.choice([f for f in copy if f['type'] == 'file'])
+            modified['sha1'] = generate_sha1(rng)
+        vendored_files.extend(copy)
+        vendored_files_count += files_count
+        corpus.vendored_package_names.append(name)
+
+    own_files_count = max(0, codebase_files_count - vendored_files_count)
+    own_files = generate_files(rng, f'{codebase_root}/src', own_files_count, depth)
+    corpus.codebase_files = (
+        [dict(path=codebase_root, type='directory')]
+        + ([dict(path=f'{codebase_root}/vendor', type='directory')] if vendored_files else [])
+        + vendored_files
+        + own_files
+    )
+    return corpus
+
+
+def seed_corpus(corpus):
+    """
+    Create the Packages and Resources of the `corpus` SyntheticCorpus in the
+    database and return the list of created Packages.
+    """
+    packages = []
+    for name, files in corpus.packages:
+        package = Package.objects.create(
+            type=BENCHMARK_PACKAGE_TYPE,
+            namespace=BENCHMARK_PACKAGE_NAMESPACE,
+            name=name,
+            version='1.0',
+            download_url=f'https://example.com/{BENCHMARK_PACKAGE_NAMESPACE}/{name}-1.0.tar.gz',
+            sha1=hashlib.sha1(name.encode('utf-8')).hexdigest(),
+        )
+        Resource.objects.bulk_create(
+            Resource(
+                package=package,
+                path=f['path'],
+                size=f.get('size'),
+                sha1=f.get('sha1'),
+                is_file=f['type'] == 'file',
+            )
+            for f in files
+        )
+        packages.append(package)
+    return packages
+
+
+def delete_package_indexes(packages):
+    """
+    Delete all the index rows of the `packages` list of Packages.
+    """
+    for package in packages:
+        ExactFilePackageSet.remove_package(package.id)
+    for index_class in (
+        ExactPackageArchiveIndex,
+        ExactFileIndex,
+        ApproximateDirectoryContentIndex,
+        ApproximateDirectoryStructureIndex,
+    ):
+        index_class.objects.filter(package__in=packages).delete()
+
+
+def get_directory_fingerprints(codebase, fingerprint_name):
+    """
+    Return a list of the `fingerprint_name` directory fingerprints of the
+    `codebase` VirtualCodebase with computed fingerprints.
+    """
+    return [
+        resource.extra_data[fingerprint_name]
+        for resource in codebase.walk()
+        if resource.is_dir and resource.extra_data.get(fingerprint_name)
+    ]
+
+
+@attr.s
+class Benchmark:
+    """
+    A benchmark case. `function` is called with the SyntheticCorpus, the
+    seeded Packages and the value returned by `setup` and returns the number
+    of processed items, such as files or fingerprints.
+    """
+    name = attr.ib()
+    group = attr.ib()
+    function = attr.ib()
+    # Optional function called with the SyntheticCorpus and the Packages
+    # before each round, outside of the timing
+    setup = attr.ib(default=None)
+
+
+def bench_fingerprinting(corpus, packages, codebase):
+    compute_directory_fingerprints(codebase)
+    return len(corpus.codebase_files)
+
+
+def bench_directory_indexing(corpus, packages, data):
+    for package in packages:
+        index_package_directories(package)
+    return len(packages)
+
+
+def bench_bulk_indexing(corpus, packages, data):
+    bulk_index_packages(packages)
+    return len(packages)
+
+
+def bench_exact_archive_matching(corpus, packages, data):
+    sha1s = [package.sha1 for package in packages]
+    ExactPackageArchiveIndex.match_many(sha1s)
+    return len(sha1s)
+
+
+def bench_exact_file_matching(corpus, packages, data):
+    sha1s = corpus.codebase_sha1s
+    ExactFileIndex.match_many(sha1s)
+    return len(sha1s)
+
+
+def bench_approximate_content_matching(corpus, packages, fingerprints):
+    for fingerprint in fingerprints:
+        ApproximateDirectoryContentIndex.match(fingerprint)
+    return len(fingerprints)
+
+
+def bench_approximate_structure_matching(corpus, packages, fingerprints):
+    for fingerprint in fingerprints:
+        ApproximateDirectoryStructureIndex.match(fingerprint)
+    return len(fingerprints)
+
+
+def bench_codebase_matching(corpus, packages, codebase):
+    match_codebase(codebase)
+    return len(corpus.codebase_files)
+
+
+def bench_api_batch_matching(corpus, packages, request_data):
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        response = Client().post(
+            reverse('api:match-list'),
+            data=request_data,
+            content_type='application/json',
+        )
+        for _ in response.streaming_content:
+            pass
+    return len(corpus.codebase_files)
+
+
+def setup_indexes(corpus, packages):
+    bulk_index_packages(packages)
+
+
+def setup_no_indexes(corpus, packages):
+    delete_package_indexes(packages)
+
+
+def setup_codebase(corpus, packages):
+    return corpus.get_codebase()
+
+
+def setup_fingerprinted_codebase(corpus, packages):
+    setup_indexes(corpus, packages)
+    return compute_directory_fingerprints(corpus.get_codebase())
+
+
+def setup_content_fingerprints(corpus, packages):
+    codebase = setup_fingerprinted_codebase(corpus, packages)
+    return get_directory_fingerprints(codebase, 'directory_content')
+
+
+def setup_structure_fingerprints(corpus, packages):
+    codebase = setup_fingerprinted_codebase(corpus, packages)
+    return get_directory_fingerprints(codebase, 'directory_structure')
+
+
+def setup_api_request(corpus, packages):
+    codebase = setup_fingerprinted_codebase(corpus, packages)
+    return dict(
+        archive_sha1s=[package.sha1 for package in packages],
+        file_sha1s=corpus.codebase_sha1s,
+        directory_content_fingerprints=get_directory_fingerprints(codebase, 'directory_content'),
+        directory_structure_fingerprints=get_directory_fingerprints(codebase, 'directory_structure'),
+    )
+
+
+BENCHMARKS = (
+    Benchmark('fingerprinting', 'fingerprinting', bench_fingerprinting, setup_codebase),
+    Benchmark('directory-indexing', 'indexing', bench_directory_indexing, setup_no_indexes),
+    Benchmark('bulk-indexing', 'indexing', bench_bulk_indexing, setup_no_indexes),
+    Benchmark('exact-archive-matching', 'matching', bench_exact_archive_matching, setup_indexes),
+    Benchmark('exact-file-matching', 'matching', bench_exact_file_matching, setup_indexes),
+    Benchmark('approximate-content-matching', 'matching', bench_approximate_content_matching, setup_content_fingerprints),
+    Benchmark('approximate-structure-matching', 'matching', bench_approximate_structure_matching, setup_structure_fingerprints),
+    Benchmark('codebase-matching', 'matching', bench_codebase_matching, setup_fingerprinted_codebase),
+    Benchmark('api-batch-matching', 'api', bench_api_batch_matching, setup_api_request),
+)
+
+
+# Name of the benchmark of the directory matching thresholds, run on a sample
+# of the indexed directory fingerprints rather than on the corpus codebase
+THRESHOLDS_BENCHMARK = 'directory-thresholds'
+
+DEFAULT_THRESHOLDS = list(range(0, MAX_THRESHOLD + 1, 2))
+
+DIRECTORY_INDEX_CLASSES = {
+    'content': ApproximateDirectoryContentIndex,
+    'structure': ApproximateDirectoryStructureIndex,
+}
+
+
+def flip_random_bits(directory_fingerprint, bits_count, rng):
+    """
+    Return a new directory fingerprint string from `directory_fingerprint` with
+    `bits_count` random bits of its bah128 part flipped using the `rng` Random.
+    """
+    indexed_elements_count_hash = directory_fingerprint[:8]
+    bah128 = int(directory_fingerprint[8:], 16)
+    for position in rng.sample(range(128), bits_count):
+        bah128 ^= 1 << position
+    return indexed_elements_count_hash + '%032x' % bah128
+
+
+def benchmark_threshold(index_class, fingerprints, threshold):
+    """
+    Return a mapping of statistics from matching the `fingerprints` list of
+    directory fingerprints against `index_class` using `threshold`.
+    """
+    candidates_count = 0
+    matches_count = 0
+    start = time.perf_counter()
+    for fingerprint in fingerprints:
+        candidates_count += index_class.get_candidates(fingerprint, threshold=threshold).count()
+    candidates_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for fingerprint in fingerprints:
+        matches_count += len(index_class.match(fingerprint, threshold=threshold))
+    match_duration = time.perf_counter() - start
+
+    fingerprints_count = len(fingerprints) or 1
+    return dict(
+        threshold=threshold,
+        avg_candidates=candidates_count / fingerprints_count,
+        avg_matches=matches_count / fingerprints_count,
+        avg_candidates_ms=candidates_duration * 1000 / fingerprints_count,
+        avg_match_ms=match_duration * 1000 / fingerprints_count,
+    )
+
+
+def run_threshold_benchmark(
+    corpus,
+    packages,
+    index_name='content',
+    thresholds=DEFAULT_THRESHOLDS,
+    sample_size=100,
+    flip_bits=0,
+    seed=42,
+):
+    """
+    Return a mapping of the candidate set size and latency of directory
+    fingerprint matching for each of the `thresholds` Hamming distance
+    thresholds, once the `corpus` SyntheticCorpus seeded as `packages` is
+    indexed.
+
+    The queries are a sample of `sample_size` fingerprints of the
+    `index_name` directory index, with `flip_bits` random bits flipped.
+    """
+    index_class = DIRECTORY_INDEX_CLASSES[index_name]
+    rng = random.Random(seed)
+    with override_settings(MATCHCODE_BLOOM_FILTER_DIR='', MATCHCODE_MATCH_CACHE_SIZE=0):
+        setup_indexes(corpus, packages)
+
+        pks = list(index_class.objects.values_list('pk', flat=True))
+        sample_pks = rng.sample(pks, min(sample_size, len(pks)))
+        fingerprints = [
+            index.fingerprint()
+            for index in index_class.objects.filter(pk__in=sample_pks)
+        ]
+        if flip_bits:
+            fingerprints = [
+                flip_random_bits(fingerprint, flip_bits, rng)
+                for fingerprint in fingerprints
+            ]
+
+        return dict(
+            name=THRESHOLDS_BENCHMARK,
+            index=index_class.__name__,
+            indexed_fingerprints=len(pks),
+            queries=len(fingerprints),
+            flip_bits=flip_bits,
+            thresholds=[
+                benchmark_threshold(index_class, fingerprints, threshold)
+                for threshold in thresholds
+            ],
+        )
+
+
+def get_stats(durations, items_count):
+    """
+    Return a mapping of timing statistics of the `durations` list of durations
+    in seconds of each round of a benchmark that processed `items_count`
+    items per round.
+    """
+    mean = statistics.mean(durations)
+    return dict(
+        rounds=len(durations),
+        min=min(durations),
+        max=max(durations),
+        mean=mean,
+        median=statistics.median(durations),
+        stddev=statistics.stdev(durations) if len(durations) > 1 else 0.0,
+        items=items_count,
+        items_per_second=items_count / mean if mean else None,
+    )
+
+
+def run_benchmark(benchmark, corpus, packages, rounds=5):
+    """
+    Return a mapping of the results of running the `benchmark` Benchmark
+    `rounds` times on the `corpus` SyntheticCorpus seeded as `packages`.
+    """
+    durations = []
+    items_count = 0
+    for _ in range(rounds):
+        data = benchmark.setup(corpus, packages) if benchmark.setup else None
+        start = time.perf_counter()
+        items_count = benchmark.function(corpus, packages, data)
+        durations.append(time.perf_counter() - start)
+    return dict(
+        name=benchmark.name,
+        group=benchmark.group,
+        stats=get_stats(durations, items_count),
+    )
+
+
+def run_benchmarks(corpus, packages, names=None, rounds=5):
+    """
+    Return a list of the results of the BENCHMARKS with a name in `names` or
+    of all the BENCHMARKS, run on the `corpus` SyntheticCorpus seeded as
+    `packages`.
+
+    The benchmarks run without the SHA1 Bloom filters and the match cache:
+    these are shared with the other processes and are not rolled back with
+    the database, such that the SHA1s and matches of the corpus would stay in
+    them after a run.
+    """
+    with override_settings(MATCHCODE_BLOOM_FILTER_DIR='', MATCHCODE_MATCH_CACHE_SIZE=0):
+        return [
+            run_benchmark(benchmark, corpus, packages, rounds=rounds)
+            for benchmark in BENCHMARKS
+            if not names or benchmark.name in names
+        ]
+
+
+def get_benchmark_results(benchmarks, params, threshold_benchmark=None):
+    """
+    Return a JSON-serializable mapping of the `benchmarks` results and of the
+    `threshold_benchmark` results if any, with the `params` corpus parameters
+    and information about the machine.
+    """
+    results = dict(
+        version=BENCHMARK_RESULTS_VERSION,
+        datetime=datetime.now(timezone.utc).isoformat(),
+        machine_info=dict(
+            node=platform.node(),
+            machine=platform.machine(),
+            system=platform.system(),
+            python_version=platform.python_version(),
+            cpu_count=os.cpu_count(),
+        ),
+        params=params,
+        benchmarks=benchmarks,
+    )
+    if threshold_benchmark:
+        results[THRESHOLDS_BENCHMARK] = threshold_benchmark
+    return results
+
+
+def compare_benchmark_results(previous, current):
+    """
+    Return a list of (benchmark name, previous mean, current mean, ratio) for
+    the benchmarks of the `current` results that are also in the `previous`
+    results. A ratio above 1 is a slowdown.
+    """
+    previous_means = {
+        benchmark['name']: benchmark['stats']['mean']
+        for benchmark in previous.get('benchmarks', [])
+    }
+    comparisons = []
+    for benchmark in current['benchmarks']:
+        name = benchmark['name']
+        if name not in previous_means:
+            continue
+        previous_mean = previous_means[name]
+        current_mean = benchmark['stats']['mean']
+        ratio = current_mean / previous_mean if previous_mean else None
+        comparisons.append((name, previous_mean, current_mean, ratio))
+    return comparisons
+
+
+def load_benchmark_results(location):
+    with open(location) as results_file:
+        return json.load(results_file)
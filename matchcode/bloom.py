@@ -0,0 +1,282 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+"""
+Persistent Bloom filters of the SHA1s of the exact file indexes.
+
+Most SHA1 lookups are for files that are not indexed. A Bloom filter answers
+"certainly not indexed" for these without any database query, using about 10
+bits per indexed SHA1 for a 1% false positive rate.
+
+SHA1s are uniformly distributed so the bit positions of a SHA1 are derived
+directly from its bytes with double hashing rather than hashing it again.
+
+A Bloom filter file is memory-mapped and shared by all the processes of a host.
+It covers the index rows up to the largest row id recorded in its header when
+it was built. SHA1s indexed later are added to the loaded filter by the
+processes that index them, but these additions are best effort: SHA1s that
+the filter reports as absent must still be looked up in the rows indexed after
+the filter was built.
+"""
+
+import math
+import os
+import struct
+
+from django.conf import settings
+import numpy
+
+from matchcode_toolkit.fingerprinting import hexstring_to_binarray
+
+
+BLOOM_FILTER_MAGIC = b'MCBLOOM\x00'
+BLOOM_FILTER_VERSION = 1
+
+# magic, version, hashes count, bits count, items count, max index row id
+BLOOM_FILTER_HEADER = struct.Struct('<8sIIQQQ')
+ITEMS_COUNT_OFFSET = 24
+
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+# Number of rows fetched at once from the database when building a filter
+BLOOM_FILTER_BUILD_CHUNK_SIZE = 100000
+
+
+class Sha1BloomFilter:
+    """
+    A Bloom filter of SHA1s stored in a numpy array of bytes, possibly
+    memory-mapped from a Bloom filter file.
+    """
+
+    def __init__(self, data, hashes_count, bits_count, max_index_id=0):
+        # `data` is the whole Bloom filter file content, header included
+        self.data = data
+        self.bits = data[BLOOM_FILTER_HEADER.size:]
+        self.hashes_count = hashes_count
+        self.bits_count = bits_count
+        self.max_index_id = max_index_id
+
+    @classmethod
+    def create(cls, capacity, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE, max_index_id=0):
+        """
+        Return a new empty in-memory Sha1BloomFilter sized for `capacity` SHA1s
+        at a `false_positive_rate`.
+        """
+        hashes_count, bits_count = get_bloom_filter_size(capacity, false_positive_rate)
+        data = numpy.zeros(BLOOM_FILTER_HEADER.size + bits_count // 8, dtype=numpy.uint8)
+        header = BLOOM_FILTER_HEADER.pack(
+            BLOOM_FILTER_MAGIC,
+            BLOOM_FILTER_VERSION,
+            hashes_count,
+            bits_count,
+            0,
+            max_index_id,
+        )
+        data[:BLOOM_FILTER_HEADER.size] = numpy.frombuffer(header, dtype=numpy.uint8)
+        return cls(data, hashes_count, bits_count, max_index_id=max_index_id)
+
+    @classmethod
+    def load(cls, location, writable=False):
+        """
+        Return a Sha1BloomFilter memory-mapped from the file at `location`. If
+        `writable` is True, SHA1s added to the filter are written to the file.
+        """
+        with open(location, 'rb') as bloom_file:
+            header = bloom_file.read(BLOOM_FILTER_HEADER.size)
+        magic, version, hashes_count, bits_count, _, max_index_id = BLOOM_FILTER_HEADER.unpack(header)
+        if magic != BLOOM_FILTER_MAGIC or version != BLOOM_FILTER_VERSION:
+            raise ValueError(f'Invalid SHA1 Bloom filter file: {location}')
+
+        data = numpy.memmap(location, dtype=numpy.uint8, mode='r+' if writable else 'r')
+        return cls(data, hashes_count, bits_count, max_index_id=max_index_id)
+
+    def save(self, location):
+        """
+        Save this Bloom filter to a file at `location`, replacing atomically any
+        existing file.
+        """
+        temp_location = f'{location}.tmp'
+        with open(temp_location, 'wb') as bloom_file:
+            bloom_file.write(self.data.tobytes())
+        os.replace(temp_location, location)
+
+    @property
+    def items_count(self):
+        """
+        Return the approximate number of SHA1s added to this filter.
+        """
+        return int(self.data[ITEMS_COUNT_OFFSET:ITEMS_COUNT_OFFSET + 8].view('<u8')[0])
+
+    def _get_bit_positions(self, sha1s):
+        """
+        Return a 2-dimensional array of the bit positions of each of the
+        `sha1s` list of SHA1 bytes.
+        """
+        digests = numpy.frombuffer(b''.join(sha1s), dtype=numpy.uint8).reshape(-1, 20)
+        h1 = digests[:, 0:8].copy().view('<u8').ravel()
+        h2 = digests[:, 8:16].copy().view('<u8').ravel() | numpy.uint64(1)
+        hashes = numpy.arange(self.hashes_count, dtype=numpy.uint64)
+        with numpy.errstate(over='ignore'):
+            positions = h1[:, None] + hashes[None, :] * h2[:, None]
+        # The bits count is a power of two
+        return positions & numpy.uint64(self.bits_count - 1)
+
+    def add_many(self, sha1s):
+        """
+        Add the `sha1s` list of SHA1 bytes to this filter.
+        """
+        sha1s = [bytes(sha1) for sha1 in sha1s if sha1]
+        if not sha1s:
+            return
+        positions = self._get_bit_positions(sha1s).ravel()
+        bytes_positions = (positions >> numpy.uint64(3)).astype(numpy.int64)
+        masks = numpy.left_shift(1, (positions & numpy.uint64(7)).astype(numpy.uint8))
+        numpy.bitwise_or.at(self.bits, bytes_positions, masks.astype(numpy.uint8))
+
+        items_count = self.data[ITEMS_COUNT_OFFSET:ITEMS_COUNT_OFFSET + 8].view('<u8')
+        items_count[0] += len(sha1s)
+
+    def contains_many(self, sha1s):
+        """
+        Return a set of the SHA1 hex strings of `sha1s` that may be in this
+        filter. The SHA1s that are not returned are certainly not in this
+        filter.
+        """
+        sha1s = [sha1 for sha1 in set(sha1s) if sha1]
+        if not sha1s:
+            return set()
+        positions = self._get_bit_positions([hexstring_to_binarray(sha1) for sha1 in sha1s])
+        bytes_positions = (positions >> numpy.uint64(3)).astype(numpy.int64)
+        masks = numpy.left_shift(1, (positions & numpy.uint64(7)).astype(numpy.uint8))
+        present = (self.bits[bytes_positions] & masks.astype(numpy.uint8)) != 0
+        return {sha1 for sha1, found in zip(sha1s, present.all(axis=1).tolist()) if found}
+
+    def __contains__(self, sha1):
+        return bool(self.contains_many([sha1]))
+
+    def get_stats(self):
+        """
+        Return a mapping of statistics about this filter size and its false
+        positive rate.
+        """
+        items_count = self.items_count
+        set_bits_count = int(numpy.unpackbits(self.bits).sum(dtype=numpy.int64))
+        fill_ratio = set_bits_count / self.bits_count
+        expected_rate = (
+            1 - math.exp(-self.hashes_count * items_count / self.bits_count)
+        ) ** self.hashes_count
+        return dict(
+            items_count=items_count,
+            max_index_id=self.max_index_id,
+            hashes_count=self.hashes_count,
+            bits_count=self.bits_count,
+            size_bytes=len(self.bits),
+            bits_per_item=self.bits_count / items_count if items_count else None,
+            fill_ratio=fill_ratio,
+            # The actual false positive rate given the bits set
+            false_positive_rate=fill_ratio ** self.hashes_count,
+            expected_false_positive_rate=expected_rate,
+        )
+
+
+def get_bloom_filter_size(capacity, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    """
+    Return a tuple of (hashes count, bits count) for a Bloom filter of
+    `capacity` items with a `false_positive_rate`. The bits count is rounded
+    up to a power of two of at least 64 bits.
+
+    For example:
+    >>> get_bloom_filter_size(1000, 0.01)
+    (7, 16384)
+    >>> get_bloom_filter_size(0)
+    (7, 64)
+    """
+    capacity = max(capacity, 1)
+    optimal_bits_count = -capacity * math.log(false_positive_rate) / (math.log(2) ** 2)
+    bits_count = max(64, 1 << math.ceil(math.log2(optimal_bits_count)))
+    hashes_count = max(1, round(optimal_bits_count / capacity * math.log(2)))
+    return hashes_count, bits_count
+
+
+def get_bloom_filter_location(index_class, directory=None):
+    """
+    Return the location of the Bloom filter file of the `index_class`
+    BaseFileIndex model in `directory` or in the MATCHCODE_BLOOM_FILTER_DIR
+    setting directory. Return None if there is no Bloom filter directory.
+    """
+    directory = directory or settings.MATCHCODE_BLOOM_FILTER_DIR
+    if not directory:
+        return
+    return os.path.join(directory, f'{index_class.__name__.lower()}.bloom')
+
+
+# Mapping of {Bloom filter location: (modification time, Sha1BloomFilter)} of
+# the Bloom filters loaded in this process
+_bloom_filters_cache = {}
+
+
+def get_bloom_filter(index_class):
+    """
+    Return the current Sha1BloomFilter of the `index_class` BaseFileIndex model
+    or None if there is no Bloom filter. A Bloom filter is loaded once per
+    process and reloaded when its file is replaced.
+    """
+    location = get_bloom_filter_location(index_class)
+    if not location:
+        return
+
+    try:
+        mtime = os.stat(location).st_mtime_ns
+    except FileNotFoundError:
+        return
+
+    cached = _bloom_filters_cache.get(location)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    bloom_filter = Sha1BloomFilter.load(location, writable=os.access(location, os.W_OK))
+    _bloom_filters_cache[location] = mtime, bloom_filter
+    return bloom_filter
+
+
+def build_bloom_filter(
+    index_class,
+    location,
+    false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE,
+    growth_factor=2,
+    chunk_size=BLOOM_FILTER_BUILD_CHUNK_SIZE,
+):
+    """
+    Build and save a Bloom filter file at `location` of the SHA1s of all the
+    rows of the `index_class` BaseFileIndex model. The filter is sized for
+    `growth_factor` times the current number of rows at a
+    `false_positive_rate`.
+
+    Return the new Sha1BloomFilter.
+    """
+    # Rows inserted while the filter is built are not covered
+    max_index_id = index_class.get_max_committed_id()
+    rows = index_class.objects.filter(pk__lte=max_index_id)
+    capacity = int(rows.count() * growth_factor)
+    bloom_filter = Sha1BloomFilter.create(
+        capacity=capacity,
+        false_positive_rate=false_positive_rate,
+        max_index_id=max_index_id,
+    )
+
+    sha1s = []
+    for sha1 in rows.values_list('sha1', flat=True).iterator(chunk_size=chunk_size):
+        sha1s.append(sha1)
+        if len(sha1s) >= chunk_size:
+            bloom_filter.add_many(sha1s)
+            sha1s = []
+    bloom_filter.add_many(sha1s)
+
+    bloom_filter.save(location)
+    return Sha1BloomFilter.load(location)
@@ -0,0 +1,223 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+"""
+A cache of the match results of the matchcode indexes.
+
+The same fingerprints, such as the ones of popular library directories or of
+common files, are matched over and over by different scans. Their matches are
+cached in a bounded in-process LRU cache and optionally in a shared Django
+cache backend.
+
+Cached matches are invalidated using a generation counter of each index,
+stored in the database and incremented whenever rows are added to or removed
+from an index. The generations are read from the database at most once every
+MATCHCODE_MATCH_CACHE_GENERATION_TTL seconds.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class MatchCache:
+    """
+    A cache of the matches of an index for a fingerprint and a threshold.
+    """
+
+    def __init__(
+        self,
+        max_size,
+        get_generations,
+        shared_cache=None,
+        timeout=None,
+        generation_ttl=0,
+    ):
+        self.max_size = max_size
+        # Callable returning a mapping of {index name: generation}
+        self.get_generations = get_generations
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self.generation_ttl = generation_ttl
+
+        # Mapping of {(index name, fingerprint, threshold): (generation, matches)}
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.generations_expiration = 0
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_generation(self, index_name):
+        """
+        Return the current generation of the index with `index_name`.
+        """
+        now = time.monotonic()
+        if now >= self.generations_expiration:
+            self.generations = self.get_generations()
+            self.generations_expiration = now + self.generation_ttl
+        return self.generations.get(index_name, 0)
+
+    def expire_generations(self):
+        """
+        Read again the index generations on the next cache access.
+        """
+        self.generations_expiration = 0
+
+    def get_or_match(self, index_name, fingerprint, threshold, match_function):
+        """
+        Return a list of the cached matches of the index with `index_name` for
+        `fingerprint` and `threshold`. On a cache miss, the matches are
+        computed by calling `match_function` and are cached.
+        """
+        matches_by_fingerprint = self.get_or_match_many(
+            index_name=index_name,
+            fingerprints=[fingerprint],
+            threshold=threshold,
+            match_many_function=lambda fingerprints: {fingerprint: list(match_function())},
+        )
+        return matches_by_fingerprint[fingerprint]
+
+    def get_or_match_many(self, index_name, fingerprints, threshold, match_many_function):
+        """
+        Return a mapping of {fingerprint: cached matches} of the index with
+        `index_name` for each of the `fingerprints` and `threshold`.
+
+        The fingerprints that are not cached are matched together by calling
+        `match_many_function` with the list of these fingerprints. It returns
+        a mapping of {fingerprint: matches} and the fingerprints missing from
+        this mapping have no matches. These matches are cached.
+        """
+        generation = self.get_generation(index_name)
+        matches_by_fingerprint = {}
+        missing = []
+
+        with self.lock:
+            for fingerprint in fingerprints:
+                key = index_name, fingerprint, threshold
+                entry = self.entries.get(key)
+                if entry and entry[0] == generation:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    matches_by_fingerprint[fingerprint] = entry[1]
+                else:
+                    missing.append(fingerprint)
+
+        if not missing:
+            return matches_by_fingerprint
+
+        new_matches = {}
+        shared_keys = {}
+        if self.shared_cache is not None:
+            shared_keys = {
+                f'matchcode:{index_name}:{generation}:{threshold}:{fingerprint}': fingerprint
+                for fingerprint in missing
+            }
+            shared_matches = self.shared_cache.get_many(list(shared_keys))
+            for shared_key, matches in shared_matches.items():
+                new_matches[shared_keys[shared_key]] = matches
+            shared_hits = len(new_matches)
+            missing = [fingerprint for fingerprint in missing if fingerprint not in new_matches]
+        else:
+            shared_hits = 0
+
+        if missing:
+            matched = match_many_function(missing)
+            computed_matches = {
+                fingerprint: matched.get(fingerprint, [])
+                for fingerprint in missing
+            }
+            new_matches.update(computed_matches)
+            if self.shared_cache is not None:
+                shared_keys_by_fingerprint = {
+                    fingerprint: shared_key
+                    for shared_key, fingerprint in shared_keys.items()
+                }
+                self.shared_cache.set_many(
+                    {
+                        shared_keys_by_fingerprint[fingerprint]: matches
+                        for fingerprint, matches in computed_matches.items()
+                    },
+                    self.timeout,
+                )
+
+        with self.lock:
+            self.shared_hits += shared_hits
+            self.misses += len(missing)
+            for fingerprint, matches in new_matches.items():
+                key = index_name, fingerprint, threshold
+                self.entries[key] = generation, matches
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        matches_by_fingerprint.update(new_matches)
+        return matches_by_fingerprint
+
+    def clear(self):
+        """
+        Remove all the in-process cached matches and reset the statistics.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get_stats(self):
+        """
+        Return a mapping of statistics about the hits and misses of this cache.
+        """
+        lookups = self.hits + self.shared_hits + self.misses
+        return dict(
+            size=len(self.entries),
+            max_size=self.max_size,
+            hits=self.hits,
+            shared_hits=self.shared_hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_ratio=(self.hits + self.shared_hits) / lookups if lookups else None,
+        )
+
+
+# The MatchCache of this process, created on first use
+_match_cache = None
+
+
+def get_match_cache():
+    """
+    Return the MatchCache of this process configured from the settings or None
+    if match results are not cached.
+    """
+    global _match_cache
+
+    max_size = settings.MATCHCODE_MATCH_CACHE_SIZE
+    if not max_size:
+        return
+
+    if _match_cache is None or _match_cache.max_size != max_size:
+        from matchcode.models import IndexGeneration
+
+        backend = settings.MATCHCODE_MATCH_CACHE_BACKEND
+        _match_cache = MatchCache(
+            max_size=max_size,
+            get_generations=IndexGeneration.get_generations,
+            shared_cache=caches[backend] if backend else None,
+            timeout=settings.MATCHCODE_MATCH_CACHE_TIMEOUT,
+            generation_ttl=settings.MATCHCODE_MATCH_CACHE_GENERATION_TTL,
+        )
+    return _match_cache
@@ -0,0 +1,109 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+"""
+Multi-index hashing for the Hamming space search of directory fingerprints.
+
+A 128-bit directory fingerprint is stored as four 32-bit chunks that are each
+indexed separately. By the pigeonhole principle, when two fingerprints are
+within a Hamming distance of `threshold`, at least one of their chunks must be
+within a much smaller distance. We find all candidates by looking up the
+exact chunk values within that smaller radius of each chunk of the query
+fingerprint, and then only compute the full Hamming distance on these
+candidates.
+
+See "Fast Exact Search in Hamming Space with Multi-Index Hashing" by Norouzi,
+Punjani and Fleet.
+"""
+
+from itertools import combinations
+
+
+# Default maximum Hamming distance of a directory fingerprint match
+DEFAULT_THRESHOLD = 7
+
+# Maximum supported Hamming distance of a directory fingerprint match. Beyond
+# this, the number of chunk values to lookup grows too much to be practical.
+MAX_THRESHOLD = 16
+
+
+def get_chunk_search_radii(threshold, chunks_count=4):
+    """
+    Return a list of `chunks_count` search radii, one for each chunk of a
+    fingerprint, such that any fingerprint within a Hamming distance of
+    `threshold` has at least one chunk within the radius of that chunk.
+
+    A radius of -1 means that the chunk does not need to be looked up.
+
+    With `threshold = chunks_count * q + a`, the first `a + 1` chunks are
+    searched with a radius of `q` and the remaining chunks with a radius of
+    `q - 1`: otherwise the distance would be at least `threshold + 1`.
+
+    For example:
+    >>> get_chunk_search_radii(0)
+    [0, -1, -1, -1]
+    >>> get_chunk_search_radii(3)
+    [0, 0, 0, 0]
+    >>> get_chunk_search_radii(7)
+    [1, 1, 1, 1]
+    >>> get_chunk_search_radii(8)
+    [2, 1, 1, 1]
+    >>> get_chunk_search_radii(16)
+    [4, 3, 3, 3]
+    """
+    if threshold < 0:
+        raise ValueError(f'Invalid negative threshold: {threshold}')
+    q, a = divmod(threshold, chunks_count)
+    return [q if i <= a else q - 1 for i in range(chunks_count)]
+
+
+def get_chunk_neighbors(chunk, radius):
+    """
+    Yield all the byte strings within a Hamming distance of `radius` of the
+    `chunk` byte string, starting with `chunk` itself.
+
+    For example:
+    >>> list(get_chunk_neighbors(b'\\x00', 0))
+    [b'\\x00']
+    >>> neighbors = list(get_chunk_neighbors(b'\\x00', 1))
+    >>> len(neighbors)
+    9
+    >>> neighbors[:3]
+    [b'\\x00', b'\\x01', b'\\x02']
+    >>> len(list(get_chunk_neighbors(b'\\x00\\x00\\x00\\x00', 2)))
+    529
+    """
+    size = len(chunk)
+    value = int.from_bytes(chunk, 'big')
+    bit_positions = range(size * 8)
+    for distance in range(radius + 1):
+        for positions in combinations(bit_positions, distance):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            yield (value ^ mask).to_bytes(size, 'big')
+
+
+def get_bigint_halves(bah128):
+    """
+    Return a tuple of two signed 64-bit integers from the high and low halves
+    of the `bah128` hex string of a 128-bit fingerprint, suitable to store in
+    PostgreSQL bigint columns.
+
+    For example:
+    >>> get_bigint_halves('00000000000000010000000000000002')
+    (1, 2)
+    >>> get_bigint_halves('ffffffffffffffff8000000000000000')
+    (-1, -9223372036854775808)
+    """
+    halves = int(bah128[:16], 16), int(bah128[16:32], 16)
+    return tuple(
+        half - (1 << 64) if half >= (1 << 63) else half
+        for half in halves
+    )
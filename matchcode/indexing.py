@@ -7,17 +7,39 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+from collections import defaultdict
 import logging
 import os
 import sys
+import time
 
 from commoncode.resource import VirtualCodebase
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.db import transaction
+from django.db.models import CharField
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.db.models.functions import MD5
+from django.utils import timezone
 
+from minecode.management.commands import get_error_message
 from matchcode_toolkit.fingerprinting import compute_directory_fingerprints
+from matchcode_toolkit.fingerprinting import DirectoryColumns
+from matchcode_toolkit.fingerprinting import get_parent_paths
+from matchcode_toolkit.fingerprinting import hexstring_to_binarray
+from matchcode_toolkit.fingerprinting import update_directory_columns
 from matchcode.models import ApproximateDirectoryContentIndex
 from matchcode.models import ApproximateDirectoryStructureIndex
+from matchcode.models import BaseFileIndex
+from matchcode.models import DirectoryColumnSums
 from matchcode.models import ExactPackageArchiveIndex
 from matchcode.models import ExactFileIndex
+from matchcode.models import ExactFilePackageSet
+from matchcode.models import ExactGitBlobIndex
+from matchcode.models import IndexGeneration
+from packagedb.models import Package
+from packagedb.models import Resource
 
 
 TRACE = False
@@ -27,6 +49,13 @@ logging.basicConfig(stream=sys.stdout)
 logger.setLevel(logging.INFO)
 
 
+# Number of index rows inserted at once when indexing in bulk
+BULK_INDEX_BATCH_SIZE = 10000
+
+# Key of the indexing stats of the directories fingerprints computation
+DIRECTORY_FINGERPRINTS_STATS = 'DirectoryFingerprints'
+
+
 def index_package_archives(package):
     """
     Index Package archives for matching
@@ -55,16 +84,34 @@ def index_package_file(resource):
     return created_exact_file_index
 
 
-def _create_virtual_codebase_from_package_resources(package):
+def index_package_git_blob(resource):
     """
-    Return a VirtualCodebase from the resources of `package`
+    Index the git blob SHA1 of a Package file for matching
+
+    Return True if an ExactGitBlobIndex has been created, otherwise return
+    False
+    """
+    if not resource.git_sha1:
+        return False
+    _, created = ExactGitBlobIndex.index(
+        sha1=resource.git_sha1,
+        package=resource.package
+    )
+    return created
+
+
+def get_package_codebase_files(package):
+    """
+    Return a list of mappings of ScanCode-like fields of the Resources of
+    `package`, such as found in a scan. If the Resources do not share a single
+    root directory, their paths are prefixed with a new root directory.
     """
     # Create something that looks like a scancode scan so we can import it into a VirtualCodebase
     # TODO: Evolve this into something more elaborate, e.g.
     #       Codebase class methods can manipulate Resource table entries
     package_resources = package.resources.order_by('path')
     if not package_resources:
-        return
+        return []
 
     files = []
     for resource in package_resources:
@@ -93,6 +140,17 @@ def _create_virtual_codebase_from_package_resources(package):
             new_path = os.path.join(new_root, f.get('path', ''))
             f['path'] = new_path
 
+    return files
+
+
+def _create_virtual_codebase_from_package_resources(package):
+    """
+    Return a VirtualCodebase from the resources of `package`
+    """
+    files = get_package_codebase_files(package)
+    if not files:
+        return
+
     # Create VirtualCodebase
     mock_scan = dict(files=files)
     return VirtualCodebase(location=mock_scan)
@@ -151,4 +209,452 @@ def index_package_directories(package):
         return 0, 0
 
     vc = compute_directory_fingerprints(vc)
-    return index_directory_fingerprints(vc, package)
+    with IndexGeneration.bump_once():
+        return index_directory_fingerprints(vc, package)
+
+
+def bulk_index_packages(packages, batch_size=BULK_INDEX_BATCH_SIZE):
+    """
+    Index the archives, files and directories of the `packages` list of
+    Packages for matching using bulk inserts of `batch_size` rows. Index rows
+    that already exist are skipped.
+
+    Return a mapping of {index name: [submitted rows count, duration in seconds]}
+    """
+    stats = defaultdict(lambda: [0, 0.0])
+    with IndexGeneration.bump_once():
+        _bulk_index_package_archives(packages, batch_size, stats)
+        _bulk_index_package_files(packages, batch_size, stats)
+        _bulk_index_package_git_blobs(packages, batch_size, stats)
+        failed_package_ids = _bulk_index_package_directories(packages, batch_size, stats)
+
+    resources_digests = get_resources_digests(packages)
+    indexed_date = timezone.now()
+    indexed_packages = []
+    for package in packages:
+        if package.id in failed_package_ids:
+            continue
+        package.last_indexed_date = indexed_date
+        package.indexed_resources_digest = resources_digests.get(package.id)
+        package.index_error = None
+        indexed_packages.append(package)
+    Package.objects.bulk_update(
+        indexed_packages,
+        fields=['last_indexed_date', 'indexed_resources_digest', 'index_error'],
+        batch_size=batch_size,
+    )
+    return dict(stats)
+
+
+def incremental_index_packages(packages, batch_size=BULK_INDEX_BATCH_SIZE):
+    """
+    Update the index rows of the `packages` list of Packages that have been
+    created or modified since they were last indexed.
+
+    The archive index of each Package is always updated. The file and
+    directory indexes of a Package are only rebuilt when its Resources have
+    changed since the last indexing, as tracked by the
+    `Package.indexed_resources_digest`. If the directory column sums are
+    persisted, only the directories that contain a changed file are
+    fingerprinted again.
+
+    Each Package is indexed in its own transaction that also updates its
+    `last_indexed_date`.
+
+    Return a mapping of {index name: [submitted rows count, duration in seconds]}
+    """
+    stats = defaultdict(lambda: [0, 0.0])
+    resources_digests = get_resources_digests(packages)
+    with IndexGeneration.bump_once():
+        for package in packages:
+            resources_digest = resources_digests.get(package.id)
+            resources_changed = resources_digest != package.indexed_resources_digest
+            with transaction.atomic():
+                ExactPackageArchiveIndex.objects.filter(package=package).delete()
+                IndexGeneration.bump(ExactPackageArchiveIndex)
+                _bulk_index_package_archives([package], batch_size, stats)
+
+                failed_package_ids = set()
+                if resources_changed:
+                    ExactFilePackageSet.remove_package(package.id)
+                    ExactFileIndex.objects.filter(package=package).delete()
+                    ExactGitBlobIndex.objects.filter(package=package).delete()
+                    # Cached matches are invalidated even if no rows are indexed again
+                    IndexGeneration.bump(ExactFileIndex)
+                    IndexGeneration.bump(ExactGitBlobIndex)
+                    _bulk_index_package_files([package], batch_size, stats)
+                    _bulk_index_package_git_blobs([package], batch_size, stats)
+
+                    updated = (
+                        settings.MATCHCODE_DIRECTORY_COLUMN_SUMS
+                        and _update_package_directories(package, batch_size, stats)
+                    )
+                    if not updated:
+                        ApproximateDirectoryContentIndex.objects.filter(package=package).delete()
+                        ApproximateDirectoryStructureIndex.objects.filter(package=package).delete()
+                        IndexGeneration.bump(ApproximateDirectoryContentIndex)
+                        IndexGeneration.bump(ApproximateDirectoryStructureIndex)
+                        failed_package_ids = _bulk_index_package_directories([package], batch_size, stats)
+
+                if package.id in failed_package_ids:
+                    # Keep the previous digest so the directories are fingerprinted
+                    # again once the Package is modified
+                    Package.objects.filter(pk=package.pk).update(
+                        last_indexed_date=timezone.now(),
+                    )
+                else:
+                    Package.objects.filter(pk=package.pk).update(
+                        last_indexed_date=timezone.now(),
+                        indexed_resources_digest=resources_digest,
+                        index_error=None,
+                    )
+    return dict(stats)
+
+
+def get_resources_digests(packages):
+    """
+    Return a mapping of {package id: digest} of the digests of the Resources of
+    each Package of the `packages` list. The digest is computed from the path,
+    SHA1 and size of all the Resources of a Package and changes whenever a
+    Resource is added, removed or modified. Packages without Resources are not
+    in the mapping.
+    """
+    resource_fields = Concat(
+        'path', Value('\t'), 'sha1', Value('\t'), 'size',
+        output_field=CharField(),
+    )
+    digests = (
+        Resource.objects
+        .filter(package__in=packages)
+        .values('package_id')
+        .annotate(digest=MD5(StringAgg(resource_fields, delimiter='\n', ordering='path')))
+        .values_list('package_id', 'digest')
+    )
+    return dict(digests)
+
+
+def _bulk_index_package_archives(packages, batch_size, stats):
+    """
+    Index the archive SHA1 of the `packages` list of Packages.
+    """
+    start = time.time()
+    package_archive_indexes = [
+        ExactPackageArchiveIndex(sha1=hexstring_to_binarray(package.sha1), package=package)
+        for package in packages
+        if package.sha1
+    ]
+    _bulk_create(ExactPackageArchiveIndex, package_archive_indexes, batch_size, stats, start)
+    ExactPackageArchiveIndex.add_to_bloom_filter(index.sha1 for index in package_archive_indexes)
+
+
+def _bulk_index_package_files(packages, batch_size, stats):
+    """
+    Index the Resource SHA1 of the `packages` list of Packages and add them to
+    the ExactFilePackageSet of each SHA1.
+    """
+    start = time.time()
+    # Only the (sha1, package id) pairs that are not indexed yet are added to
+    # the package sets
+    indexed_pairs = set(
+        (bytes(sha1), package_id)
+        for sha1, package_id in ExactFileIndex.objects
+        .filter(package__in=packages)
+        .values_list('sha1', 'package_id')
+        .iterator(chunk_size=batch_size)
+    )
+    resources = (
+        Resource.objects
+        .filter(package__in=packages, sha1__isnull=False)
+        .exclude(sha1='')
+        .values_list('package_id', 'sha1')
+    )
+    file_indexes = []
+    for package_id, sha1 in resources.iterator(chunk_size=batch_size):
+        sha1_bin = bytes(hexstring_to_binarray(sha1))
+        if (sha1_bin, package_id) in indexed_pairs:
+            continue
+        indexed_pairs.add((sha1_bin, package_id))
+        file_indexes.append(ExactFileIndex(sha1=sha1_bin, package_id=package_id))
+        if len(file_indexes) >= batch_size:
+            _bulk_create_file_indexes(file_indexes, batch_size, stats, start)
+            file_indexes = []
+            start = time.time()
+    _bulk_create_file_indexes(file_indexes, batch_size, stats, start)
+
+
+def _bulk_create_file_indexes(file_indexes, batch_size, stats, start):
+    """
+    Insert the `file_indexes` new ExactFileIndex and add them to the Bloom
+    filter and to the package sets.
+    """
+    _bulk_create(ExactFileIndex, file_indexes, batch_size, stats, start)
+    ExactFileIndex.add_to_bloom_filter(index.sha1 for index in file_indexes)
+    ExactFilePackageSet.add_packages(
+        (index.sha1, index.package_id) for index in file_indexes
+    )
+
+
+def _bulk_index_package_git_blobs(packages, batch_size, stats):
+    """
+    Index the Resource git blob SHA1 of the `packages` list of Packages.
+    """
+    start = time.time()
+    resources = (
+        Resource.objects
+        .filter(package__in=packages, git_sha1__regex=r'^[0-9a-fA-F]{40}$')
+        .values_list('package_id', 'git_sha1')
+    )
+    git_blob_indexes = []
+    for package_id, git_sha1 in resources.iterator(chunk_size=batch_size):
+        git_blob_indexes.append(
+            ExactGitBlobIndex(sha1=hexstring_to_binarray(git_sha1), package_id=package_id)
+        )
+        if len(git_blob_indexes) >= batch_size:
+            _bulk_create(ExactGitBlobIndex, git_blob_indexes, batch_size, stats, start)
+            ExactGitBlobIndex.add_to_bloom_filter(index.sha1 for index in git_blob_indexes)
+            git_blob_indexes = []
+            start = time.time()
+    _bulk_create(ExactGitBlobIndex, git_blob_indexes, batch_size, stats, start)
+    ExactGitBlobIndex.add_to_bloom_filter(index.sha1 for index in git_blob_indexes)
+
+
+def _bulk_index_package_directories(packages, batch_size, stats):
+    """
+    Index the directory fingerprints of the `packages` list of Packages.
+
+    Return a set of the ids of the Packages whose directory fingerprints could
+    not be computed. Their `index_error` is updated with the error.
+    """
+    persist_column_sums = settings.MATCHCODE_DIRECTORY_COLUMN_SUMS
+    failed_package_ids = set()
+    start = time.time()
+    content_indexes = []
+    structure_indexes = []
+    column_sums = []
+    for package in packages:
+        try:
+            files = get_package_codebase_files(package)
+            if not files:
+                continue
+            vc = VirtualCodebase(location=dict(files=files))
+            directory_columns = {} if persist_column_sums else None
+            vc = compute_directory_fingerprints(vc, directory_columns=directory_columns)
+            if persist_column_sums:
+                column_sums.extend(
+                    _get_directory_column_sums(package, directory_columns, files)
+                )
+        except Exception as e:
+            msg = 'Error computing directory fingerprints:\n'
+            msg += get_error_message(e)
+            Package.objects.filter(pk=package.pk).update(index_error=msg)
+            logger.error(msg)
+            failed_package_ids.add(package.id)
+            continue
+
+        for resource in vc.walk(topdown=False):
+            directory_content_fingerprint = resource.extra_data.get('directory_content', '')
+            if directory_content_fingerprint:
+                content_indexes.append(
+                    ApproximateDirectoryContentIndex.from_fingerprint(
+                        directory_fingerprint=directory_content_fingerprint,
+                        resource_path=resource.path,
+                        package=package,
+                    )
+                )
+
+            directory_structure_fingerprint = resource.extra_data.get('directory_structure', '')
+            if directory_structure_fingerprint:
+                structure_indexes.append(
+                    ApproximateDirectoryStructureIndex.from_fingerprint(
+                        directory_fingerprint=directory_structure_fingerprint,
+                        resource_path=resource.path,
+                        package=package,
+                    )
+                )
+
+    # Both directory indexes are computed from the same fingerprinting pass
+    fingerprinting_stats = stats[DIRECTORY_FINGERPRINTS_STATS]
+    fingerprinting_stats[0] += len(content_indexes)
+    fingerprinting_stats[1] += time.time() - start
+
+    directory_indexes = [
+        (ApproximateDirectoryContentIndex, content_indexes),
+        (ApproximateDirectoryStructureIndex, structure_indexes),
+    ]
+    for model_class, indexes in directory_indexes:
+        _bulk_create(model_class, indexes, batch_size, stats, time.time())
+
+    if persist_column_sums:
+        start = time.time()
+        DirectoryColumnSums.objects.filter(package__in=packages).delete()
+        DirectoryColumnSums.replace(column_sums, batch_size=batch_size)
+        model_stats = stats[DirectoryColumnSums.__name__]
+        model_stats[0] += len(column_sums)
+        model_stats[1] += time.time() - start
+
+    return failed_package_ids
+
+
+def _get_directory_column_sums(package, directory_columns, files):
+    """
+    Return a list of new unsaved DirectoryColumnSums of `package` from the
+    `directory_columns` mapping of {directory path: DirectoryColumns} and the
+    `files` list of the Package files.
+    """
+    file_states_by_path = _get_file_states(files)
+    return [
+        DirectoryColumnSums.from_directory_columns(
+            package=package,
+            path=path,
+            directory_columns=columns,
+            file_states=file_states_by_path.get(path),
+        )
+        for path, columns in directory_columns.items()
+    ]
+
+
+def _get_file_states(files):
+    """
+    Return a mapping of {directory path: {file name: [sha1, size]}} of the
+    files directly in each directory from the `files` list of the files and
+    directories of a Package.
+    """
+    file_states_by_path = defaultdict(dict)
+    for f in files:
+        if f['type'] != 'file':
+            continue
+        parent_path, _, name = f['path'].rpartition('/')
+        if parent_path:
+            file_states_by_path[parent_path][name] = [f['sha1'], f['size']]
+    return file_states_by_path
+
+
+def _update_package_directories(package, batch_size, stats):
+    """
+    Update the directory fingerprints of `package` from its persisted
+    DirectoryColumnSums: the features of the files added, removed or modified
+    since the last indexing are added to or subtracted from the column sums of
+    their ancestor directories. Only the index rows of these directories are
+    replaced.
+
+    Return False if the directory fingerprints of `package` cannot be updated
+    incrementally and must be computed again from all its files, such as when
+    it has no DirectoryColumnSums.
+    """
+    start = time.time()
+    column_sums = DirectoryColumnSums.objects.filter(package=package)
+    directory_columns = {}
+    previous_files = {}
+    for directory_column_sums in column_sums:
+        path = directory_column_sums.path
+        directory_columns[path] = directory_column_sums.to_directory_columns()
+        for name, (sha1, size) in directory_column_sums.file_states.items():
+            previous_files[f'{path}/{name}'] = sha1, size
+    if not directory_columns:
+        return False
+
+    files = get_package_codebase_files(package)
+    if len({f['path'].split('/')[0] for f in files}) != 1:
+        # Directory paths are not stable without a single root directory
+        return False
+
+    current_files = {
+        f['path']: (f['sha1'], f['size'])
+        for f in files if f['type'] == 'file'
+    }
+    removed_files = [
+        (path, sha1, size) for path, (sha1, size) in previous_files.items()
+        if current_files.get(path) != (sha1, size)
+    ]
+    added_files = [
+        (path, sha1, size) for path, (sha1, size) in current_files.items()
+        if previous_files.get(path) != (sha1, size)
+    ]
+    updated_paths = update_directory_columns(directory_columns, added_files, removed_files)
+
+    directory_paths = set()
+    for f in files:
+        if f['type'] != 'file':
+            directory_paths.add(f['path'])
+        directory_paths.update(get_parent_paths(f['path']))
+    removed_paths = set(directory_columns) - directory_paths
+    for path in directory_paths - set(directory_columns):
+        directory_columns[path] = DirectoryColumns()
+        updated_paths.add(path)
+    updated_paths -= removed_paths
+
+    content_indexes = []
+    structure_indexes = []
+    for path in updated_paths:
+        columns = directory_columns[path]
+        if not columns.has_fingerprints:
+            continue
+        content_indexes.append(
+            ApproximateDirectoryContentIndex.from_fingerprint(
+                directory_fingerprint=columns.get_content_fingerprint(),
+                resource_path=path,
+                package=package,
+            )
+        )
+        structure_indexes.append(
+            ApproximateDirectoryStructureIndex.from_fingerprint(
+                directory_fingerprint=columns.get_structure_fingerprint(),
+                resource_path=path,
+                package=package,
+            )
+        )
+
+    fingerprinting_stats = stats[DIRECTORY_FINGERPRINTS_STATS]
+    fingerprinting_stats[0] += len(content_indexes)
+    fingerprinting_stats[1] += time.time() - start
+
+    changed_paths = updated_paths | removed_paths
+    directory_indexes = [
+        (ApproximateDirectoryContentIndex, content_indexes),
+        (ApproximateDirectoryStructureIndex, structure_indexes),
+    ]
+    for model_class, indexes in directory_indexes:
+        start = time.time()
+        model_class.objects.filter(package=package, path__in=changed_paths).delete()
+        IndexGeneration.bump(model_class)
+        _bulk_create(model_class, indexes, batch_size, stats, start)
+
+    start = time.time()
+    column_sums.filter(path__in=removed_paths).delete()
+    file_states_by_path = _get_file_states(files)
+    updated_column_sums = [
+        DirectoryColumnSums.from_directory_columns(
+            package=package,
+            path=path,
+            directory_columns=directory_columns[path],
+            file_states=file_states_by_path.get(path),
+        )
+        for path in updated_paths
+    ]
+    DirectoryColumnSums.replace(updated_column_sums, batch_size=batch_size)
+    model_stats = stats[DirectoryColumnSums.__name__]
+    model_stats[0] += len(updated_column_sums)
+    model_stats[1] += time.time() - start
+    return True
+
+
+def _bulk_create(model_class, objects, batch_size, stats, start):
+    """
+    Insert the `objects` instances of `model_class` in batches of `batch_size`
+    skipping rows that already exist, and update the `stats` of `model_class`
+    with the number of submitted rows and the time elapsed since `start`.
+
+    The rows that already exist are counted in the submitted rows: they are
+    skipped by the database and bulk inserts do not report them.
+    """
+    if objects:
+        with transaction.atomic():
+            if issubclass(model_class, BaseFileIndex):
+                # The prefilters of the SHA1 indexes must not be built while
+                # these rows are not committed
+                model_class.lock_inserts()
+            model_class.objects.bulk_create(objects, batch_size=batch_size, ignore_conflicts=True)
+        IndexGeneration.bump(model_class)
+    model_stats = stats[model_class.__name__]
+    model_stats[0] += len(objects)
+    model_stats[1] += time.time() - start
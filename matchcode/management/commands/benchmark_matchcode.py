@@ -0,0 +1,233 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import json
+import logging
+import sys
+
+from django.db import connection
+from django.db import transaction
+
+from minecode.management.commands import VerboseCommand
+from matchcode.benchmark import BENCHMARKS
+from matchcode.benchmark import compare_benchmark_results
+from matchcode.benchmark import DEFAULT_THRESHOLDS
+from matchcode.benchmark import DIRECTORY_INDEX_CLASSES
+from matchcode.benchmark import generate_corpus
+from matchcode.benchmark import get_benchmark_results
+from matchcode.benchmark import load_benchmark_results
+from matchcode.benchmark import run_benchmarks
+from matchcode.benchmark import run_threshold_benchmark
+from matchcode.benchmark import seed_corpus
+from matchcode.benchmark import THRESHOLDS_BENCHMARK
+
+
+TRACE = False
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout)
+logger.setLevel(logging.INFO)
+
+
+class Command(VerboseCommand):
+    help = (
+        'Benchmark the fingerprinting, indexing and matching of matchcode on a '
+        'synthetic corpus and write the results as JSON. The directory-thresholds '
+        'benchmark reports the candidate set size and latency of directory '
+        'fingerprint matching for a range of Hamming distance thresholds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='-',
+            help='Path to the JSON results file. Use "-" to write to stdout.',
+        )
+        parser.add_argument(
+            '--compare',
+            type=str,
+            help='Path to the JSON results file of a previous run to compare with.',
+        )
+        parser.add_argument(
+            '--benchmarks',
+            nargs='+',
+            choices=[benchmark.name for benchmark in BENCHMARKS] + [THRESHOLDS_BENCHMARK],
+            help='Names of the benchmarks to run. Run all the benchmarks by default.',
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=5,
+            help='Number of times each benchmark is run.',
+        )
+        parser.add_argument(
+            '--packages',
+            type=int,
+            default=10,
+            help='Number of generated Packages.',
+        )
+        parser.add_argument(
+            '--files',
+            type=int,
+            default=100,
+            help='Number of files of each generated Package.',
+        )
+        parser.add_argument(
+            '--depth',
+            type=int,
+            default=3,
+            help='Maximum directory depth of the generated files.',
+        )
+        parser.add_argument(
+            '--overlap',
+            type=float,
+            default=0.5,
+            help='Ratio of the codebase files that are copies of generated Packages.',
+        )
+        parser.add_argument(
+            '--modified',
+            type=float,
+            default=0.5,
+            help='Ratio of the Package copies with a modified file.',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed used to generate the corpus.',
+        )
+        parser.add_argument(
+            '--threshold-index',
+            choices=sorted(DIRECTORY_INDEX_CLASSES),
+            default='content',
+            help='Directory index of the directory-thresholds benchmark.',
+        )
+        parser.add_argument(
+            '--thresholds',
+            type=int,
+            nargs='+',
+            default=DEFAULT_THRESHOLDS,
+            help='Hamming distance thresholds of the directory-thresholds benchmark.',
+        )
+        parser.add_argument(
+            '--sample-size',
+            type=int,
+            default=100,
+            help='Number of indexed fingerprints used as match queries by the '
+                 'directory-thresholds benchmark.',
+        )
+        parser.add_argument(
+            '--flip-bits',
+            type=int,
+            default=0,
+            help='Number of random bits to flip in each query fingerprint of the '
+                 'directory-thresholds benchmark.',
+        )
+        parser.add_argument(
+            '--test-database',
+            action='store_true',
+            help='Seed the corpus in a new empty test database, destroyed when '
+                 'done, instead of in a rolled back transaction of the default '
+                 'database.',
+        )
+
+    def handle(self, *args, **options):
+        logger.setLevel(self.get_verbosity(**options))
+
+        params = dict(
+            packages_count=options['packages'],
+            files_count=options['files'],
+            depth=options['depth'],
+            overlap=options['overlap'],
+            modified_ratio=options['modified'],
+            seed=options['seed'],
+        )
+        corpus = generate_corpus(**params)
+        logger.info(
+            'Generated {} Packages and a codebase of {} files'.format(
+                len(corpus.packages), len(corpus.codebase_files)
+            )
+        )
+
+        if options['test_database']:
+            old_database_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                benchmarks, threshold_benchmark = self.run_benchmarks(corpus, options)
+            finally:
+                connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        else:
+            benchmarks, threshold_benchmark = self.run_benchmarks(corpus, options)
+
+        results = get_benchmark_results(benchmarks, params, threshold_benchmark)
+        outfile = options['output']
+        if outfile == '-':
+            json.dump(results, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        else:
+            with open(outfile, 'w') as output:
+                json.dump(results, output, indent=2)
+
+        compare = options.get('compare')
+        if compare:
+            previous = load_benchmark_results(compare)
+            for name, previous_mean, current_mean, ratio in compare_benchmark_results(previous, results):
+                ratio = f'{ratio:.2f}x' if ratio is not None else 'n/a'
+                logger.info(f'{name}: {previous_mean:.4f}s -> {current_mean:.4f}s ({ratio})')
+
+    def run_benchmarks(self, corpus, options):
+        """
+        Return a tuple of (benchmarks results, directory thresholds benchmark
+        results or None) of the benchmarks run on `corpus`. The corpus
+        Packages and their index rows are created in a transaction that is
+        rolled back when done.
+        """
+        names = options.get('benchmarks')
+        threshold_benchmark = None
+        with transaction.atomic():
+            packages = seed_corpus(corpus)
+            benchmarks = run_benchmarks(
+                corpus,
+                packages,
+                names=names,
+                rounds=options['rounds'],
+            )
+            for benchmark in benchmarks:
+                stats = benchmark['stats']
+                logger.info(
+                    '{}: mean {:.4f}s, {:.1f} items/s'.format(
+                        benchmark['name'], stats['mean'], stats['items_per_second'] or 0
+                    )
+                )
+
+            if not names or THRESHOLDS_BENCHMARK in names:
+                threshold_benchmark = run_threshold_benchmark(
+                    corpus,
+                    packages,
+                    index_name=options['threshold_index'],
+                    thresholds=options['thresholds'],
+                    sample_size=options['sample_size'],
+                    flip_bits=options['flip_bits'],
+                    seed=options['seed'],
+                )
+                logger.info(
+                    '{}: {index}: {indexed_fingerprints} indexed fingerprints, '
+                    '{queries} queries, {flip_bits} flipped bits'.format(
+                        THRESHOLDS_BENCHMARK, **threshold_benchmark
+                    )
+                )
+                for stats in threshold_benchmark['thresholds']:
+                    logger.info(
+                        'threshold {threshold}: {avg_candidates:.1f} candidates, '
+                        '{avg_matches:.1f} matches, {avg_candidates_ms:.2f}ms '
+                        'candidates, {avg_match_ms:.2f}ms match'.format(**stats)
+                    )
+            transaction.set_rollback(True)
+        return benchmarks, threshold_benchmark
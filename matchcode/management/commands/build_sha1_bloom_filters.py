@@ -0,0 +1,108 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import logging
+import os
+import sys
+import time
+
+from django.core.management.base import CommandError
+
+from minecode.management.commands import VerboseCommand
+from matchcode.bloom import build_bloom_filter
+from matchcode.bloom import DEFAULT_FALSE_POSITIVE_RATE
+from matchcode.bloom import get_bloom_filter_location
+from matchcode.bloom import Sha1BloomFilter
+from matchcode.models import ExactFileIndex
+from matchcode.models import ExactGitBlobIndex
+from matchcode.models import ExactPackageArchiveIndex
+
+
+TRACE = False
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout)
+logger.setLevel(logging.INFO)
+
+
+INDEX_CLASSES = {
+    'archive': ExactPackageArchiveIndex,
+    'file': ExactFileIndex,
+    'git-blob': ExactGitBlobIndex,
+}
+
+
+class Command(VerboseCommand):
+    help = (
+        'Build the SHA1 Bloom filters of the exact file and package archive '
+        'indexes, or report their size and false positive rate.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index',
+            choices=sorted(INDEX_CLASSES),
+            nargs='+',
+            default=sorted(INDEX_CLASSES),
+            help='Indexes to build a Bloom filter for.',
+        )
+        parser.add_argument(
+            '--directory',
+            help='Bloom filters directory. Defaults to the MATCHCODE_BLOOM_FILTER_DIR setting.',
+        )
+        parser.add_argument(
+            '--false-positive-rate',
+            type=float,
+            default=DEFAULT_FALSE_POSITIVE_RATE,
+            help='Target false positive rate of the Bloom filters.',
+        )
+        parser.add_argument(
+            '--growth-factor',
+            type=float,
+            default=2,
+            help='Size the Bloom filters for this many times the current number of rows.',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            default=False,
+            help='Only report statistics about the existing Bloom filters.',
+        )
+
+    def handle(self, *args, **options):
+        logger.setLevel(self.get_verbosity(**options))
+        directory = options.get('directory')
+
+        for index_name in options['index']:
+            index_class = INDEX_CLASSES[index_name]
+            location = get_bloom_filter_location(index_class, directory=directory)
+            if not location:
+                raise CommandError(
+                    'No Bloom filter directory: use --directory or set MATCHCODE_BLOOM_FILTER_DIR.'
+                )
+
+            if options['stats']:
+                if not os.path.exists(location):
+                    print('{}: no Bloom filter at: {}'.format(index_class.__name__, location))
+                    continue
+                bloom_filter = Sha1BloomFilter.load(location)
+            else:
+                os.makedirs(os.path.dirname(location), exist_ok=True)
+                start = time.time()
+                bloom_filter = build_bloom_filter(
+                    index_class,
+                    location,
+                    false_positive_rate=options['false_positive_rate'],
+                    growth_factor=options['growth_factor'],
+                )
+                duration = time.time() - start
+                print('{}: built in {:.1f} seconds: {}'.format(index_class.__name__, duration, location))
+
+            for name, value in bloom_filter.get_stats().items():
+                print('  {}: {}'.format(name, value))
@@ -0,0 +1,86 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import logging
+import os
+import sys
+import time
+
+from django.core.management.base import CommandError
+
+from minecode.management.commands import VerboseCommand
+from matchcode.models import ExactFileIndex
+from matchcode.models import ExactGitBlobIndex
+from matchcode.models import ExactPackageArchiveIndex
+from matchcode.snapshot import build_snapshot
+from matchcode.snapshot import get_snapshot_location
+
+
+TRACE = False
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout)
+logger.setLevel(logging.INFO)
+
+
+INDEX_CLASSES = {
+    'archive': ExactPackageArchiveIndex,
+    'file': ExactFileIndex,
+    'git-blob': ExactGitBlobIndex,
+}
+
+
+class Command(VerboseCommand):
+    help = 'Build memory-mapped SHA1 snapshots of the exact file and package archive indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index',
+            choices=sorted(INDEX_CLASSES),
+            nargs='+',
+            default=sorted(INDEX_CLASSES),
+            help='Indexes to snapshot.',
+        )
+        parser.add_argument(
+            '--directory',
+            help='Snapshots directory. Defaults to the MATCHCODE_SNAPSHOT_DIR setting.',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            default=False,
+            help='Only add the rows indexed since the existing snapshots were built.',
+        )
+
+    def handle(self, *args, **options):
+        logger.setLevel(self.get_verbosity(**options))
+        directory = options.get('directory')
+        incremental = options.get('incremental', False)
+
+        for index_name in options['index']:
+            index_class = INDEX_CLASSES[index_name]
+            location = get_snapshot_location(index_class, directory=directory)
+            if not location:
+                raise CommandError(
+                    'No snapshot directory: use --directory or set MATCHCODE_SNAPSHOT_DIR.'
+                )
+            os.makedirs(os.path.dirname(location), exist_ok=True)
+
+            start = time.time()
+            snapshot = build_snapshot(index_class, location, incremental=incremental)
+            duration = time.time() - start
+            print(
+                '{}: {} SHA1s up to id {} in {:.1f} seconds: {}'.format(
+                    index_class.__name__,
+                    len(snapshot),
+                    snapshot.max_index_id,
+                    duration,
+                    location,
+                )
+            )
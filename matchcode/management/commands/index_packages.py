@@ -7,19 +7,28 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+from collections import defaultdict
 from datetime import datetime
+from functools import partial
+from multiprocessing import pool
 import logging
 import sys
 import time
 
+from django.db import connections
 from django.db import transaction
+from django.db.models import Max
+from django.db.models import Min
+from django.utils import timezone
 
 from minecode.management.commands import VerboseCommand
-from matchcode.indexing import index_package_archives
-from matchcode.indexing import index_package_directories
-from matchcode.indexing import index_package_file
+from matchcode.indexing import BULK_INDEX_BATCH_SIZE
+from matchcode.indexing import bulk_index_packages
+from matchcode.indexing import incremental_index_packages
+from matchcode.indexing import index_package_directories  # NOQA
+from matchcode.models import IndexGeneration
+from matchcode.models import IndexingShard
 from packagedb.models import Package
-from packagedb.models import Resource
 
 
 TRACE = False
@@ -29,45 +38,195 @@ logging.basicConfig(stream=sys.stdout)
 logger.setLevel(logging.INFO)
 
 
+# Number of Package ids in a shard
+SHARD_SIZE = 100000
+
+# Number of Packages indexed together in a single transaction
+PACKAGES_CHUNK_SIZE = 500
+
+
+def create_shards(shard_size=SHARD_SIZE):
+    """
+    Replace all IndexingShard by new shards of `shard_size` Package ids that
+    cover all the Packages.
+    """
+    IndexingShard.objects.all().delete()
+    ids = Package.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+    min_id = ids['min_id']
+    max_id = ids['max_id']
+    if min_id is None:
+        return
+
+    shards = [
+        IndexingShard(
+            start_package_id=start,
+            end_package_id=min(start + shard_size, max_id + 1),
+        )
+        for start in range(min_id, max_id + 1, shard_size)
+    ]
+    IndexingShard.objects.bulk_create(shards)
+
+
+def index_shard(shard_id, batch_size=BULK_INDEX_BATCH_SIZE, chunk_size=PACKAGES_CHUNK_SIZE):
+    """
+    Index the Packages of the IndexingShard with `shard_id` that have not been
+    indexed yet, `chunk_size` Packages at a time. The shard progress is saved
+    after each chunk.
+
+    Return a mapping of {index name: [submitted rows count, duration in seconds]}
+    """
+    stats = defaultdict(lambda: [0, 0.0])
+    shard = IndexingShard.objects.get(pk=shard_id)
+    # The index generations are bumped once per shard rather than per chunk
+    with IndexGeneration.bump_once():
+        while True:
+            packages = list(shard.get_packages_to_index()[:chunk_size])
+            if not packages:
+                break
+
+            with transaction.atomic():
+                chunk_stats = bulk_index_packages(packages, batch_size=batch_size)
+                shard.last_indexed_package_id = packages[-1].id
+                shard.save()
+
+            for index_name, (rows, duration) in chunk_stats.items():
+                stats[index_name][0] += rows
+                stats[index_name][1] += duration
+
+    shard.completed_date = timezone.now()
+    shard.save()
+    return dict(stats)
+
+
+def index_modified_packages(batch_size=BULK_INDEX_BATCH_SIZE, chunk_size=PACKAGES_CHUNK_SIZE):
+    """
+    Index the Packages that have never been indexed or that have been modified
+    since they were last indexed, `chunk_size` Packages at a time.
+
+    Return a tuple of (indexed packages count, mapping of {index name:
+    [submitted rows count, duration in seconds]})
+    """
+    stats = defaultdict(lambda: [0, 0.0])
+    packages_count = 0
+    last_package_id = 0
+    # The index generations are bumped once at the end of the run
+    with IndexGeneration.bump_once():
+        while True:
+            packages = list(
+                Package.objects
+                .needs_indexing()
+                .filter(id__gt=last_package_id)
+                .order_by('id')[:chunk_size]
+            )
+            if not packages:
+                break
+
+            chunk_stats = incremental_index_packages(packages, batch_size=batch_size)
+            packages_count += len(packages)
+            last_package_id = packages[-1].id
+
+            for index_name, (rows, duration) in chunk_stats.items():
+                stats[index_name][0] += rows
+                stats[index_name][1] += duration
+
+    return packages_count, dict(stats)
+
+
+def print_index_stats(stats):
+    """
+    Print the `stats` mapping of {index name: [submitted rows count, duration in seconds]}
+    The submitted rows include the rows that were already indexed.
+    """
+    print('Submitted index rows:')
+    for index_name, (rows, duration) in sorted(stats.items()):
+        rows_per_second = int(rows / duration) if duration else rows
+        print('{}: {} ({} rows/sec)'.format(index_name, rows, rows_per_second))
+
+
 class Command(VerboseCommand):
     help = 'Index all Package SHA1 from PackageDB.'
 
-    def handle(self, *args, **options):
-        # Stats to keep track of during indexing
-        total_indexed_package_archives = 0
-        total_indexed_package_files = 0
-        total_indexed_adci = 0
-        total_indexed_adsi = 0
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Number of worker processes used to index shards in parallel.',
+        )
+        parser.add_argument(
+            '--shard-size',
+            type=int,
+            default=SHARD_SIZE,
+            help='Number of Package ids in each shard.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BULK_INDEX_BATCH_SIZE,
+            help='Number of index rows inserted at once.',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            default=False,
+            help='Resume the previous indexing run from the recorded shards progress.',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            default=False,
+            help='Only index the Packages that are new or modified since they '
+                 'were last indexed. Shards are not used in this mode.',
+        )
 
+    def handle(self, *args, **options):
         logger.setLevel(self.get_verbosity(**options))
+        processes = options.get('processes') or 1
+        shard_size = options.get('shard_size') or SHARD_SIZE
+        batch_size = options.get('batch_size') or BULK_INDEX_BATCH_SIZE
+        resume = options.get('resume', False)
+        incremental = options.get('incremental', False)
+
         start = time.time()
 
-        packages = Package.objects.filter(sha1__isnull=False)
-        for package in packages.iterator():
-            with transaction.atomic():
-                created_package_archive = index_package_archives(package)
-                if created_package_archive:
-                    total_indexed_package_archives += 1
+        if incremental:
+            packages_count, stats = index_modified_packages(batch_size=batch_size)
+            print('Package indexing completed at: {}'.format(datetime.utcnow().isoformat()))
+            total_duration = int(time.time() - start)
+            print('Total run duration: {} seconds'.format(total_duration))
+            print('Indexed packages: {}'.format(packages_count))
+            print_index_stats(stats)
+            return
 
-        resources = Resource.objects.filter(sha1__isnull=False)
-        for resource in resources.iterator():
-            with transaction.atomic():
-                created_package_file = index_package_file(resource)
-                if created_package_file:
-                    total_indexed_package_files += 1
+        if not resume or not IndexingShard.objects.exists():
+            create_shards(shard_size=shard_size)
 
-        for package in Package.objects.all().iterator():
-            with transaction.atomic():
-                indexed_adci, indexed_adsi = index_package_directories(package)
-                total_indexed_adci += indexed_adci
-                total_indexed_adsi += indexed_adsi
+        shard_ids = list(
+            IndexingShard.objects
+            .filter(completed_date__isnull=True)
+            .values_list('id', flat=True)
+        )
+        index_shard_with_options = partial(index_shard, batch_size=batch_size)
+
+        # Stats to keep track of during indexing
+        stats = defaultdict(lambda: [0, 0.0])
+        if processes > 1:
+            # Each worker process must open its own database connection
+            connections.close_all()
+            with pool.Pool(processes=processes) as workers:
+                shards_stats = list(workers.imap_unordered(index_shard_with_options, shard_ids))
+        else:
+            shards_stats = [index_shard_with_options(shard_id) for shard_id in shard_ids]
+
+        for shard_stats in shards_stats:
+            for index_name, (rows, duration) in shard_stats.items():
+                stats[index_name][0] += rows
+                stats[index_name][1] += duration
 
         # TODO: Format this better for viewing on terminal
         print('Package indexing completed at: {}'.format(datetime.utcnow().isoformat()))
         total_duration = int(time.time() - start)
         print('Total run duration: {} seconds'.format(total_duration))
-        print('Created:')
-        print('ExactPackageArchiveIndex: {}'.format(total_indexed_package_archives))
-        print('ExactFileIndex: {}'.format(total_indexed_package_files))
-        print('ApproximateDirectoryContentIndex: {}'.format(total_indexed_adci))
-        print('ApproximateDirectoryStructureIndex: {}'.format(total_indexed_adsi))
+        print('Indexed shards: {}'.format(len(shard_ids)))
+        print_index_stats(stats)
+
@@ -0,0 +1,118 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import logging
+import sys
+
+import attr
+from commoncode.resource import VirtualCodebase
+
+from minecode.management.commands import VerboseCommand
+from matchcode.management.commands.match_scan import match_codebase
+from matchcode.management.commands.match_scan import write_matches
+from matchcode.match import EXACT_GIT_BLOB_MATCH
+from matchcode.match import get_codebase_package_scores
+from matchcode.match import iter_git_ls_tree_files
+from matchcode.models import ExactGitBlobIndex
+
+
+TRACE = False
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout)
+logger.setLevel(logging.INFO)
+
+
+def get_git_tree_codebase(lines, root_name='codebase'):
+    """
+    Return a VirtualCodebase of the files listed in the `lines` of a
+    `git ls-tree -r` output. The path of each file is prefixed with
+    `root_name`.
+
+    The files are not read: each file Resource only has the git blob SHA1 of
+    the listing in its `git_sha1` attribute.
+    """
+    files = []
+    for git_file in iter_git_ls_tree_files(lines):
+        git_file['path'] = f"{root_name}/{git_file['path']}"
+        files.append(git_file)
+
+    return VirtualCodebase(
+        location=dict(files=files),
+        codebase_attributes=dict(
+            matches=attr.ib(default=attr.Factory(list))
+        ),
+        resource_attributes=dict(
+            matched_to=attr.ib(default=attr.Factory(list))
+        )
+    )
+
+
+class Command(VerboseCommand):
+    help = (
+        'Match the files of a `git ls-tree -r HEAD` listing to Packages using '
+        'their git blob SHA1 and write the matched Resources and Packages as '
+        'JSON lines.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'ls_tree_file_path',
+            type=str,
+            help='Path to the output of `git ls-tree -r`. Use "-" to read from stdin.',
+        )
+        parser.add_argument(
+            'outfile_path',
+            type=str,
+            help='Path to the JSON lines output file. Use "-" to write to stdout.',
+        )
+        parser.add_argument(
+            '--root-name',
+            type=str,
+            default='codebase',
+            help='Name of the root directory of the matched codebase.',
+        )
+        parser.add_argument(
+            '--top-packages',
+            type=int,
+            default=0,
+            help='Write the scores of the top N Packages that contain the most '
+                 'files of the tree instead of each matched Package.',
+        )
+
+    def handle(self, *args, **options):
+        logger.setLevel(self.get_verbosity(**options))
+        ls_tree_file = options['ls_tree_file_path']
+        outfile = options['outfile_path']
+        root_name = options['root_name']
+
+        if ls_tree_file == '-':
+            codebase = get_git_tree_codebase(sys.stdin, root_name=root_name)
+        else:
+            with open(ls_tree_file) as lines:
+                codebase = get_git_tree_codebase(lines, root_name=root_name)
+
+        match_count = match_codebase(codebase, match_types=(EXACT_GIT_BLOB_MATCH,))
+        logger.info('Found {} matches in: {}'.format(match_count, ls_tree_file))
+
+        package_scores = None
+        top_packages = options.get('top_packages')
+        if top_packages:
+            package_scores = get_codebase_package_scores(
+                codebase,
+                limit=top_packages,
+                index_class=ExactGitBlobIndex,
+                sha1_attribute='git_sha1',
+            )
+
+        if outfile == '-':
+            write_matches(codebase, sys.stdout, package_scores)
+        else:
+            with open(outfile, 'w') as output:
+                write_matches(codebase, output, package_scores)
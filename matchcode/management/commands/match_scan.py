@@ -8,29 +8,337 @@
 #
 
 import json
+import logging
+import sys
 
-from django.core.management.base import BaseCommand
+import attr
+import ijson
+from commoncode.resource import VirtualCodebase
 
-from matchcode import match
+from matchcode_toolkit.fingerprinting import compute_directory_fingerprints
+from minecode.management.commands import VerboseCommand
+from matchcode.match import APPROXIMATE_DIRECTORY_CONTENT_MATCH
+from matchcode.match import APPROXIMATE_DIRECTORY_STRUCTURE_MATCH
+from matchcode.match import do_match
+from matchcode.match import EXACT_FILE_MATCH
+from matchcode.match import EXACT_PACKAGE_ARCHIVE_MATCH
+from matchcode.match import get_package_scores
+from matchcode.match import MatchSession
 
 
-class Command(BaseCommand):
-    help = 'matches packages in a scancode fileinfo scan'
+TRACE = False
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout)
+logger.setLevel(logging.INFO)
+
+
+# Resource fields of a ScanCode scan that are needed for matching. All the
+# other fields, such as license or copyright detections, are dropped while
+# the scan is read.
+MATCHING_RESOURCE_FIELDS = (
+    'path',
+    'type',
+    'size',
+    'sha1',
+    'md5',
+    'is_archive',
+)
+
+# Matchers in the order they are run: Resources that are matched by a matcher
+# are skipped by the next matchers.
+MATCH_TYPES = (
+    EXACT_PACKAGE_ARCHIVE_MATCH,
+    APPROXIMATE_DIRECTORY_CONTENT_MATCH,
+    APPROXIMATE_DIRECTORY_STRUCTURE_MATCH,
+    EXACT_FILE_MATCH,
+)
+
+# Maximum number of Resources of a scan that are matched at a time. A
+# directory with more Resources in its subtree is not matched by the directory
+# matchers, but its files and smaller subdirectories are.
+MAX_CHUNK_RESOURCES = 50000
+
+
+def iter_scan_resources(location):
+    """
+    Yield mappings of the fields needed for matching of each of the Resources
+    of the ScanCode JSON scan at `location`.
+
+    The scan is read incrementally: only a single Resource of the scan is
+    fully loaded in memory at a time.
+    """
+    with open(location, 'rb') as scan_file:
+        for resource in ijson.items(scan_file, 'files.item', use_float=True):
+            yield {
+                field: resource[field]
+                for field in MATCHING_RESOURCE_FIELDS
+                if field in resource
+            }
+
+
+def iter_scan_chunks(resources, max_resources=MAX_CHUNK_RESOURCES):
+    """
+    Yield tuples of (list of Resource mappings, set of partial directory
+    paths) for chunks of about `max_resources` Resources of the `resources`
+    iterable of Resource mappings of a scan.
+
+    The Resources must be sorted top-down as in a ScanCode scan, such that the
+    subtree of each directory is contiguous. Each chunk contains complete
+    subtrees of a single root, along with their open ancestor directories.
+    The directories whose subtree does not fit in a chunk are "partial": they
+    are split across chunks, and each of their chunks only contains a part of
+    their subtree.
+
+    Only the Resources of the current chunk and the current path of open
+    directories are kept in memory.
+    """
+    # Resource mappings of the current chunk
+    pending = []
+    # Stack of [path, Resource mapping, index in pending] of the open
+    # directories, from the root down. The index of a partial directory is None.
+    open_directories = []
+
+    def shift(end):
+        del pending[:end]
+        for directory in open_directories:
+            if directory[2] is not None:
+                directory[2] -= end
+
+    def get_chunk(end):
+        chunk = pending[:end]
+        shift(end)
+
+        partial_directories = [
+            directory for directory in open_directories if directory[2] is None
+        ]
+        chunk_paths = set(resource['path'] for resource in chunk)
+        ancestors = [
+            resource for path, resource, _ in partial_directories
+            if path not in chunk_paths
+        ]
+        partial_paths = set(path for path, _, _ in partial_directories)
+        return ancestors + chunk, partial_paths
+
+    for resource in resources:
+        path = resource['path']
+        while open_directories and not path.startswith(open_directories[-1][0] + '/'):
+            if open_directories[-1][2] is None and pending:
+                # A partial directory is closed: the pending Resources are
+                # its last complete subtrees.
+                yield get_chunk(len(pending))
+            open_directories.pop()
+
+        if not open_directories and pending:
+            # A new root starts
+            yield get_chunk(len(pending))
+
+        while pending and len(pending) >= max_resources:
+            # The Resources before the outermost open directory that started
+            # in this chunk are complete subtrees
+            start = next(
+                (index for _, _, index in open_directories if index is not None),
+                None,
+            )
+            if start is None:
+                yield get_chunk(len(pending))
+            elif start:
+                yield get_chunk(start)
+            else:
+                # This directory subtree does not fit in a chunk: it is added
+                # to the next chunks as an ancestor
+                for directory in open_directories:
+                    if directory[2] == 0:
+                        directory[2] = None
+                        break
+                shift(1)
+
+        pending.append(resource)
+        if resource.get('type') == 'directory':
+            open_directories.append([path, resource, len(pending) - 1])
+
+    if pending:
+        yield get_chunk(len(pending))
+
+
+def get_matching_codebase(resources, partial_directory_paths=()):
+    """
+    Return a VirtualCodebase with directory fingerprints built from the
+    `resources` list of Resource mappings with the fields needed for matching.
+
+    The directories of the `partial_directory_paths` have only a part of their
+    subtree in `resources`: they have no fingerprints and cannot be matched by
+    the directory matchers.
+    """
+    codebase = VirtualCodebase(
+        location=dict(files=resources),
+        codebase_attributes=dict(
+            matches=attr.ib(default=attr.Factory(list))
+        ),
+        resource_attributes=dict(
+            matched_to=attr.ib(default=attr.Factory(list))
+        )
+    )
+    compute_directory_fingerprints(codebase)
+
+    for path in partial_directory_paths:
+        resource = codebase.get_resource(path)
+        resource.extra_data.pop('directory_content', None)
+        resource.extra_data.pop('directory_structure', None)
+        resource.save(codebase)
+    return codebase
+
+
+def match_codebase(codebase, match_types=MATCH_TYPES):
+    """
+    Run the matchers of each of the `match_types` on `codebase`. The matched
+    Resources are saved once after all the matchers have run.
+
+    Return the total number of matches found.
+    """
+    session = MatchSession(codebase)
+    match_count = 0
+    for match_type in match_types:
+        match_count += do_match(codebase, match_type, session=session)
+    session.flush()
+    return match_count
+
+
+def write_matches(codebase, output, package_scores=None, seen=None):
+    """
+    Write the matched Resources and Packages of `codebase` to the `output`
+    file-like object as JSON lines, one matched Resource or Package per line.
+    The low-signal Resources that are not matched are written with their
+    `low_signal_packages_count`.
+
+    If a `package_scores` list of Package scores is provided, the scores are
+    written instead of the matched Packages.
+
+    If a `seen` set of (purl, match type) is provided, it is updated with the
+    written Packages and the Packages already in this set are not written.
+    """
+    for resource in codebase.walk(topdown=True):
+        low_signal_packages_count = resource.extra_data.get('low_signal_packages_count')
+        if not resource.matched_to and not low_signal_packages_count:
+            continue
+        matched_resource = dict(
+            path=resource.path,
+            type=resource.type,
+            sha1=getattr(resource, 'sha1', None),
+            matched_to=resource.matched_to,
+        )
+        if low_signal_packages_count:
+            # A very common file found in too many Packages to be matched
+            matched_resource['low_signal_packages_count'] = low_signal_packages_count
+        git_sha1 = getattr(resource, 'git_sha1', None)
+        if git_sha1:
+            matched_resource['git_sha1'] = git_sha1
+        output.write(json.dumps(dict(resource=matched_resource)))
+        output.write('\n')
+
+    if package_scores is not None:
+        for package_score in package_scores:
+            output.write(json.dumps(dict(package_score=package_score)))
+            output.write('\n')
+        return
+
+    if seen is None:
+        seen = set()
+    for matched_package in codebase.attributes.matches:
+        key = matched_package.get('purl'), matched_package.get('match_type')
+        if key in seen:
+            continue
+        seen.add(key)
+        output.write(json.dumps(dict(package=matched_package)))
+        output.write('\n')
+
+
+def match_scan(location, output, top_packages=0, max_resources=MAX_CHUNK_RESOURCES):
+    """
+    Match the Resources of the ScanCode JSON scan at `location` and write the
+    matched Resources and Packages to the `output` file-like object as JSON
+    lines. If `top_packages` is provided, write the scores of the top
+    `top_packages` Packages instead of each matched Package.
+
+    The scan is matched and written in chunks of `max_resources` Resources
+    such that the memory use does not grow with the size of the scan: only
+    the SHA1s of the files are kept across chunks to score the Packages.
+
+    Return a tuple of (number of matches, number of chunks).
+    """
+    match_count = 0
+    chunk_count = 0
+    seen = set()
+    sha1s = set()
+    for resources, partial_directory_paths in iter_scan_chunks(
+        iter_scan_resources(location),
+        max_resources=max_resources,
+    ):
+        codebase = get_matching_codebase(resources, partial_directory_paths)
+        match_count += match_codebase(codebase)
+        chunk_count += 1
+
+        if top_packages:
+            sha1s.update(
+                resource['sha1'] for resource in resources
+                if resource.get('type') == 'file' and resource.get('sha1')
+            )
+            write_matches(codebase, output, package_scores=[])
+        else:
+            write_matches(codebase, output, seen=seen)
+        output.flush()
+
+    if top_packages:
+        for score in get_package_scores(sha1s, limit=top_packages):
+            package = score.pop('package')
+            package_score = dict(purl=package.package_url, **score)
+            output.write(json.dumps(dict(package_score=package_score)))
+            output.write('\n')
+
+    return match_count, chunk_count
+
+
+class Command(VerboseCommand):
+    help = (
+        'Match the Resources of a ScanCode fileinfo scan to Packages and write '
+        'the matched Resources and Packages as JSON lines.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('scancode_file_path', type=str)
-        parser.add_argument('outfile_path', type=str)
+        parser.add_argument(
+            'outfile_path',
+            type=str,
+            help='Path to the JSON lines output file. Use "-" to write to stdout.',
+        )
+        parser.add_argument(
+            '--top-packages',
+            type=int,
+            default=0,
+            help='Write the scores of the top N Packages that contain the most '
+                 'files of the scan instead of each matched Package.',
+        )
+        parser.add_argument(
+            '--max-resources',
+            type=int,
+            default=MAX_CHUNK_RESOURCES,
+            help='Maximum number of Resources of the scan that are matched at a time.',
+        )
 
     def handle(self, *args, **options):
+        logger.setLevel(self.get_verbosity(**options))
         scancode_file = options['scancode_file_path']
         outfile = options['outfile_path']
+        match_options = dict(
+            top_packages=options.get('top_packages'),
+            max_resources=options['max_resources'],
+        )
 
-        # load up the scancode fileinfo json
-        with open(scancode_file) as f:
-            scan = json.load(f)
-
-        results = match.match_packages(scan)
+        if outfile == '-':
+            match_count, chunk_count = match_scan(scancode_file, sys.stdout, **match_options)
+        else:
+            with open(outfile, 'w') as output:
+                match_count, chunk_count = match_scan(scancode_file, output, **match_options)
 
-        # write new json results
-        with open(outfile, 'w') as f:
-            json.dump(results, f, indent=2)
+        logger.info('Found {} matches in {} chunks of: {}'.format(
+            match_count, chunk_count, scancode_file))
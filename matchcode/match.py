@@ -7,15 +7,20 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
-from functools import reduce
-from operator import or_
+import codecs
 
+from django.db.models import Count
+from django.db.models import OuterRef
 from django.db.models import Q
+from django.db.models import Subquery
 
+from matchcode_toolkit.fingerprinting import hexstring_to_binarray
 from matchcode.models import ApproximateDirectoryContentIndex
 from matchcode.models import ApproximateDirectoryStructureIndex
 from matchcode.models import ExactFileIndex
+from matchcode.models import ExactGitBlobIndex
 from matchcode.models import ExactPackageArchiveIndex
+from packagedb.models import Package
 
 
 # TODO: Refactor this file into functions/utilities used in
@@ -24,6 +29,10 @@ EXACT_PACKAGE_ARCHIVE_MATCH = 0
 APPROXIMATE_DIRECTORY_STRUCTURE_MATCH = 1
 APPROXIMATE_DIRECTORY_CONTENT_MATCH = 2
 EXACT_FILE_MATCH = 3
+EXACT_GIT_BLOB_MATCH = 4
+
+# Default number of Packages returned when scoring the Packages of a codebase
+TOP_PACKAGES_COUNT = 20
 
 
 def get_matchers():
@@ -32,170 +41,376 @@ def get_matchers():
         APPROXIMATE_DIRECTORY_CONTENT_MATCH: approximate_directory_content_match,
         APPROXIMATE_DIRECTORY_STRUCTURE_MATCH: approximate_directory_structure_match,
         EXACT_FILE_MATCH: individual_file_match,
+        EXACT_GIT_BLOB_MATCH: git_blob_match,
     }
     return MATCHERS_BY_MATCH_TYPE
 
 
-def do_match(codebase, match_type):
+def do_match(codebase, match_type, session=None):
     """
     Perform Package matching on `codebase` by running matching functions of `match_type` on `codebase`
 
+    `session` is an optional MatchSession shared by several matchers. The
+    matched Resources are saved at the end of the matching unless a `session`
+    is provided: in this case, it is up to the caller to flush the session.
+
     The total number of matches found is returned
     """
 
     matcher = get_matchers().get(match_type)
     if not matcher:
         raise Exception('Unknown match type: {}'.format(match_type))
-    match_count = matcher(codebase)
+
+    if session:
+        return matcher(codebase, session=session)
+
+    session = MatchSession(codebase)
+    match_count = matcher(codebase, session=session)
+    session.flush()
     return match_count
 
 
-def package_archive_match(codebase):
+def package_archive_match(codebase, session):
     """
     Update Matches from detected Package Archives in `codebase`
 
     Return the number of matches found in `codebase`
     """
-    match_count = 0
-    for resource in codebase.walk(topdown=True):
-        if (resource.is_dir
-                or not resource.is_archive
-                or resource.extra_data.get('matched', False)):
-            continue
-
-        archive_matches, match_type = get_archive_match(resource)
-        if not archive_matches:
-            continue
-
-        match_count += len(archive_matches)
-
-        # Tag matched Resource as `matched` as to not analyze it later
-        tag_matched_resources(resource, codebase, archive_matches, match_type)
-    return match_count
-
-
-def approximate_directory_content_match(codebase):
+    resources = [
+        resource for resource in session.walk()
+        if (resource.is_file
+            and resource.is_archive
+            and not session.is_matched(resource))
+    ]
+    return match_resources_by_sha1(
+        resources=resources,
+        codebase=codebase,
+        index_class=ExactPackageArchiveIndex,
+        match_type='exact-archive',
+        session=session,
+    )
+
+
+def approximate_directory_content_match(codebase, session):
     """
     Update Matches from detected Package directories based on directory contents in `codebase`
 
     Return the number of matches found in `codebase`
     """
-    match_count = 0
-    for resource in codebase.walk(topdown=True):
-        if resource.is_file or resource.extra_data.get('matched', False):
-            continue
+    return match_directories(
+        codebase=codebase,
+        index_class=ApproximateDirectoryContentIndex,
+        fingerprint_name='directory_content',
+        match_type='approximate-content',
+        session=session,
+    )
 
-        directory_matches, match_type = get_directory_content_match(resource)
-        if not directory_matches:
-            continue
 
-        match_count += directory_matches.count()
-        tag_matched_resources(resource, codebase, directory_matches, match_type)
-    return match_count
+def approximate_directory_structure_match(codebase, session):
+    """
+    Update Matches from detected Package directories based on directory structure in `codebase`
+
+    Return the number of matches found in `codebase`
+    """
+    return match_directories(
+        codebase=codebase,
+        index_class=ApproximateDirectoryStructureIndex,
+        fingerprint_name='directory_structure',
+        match_type='approximate-structure',
+        session=session,
+    )
 
 
-def approximate_directory_structure_match(codebase):
+def match_directories(codebase, index_class, fingerprint_name, match_type, session):
     """
-    Update Matches from detected Package directories based on directory structure in `codebase`
+    Match the directories of `codebase` against `index_class` using their
+    `fingerprint_name` fingerprint stored in their extra data and tag matched
+    Resources with `match_type` in the `session` MatchSession.
+
+    The fingerprints of all the directories that are not matched yet are
+    resolved upfront with a few batched queries, then directories are matched
+    top-down from the in-memory mapping of fingerprint to matches: the
+    Resources under a matched directory are not matched again.
 
     Return the number of matches found in `codebase`
     """
+    fingerprints = [
+        resource.extra_data.get(fingerprint_name)
+        for resource in session.walk()
+        if not resource.is_file and not session.is_matched(resource)
+    ]
+    matches_by_fingerprint = index_class.match_many(fingerprints)
+
     match_count = 0
-    for resource in codebase.walk(topdown=True):
-        if resource.is_file or resource.extra_data.get('matched', False):
+    package_path_tries = {}
+    for resource in session.walk():
+        if resource.is_file or session.is_matched(resource):
             continue
 
-        directory_matches, match_type = get_directory_structure_match(resource)
+        fingerprint = resource.extra_data.get(fingerprint_name)
+        directory_matches = matches_by_fingerprint.get(fingerprint)
         if not directory_matches:
             continue
 
-        match_count += directory_matches.count()
-        tag_matched_resources(resource, codebase, directory_matches, match_type)
+        match_count += len(directory_matches)
+        tag_matched_resources(
+            resource, codebase, directory_matches, match_type, package_path_tries, session
+        )
     return match_count
 
 
-def individual_file_match(codebase):
+def individual_file_match(codebase, session):
     """
     Update Matches from detected Package files in `codebase`
 
     Return the number of matches found in `codebase`
     """
-    match_count = 0
-    for resource in codebase.walk(topdown=True):
-        if resource.is_dir or resource.extra_data.get('matched', False):
-            continue
+    resources = [
+        resource for resource in session.walk()
+        if resource.is_file and not session.is_matched(resource)
+    ]
+    return match_resources_by_sha1(
+        resources=resources,
+        codebase=codebase,
+        index_class=ExactFileIndex,
+        match_type='exact-file',
+        session=session,
+    )
+
+
+def git_blob_match(codebase, session):
+    """
+    Update Matches from Package files detected using the git blob SHA1 of the
+    files in `codebase`, stored in the `git_sha1` attribute of its Resources
 
-        file_matches, match_type = get_file_match(resource)
-        if not file_matches:
+    Return the number of matches found in `codebase`
+    """
+    resources = [
+        resource for resource in session.walk()
+        if (resource.is_file
+            and getattr(resource, 'git_sha1', None)
+            and not session.is_matched(resource))
+    ]
+    return match_resources_by_sha1(
+        resources=resources,
+        codebase=codebase,
+        index_class=ExactGitBlobIndex,
+        match_type='exact-git-blob',
+        session=session,
+        sha1_attribute='git_sha1',
+    )
+
+
+def iter_git_ls_tree_files(lines):
+    r"""
+    Yield mappings of the path and git blob SHA1 of each file listed in the
+    `lines` iterable of the output of the `git ls-tree -r` command, read
+    without reading any file content.
+
+    Submodules and symlinks are skipped. Both the default output where special
+    paths are quoted and the `-z` output where paths are not quoted are
+    supported, as well as the `-l` output with the size of each file.
+
+    For example:
+    >>> lines = [
+    ...     '100644 blob 8ab686eafeb1f44702738c8b0f24f2567c36da6d\tREADME.md',
+    ...     '100755 blob e69de29bb2d1d6434b8b29ae775ad8c2e48c5391     0\tbin/run',
+    ...     '160000 commit 0a4d55a8d778e5022fab701977c5d840bbc486d0\tvendor/lib',
+    ...     '100644 blob 5716ca5987cbf97d6bb54920bea6adde242d87e6\t"caf\\303\\251.txt"',
+    ... ]
+    >>> for f in iter_git_ls_tree_files(lines): print(f['path'], f['git_sha1'][:8])
+    README.md 8ab686ea
+    bin/run e69de29b
+    café.txt 5716ca59
+    """
+    for line in lines:
+        line = line.rstrip('\n\0')
+        if not line:
+            continue
+        entry, _, path = line.partition('\t')
+        mode, object_type, object_sha1, *_ = entry.split()
+        # Skip submodules and symlinks
+        if object_type != 'blob' or mode == '120000':
             continue
+        if path.startswith('"') and path.endswith('"'):
+            path = unquote_git_path(path[1:-1])
+        yield dict(path=path, type='file', git_sha1=object_sha1.lower())
 
-        match_count += len(file_matches)
-        tag_matched_resources(resource, codebase, file_matches, match_type)
-    return match_count
 
+def unquote_git_path(path):
+    r"""
+    Return the `path` string quoted by git with C-style escapes for special
+    characters, unquoted.
 
-def get_directory_content_match(resource):
+    For example:
+    >>> unquote_git_path('caf\\303\\251 \\"quoted\\"\\ttab.txt')
+    'café "quoted"\ttab.txt'
+    >>> unquote_git_path('café\\ttab.txt')
+    'café\ttab.txt'
     """
-    Match a directory to a Package using its contents
-    """
-    directory_content_fingerprint = resource.extra_data.get('directory_content', '')
-    matches = ApproximateDirectoryContentIndex.objects.none()
-    match_type = ''
-    if directory_content_fingerprint:
-        directory_matches = ApproximateDirectoryContentIndex.match(directory_content_fingerprint)
-        matches |= directory_matches
-        match_type = 'approximate-content'
-    return matches, match_type
+    unquoted = codecs.escape_decode(path.encode('utf-8'))[0]
+    return unquoted.decode('utf-8', 'surrogateescape')
 
 
-# TODO: rename match_directory_structure
-def get_directory_structure_match(resource):
-    """
-    Match a directory to a Package using its structure
+def match_resources_by_sha1(resources, codebase, index_class, match_type, session, sha1_attribute='sha1'):
     """
-    directory_structure_fingerprint = resource.extra_data.get('directory_structure', '')
-    matches = ApproximateDirectoryStructureIndex.objects.none()
-    match_type = ''
-    if directory_structure_fingerprint:
-        directory_matches = ApproximateDirectoryStructureIndex.match(directory_structure_fingerprint)
-        matches |= directory_matches
-        match_type = 'approximate-structure'
-    return matches, match_type
+    Match the file `resources` from `codebase` against `index_class` using
+    their SHA1 stored in their `sha1_attribute` and tag matched Resources with
+    `match_type` in the `session` MatchSession.
 
+    All SHA1s are resolved upfront with a few large batched queries, then
+    Resources are tagged from the in-memory mapping of SHA1 to matches.
 
-def get_archive_match(resource):
-    """
-    Match an Archive resource to a Package
+    Resources of very common files found in too many Packages are not matched
+    and are flagged with the number of Packages instead.
+
+    Return the number of matches found in `codebase`
     """
-    file_matches = ExactPackageArchiveIndex.match(resource.sha1)
-    return file_matches, 'exact-archive'
+    sha1s = [getattr(r, sha1_attribute, None) for r in resources]
+    matches_by_sha1, low_signal_sha1s = index_class.match_many_with_low_signal(sha1s)
+    if low_signal_sha1s:
+        for resource, sha1 in zip(resources, sha1s):
+            packages_count = low_signal_sha1s.get(sha1)
+            if packages_count:
+                resource = session.get_resource(resource)
+                resource.extra_data['low_signal_packages_count'] = packages_count
+                session.update(resource)
+
+    if not matches_by_sha1:
+        return 0
 
+    match_count = 0
+    package_path_tries = {}
+    for resource, sha1 in zip(resources, sha1s):
+        file_matches = matches_by_sha1.get(sha1)
+        if not file_matches or session.is_matched(resource):
+            continue
 
-def get_file_match(resource):
-    """
-    Match an individual file back to the Package it is from
-    """
-    file_matches = ExactFileIndex.match(resource.sha1)
-    return file_matches, 'exact-file'
+        match_count += len(file_matches)
+        tag_matched_resources(
+            resource, codebase, file_matches, match_type, package_path_tries, session
+        )
+    return match_count
 
 
-def tag_matched_resource(resource, codebase, purl):
+def get_package_scores(sha1s, limit=TOP_PACKAGES_COUNT, index_class=ExactFileIndex):
     """
-    Set a resource to be flagged as matched, so it will not be considered in
-    subsequent matches once it has been matched
+    Return a list of the top `limit` Packages that contain the most files with
+    a SHA1 of the `sha1s` list of SHA1 strings of a codebase, ranked from the
+    highest to the lowest number of matched files in the `index_class`
+    BaseFileIndex.
+
+    Each item is a mapping with these scores of a Package:
+    - matched_files_count: the number of SHA1s of the codebase found in the
+      Package.
+    - package_files_count: the number of unique SHA1s of the Package files.
+    - coverage: the ratio of the Package files found in the codebase.
+    - containment: the ratio of the codebase SHA1s found in the Package.
+
+    The files of all the Packages are counted in a single grouped query rather
+    than matching and serializing each file.
     """
-    if purl not in resource.matched_to:
-        resource.matched_to.append(purl)
-    resource.extra_data['matched'] = True
-    resource.save(codebase)
-
-
-def tag_matched_resources(resource, codebase, matches, match_type):
+    sha1s = sorted(set(sha1 for sha1 in sha1s if sha1))
+    if not sha1s:
+        return []
+
+    # Skip the SHA1s that are certainly not indexed
+    sha1s_query = Q(pk__in=[])
+    for sha1s_to_lookup, extra_filter in index_class.get_sha1_lookups(sha1s):
+        if sha1s_to_lookup:
+            sha1s_in_bin = [hexstring_to_binarray(sha1) for sha1 in sha1s_to_lookup]
+            sha1s_query |= Q(extra_filter, sha1__in=sha1s_in_bin)
+
+    package_files_count = (
+        index_class.objects
+        .filter(package_id=OuterRef('package_id'))
+        .order_by()
+        .values('package_id')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    scores = list(
+        index_class.objects
+        .filter(sha1s_query)
+        .values('package_id')
+        .annotate(
+            matched_files_count=Count('*'),
+            package_files_count=Subquery(package_files_count),
+        )
+        .order_by('-matched_files_count', 'package_files_count', 'package_id')
+        [:limit]
+    )
+
+    packages_by_id = Package.objects.in_bulk([score['package_id'] for score in scores])
+    package_scores = []
+    for score in scores:
+        package = packages_by_id.get(score['package_id'])
+        if not package:
+            continue
+        matched_files_count = score['matched_files_count']
+        package_files_count = score['package_files_count']
+        package_scores.append(
+            dict(
+                package=package,
+                matched_files_count=matched_files_count,
+                package_files_count=package_files_count,
+                coverage=round(matched_files_count / package_files_count, 4),
+                containment=round(matched_files_count / len(sha1s), 4),
+            )
+        )
+    return package_scores
+
+
+def get_codebase_package_scores(
+    codebase,
+    limit=TOP_PACKAGES_COUNT,
+    index_class=ExactFileIndex,
+    sha1_attribute='sha1',
+):
+    """
+    Return a list of mappings of the scores of the top `limit` Packages
+    matched by the `sha1_attribute` SHA1s of the files of `codebase`, with the
+    Package URL of each Package. See `get_package_scores`.
+    """
+    sha1s = [
+        getattr(resource, sha1_attribute, None)
+        for resource in codebase.walk() if resource.is_file
+    ]
+    package_scores = []
+    for score in get_package_scores(sha1s, limit=limit, index_class=index_class):
+        package = score.pop('package')
+        package_scores.append(dict(purl=package.package_url, **score))
+    return package_scores
+
+
+def tag_matched_resources(
+    resource,
+    codebase,
+    matches,
+    match_type,
+    package_path_tries=None,
+    session=None,
+):
     """
     Tag this directory and other Resources under this directory so they are not
     candidates for matching by checking to see if a Resource path from
     `resource` or its children exists in the matched packages in `matches`
+
+    `package_path_tries` is an optional mapping of {package id: PackagePathTrie}
+    used to cache the Resource paths of matched packages across calls.
+
+    `session` is an optional MatchSession where Resources are tagged. Without a
+    `session`, the tagged Resources are saved right away.
     """
+    if package_path_tries is None:
+        package_path_tries = {}
+
+    flush = session is None
+    if flush:
+        session = MatchSession(codebase)
+
+    # Paths of the children of `resource` that are not matched by any match
+    unmatched_paths = None
     for match in matches:
         # Prep matched package data and append to `codebase`
         matched_package_info = match.package.to_dict()
@@ -204,17 +419,177 @@ def tag_matched_resources(resource, codebase, matches, match_type):
 
         purl = match.package.package_url
         # Tag the Resource where we found a match
-        tag_matched_resource(resource, codebase, purl)
+        session.tag(resource, purl)
 
-        # Find matching package child path for `resource` by creating all possible
-        # path suffixes from `child.path`, chaining them in Q objects (joined
-        # by or), then querying the matched packages resources to see if any of
-        # those suffixes match a package child resource path
+        # Find matching package child path for `resource` by checking if any of
+        # the path suffixes of `child.path` is a package resource path
+        package_path_trie = get_package_path_trie(match.package, package_path_tries)
+        match_unmatched_paths = set()
         for child in resource.walk(codebase):
-            query = reduce(or_, (Q(path=suffix) for suffix in path_suffixes(child.path)), Q())
-            matched_child_resources = match.package.resources.filter(query)
-            if len(matched_child_resources) > 0:
-                tag_matched_resource(child, codebase, purl)
+            if package_path_trie.has_path_suffix(child.path):
+                session.tag(child, purl)
+            elif not session.is_matched(child):
+                match_unmatched_paths.add(child.path)
+
+        if unmatched_paths is None:
+            unmatched_paths = match_unmatched_paths
+        else:
+            unmatched_paths &= match_unmatched_paths
+
+    if unmatched_paths is not None and not unmatched_paths and resource.is_dir:
+        session.add_matched_subtree(resource)
+
+    if flush:
+        session.flush()
+
+
+def get_package_path_trie(package, package_path_tries):
+    """
+    Return a PackagePathTrie of the Resource paths of `package`, loading it
+    once and caching it in the `package_path_tries` mapping.
+    """
+    package_path_trie = package_path_tries.get(package.id)
+    if package_path_trie is None:
+        paths = package.resources.values_list('path', flat=True)
+        package_path_trie = PackagePathTrie(paths.iterator())
+        package_path_tries[package.id] = package_path_trie
+    return package_path_trie
+
+
+class PackagePathTrie:
+    """
+    A trie of the reversed path segments of the Resource paths of a Package.
+
+    A path suffix of a codebase Resource is a Package Resource path when the
+    reversed segments of that Package Resource path are a prefix of the
+    reversed segments of the codebase Resource path. All the path suffixes are
+    checked at once with a single walk down the trie.
+
+    For example:
+    >>> trie = PackagePathTrie(['foo/bar/baz.c', 'qux.h'])
+    >>> trie.has_path_suffix('/src/foo/bar/baz.c')
+    True
+    >>> trie.has_path_suffix('src/bar/baz.c')
+    False
+    >>> trie.has_path_suffix('include/qux.h')
+    True
+    """
+    # Mark the end of a path. This cannot collide with a path segment string.
+    PATH_END = None
+
+    def __init__(self, paths=()):
+        self.root = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path):
+        """
+        Add the `path` string to this trie.
+        """
+        node = self.root
+        for segment in reversed(path.split('/')):
+            node = node.setdefault(segment, {})
+        node[self.PATH_END] = True
+
+    def has_path_suffix(self, path):
+        """
+        Return True if any of the path suffixes of `path` is a path of this
+        trie.
+        """
+        node = self.root
+        for segment in reversed(path.strip('/').split('/')):
+            node = node.get(segment)
+            if node is None:
+                return False
+            if self.PATH_END in node:
+                return True
+        return False
+
+
+class MatchSession:
+    """
+    Track in memory the matched Resources of a `codebase` across the matchers
+    run on this codebase.
+
+    Tagged Resources are saved once when the session is flushed rather than
+    each time they are tagged, and the directories whose whole subtree is
+    matched are not walked again by the next matchers.
+    """
+
+    def __init__(self, codebase):
+        self.codebase = codebase
+        # Set of the paths of the matched Resources
+        self.matched_paths = set()
+        # Set of the paths of the directories whose whole subtree is matched
+        self.matched_subtree_paths = set()
+        # Mapping of {path: Resource} of the Resources to save
+        self.updated_resources = {}
+
+    def walk(self):
+        """
+        Yield the Resources of the codebase top-down, skipping the descendants
+        of the directories whose whole subtree is matched.
+        """
+        return self.codebase.walk(topdown=True, ignored=self.is_in_matched_subtree)
+
+    def is_in_matched_subtree(self, resource, codebase=None):
+        """
+        Return True if the parent of `resource` is the root of a matched
+        subtree.
+        """
+        parent_path, _, _ = resource.path.rpartition('/')
+        return parent_path in self.matched_subtree_paths
+
+    def is_matched(self, resource):
+        """
+        Return True if `resource` is matched in this session or was matched
+        before.
+        """
+        return (
+            resource.path in self.matched_paths
+            or resource.extra_data.get('matched', False)
+        )
+
+    def get_resource(self, resource):
+        """
+        Return the Resource updated in this session with the path of
+        `resource` or `resource` itself.
+        """
+        return self.updated_resources.get(resource.path, resource)
+
+    def update(self, resource):
+        """
+        Save `resource` when this session is flushed.
+        """
+        self.updated_resources[resource.path] = resource
+
+    def tag(self, resource, purl):
+        """
+        Tag `resource` as matched to the `purl` Package URL string.
+        """
+        resource = self.get_resource(resource)
+        if purl not in resource.matched_to:
+            resource.matched_to.append(purl)
+        resource.extra_data['matched'] = True
+        self.matched_paths.add(resource.path)
+        self.update(resource)
+
+    def add_matched_subtree(self, resource):
+        """
+        Record that the directory `resource` and all its descendants are
+        matched.
+        """
+        self.matched_subtree_paths.add(resource.path)
+
+    def flush(self):
+        """
+        Save all the Resources updated in this session and return their count.
+        """
+        updated_count = len(self.updated_resources)
+        for resource in self.updated_resources.values():
+            resource.save(self.codebase)
+        self.updated_resources = {}
+        return updated_count
 
 
 def path_suffixes(path):
@@ -0,0 +1,62 @@
+# Generated by Django 4.1.2 on 2026-10-17 01:28
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models import Min
+
+
+def remove_duplicate_file_indexes(apps, schema_editor):
+    """
+    Remove duplicated (sha1, package) file index rows, keeping the oldest one,
+    before adding a unique constraint on these fields.
+    """
+    for model_name in ('ExactFileIndex', 'ExactPackageArchiveIndex'):
+        model = apps.get_model('matchcode', model_name)
+        duplicates = (
+            model.objects
+            .values('sha1', 'package')
+            .annotate(min_id=Min('id'), count=Count('id'))
+            .filter(count__gt=1)
+        )
+        for duplicate in duplicates.iterator():
+            model.objects.filter(
+                sha1=duplicate['sha1'],
+                package=duplicate['package'],
+            ).exclude(id=duplicate['min_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packagedb', '0067_alter_resource_md5_alter_resource_sha1_and_more'),
+        ('matchcode', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_file_indexes,
+            reverse_code=migrations.RunPython.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='exactfileindex',
+            unique_together={('sha1', 'package')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='exactpackagearchiveindex',
+            unique_together={('sha1', 'package')},
+        ),
+        migrations.CreateModel(
+            name='IndexingShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_package_id', models.IntegerField(help_text='The first Package id of this shard')),
+                ('end_package_id', models.IntegerField(help_text='The Package id right after the last Package id of this shard')),
+                ('last_indexed_package_id', models.IntegerField(blank=True, help_text='The id of the last Package indexed in this shard', null=True)),
+                ('completed_date', models.DateTimeField(blank=True, help_text='Timestamp set when all the Packages of this shard are indexed', null=True)),
+            ],
+            options={
+                'ordering': ['start_package_id'],
+                'unique_together': {('start_package_id', 'end_package_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.1.2 on 2026-10-17 02:05
+
+from django.db import migrations, models
+
+
+# Compute the signed 64-bit integer halves of the fingerprints of existing rows
+# from their four 4-byte chunks
+BACKFILL_SQL = """
+UPDATE {table} SET
+    fingerprint_high = ('x' || encode(chunk1 || chunk2, 'hex'))::bit(64)::bigint,
+    fingerprint_low = ('x' || encode(chunk3 || chunk4, 'hex'))::bit(64)::bigint;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchcode', '0002_indexingshard_and_file_index_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='approximatedirectorycontentindex',
+            name='fingerprint_high',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the first 16 (0-15) hex digits of the fingerprint, used to compute Hamming distances in the database', null=True),
+        ),
+        migrations.AddField(
+            model_name='approximatedirectorycontentindex',
+            name='fingerprint_low',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the last 16 (16-31) hex digits of the fingerprint, used to compute Hamming distances in the database', null=True),
+        ),
+        migrations.AddField(
+            model_name='approximatedirectorystructureindex',
+            name='fingerprint_high',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the first 16 (0-15) hex digits of the fingerprint, used to compute Hamming distances in the database', null=True),
+        ),
+        migrations.AddField(
+            model_name='approximatedirectorystructureindex',
+            name='fingerprint_low',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the last 16 (16-31) hex digits of the fingerprint, used to compute Hamming distances in the database', null=True),
+        ),
+        migrations.RunSQL(
+            sql=BACKFILL_SQL.format(table='matchcode_approximatedirectorycontentindex'),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            sql=BACKFILL_SQL.format(table='matchcode_approximatedirectorystructureindex'),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='approximatedirectorycontentindex',
+            name='fingerprint_high',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the first 16 (0-15) hex digits of the fingerprint, used to compute Hamming distances in the database'),
+        ),
+        migrations.AlterField(
+            model_name='approximatedirectorycontentindex',
+            name='fingerprint_low',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the last 16 (16-31) hex digits of the fingerprint, used to compute Hamming distances in the database'),
+        ),
+        migrations.AlterField(
+            model_name='approximatedirectorystructureindex',
+            name='fingerprint_high',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the first 16 (0-15) hex digits of the fingerprint, used to compute Hamming distances in the database'),
+        ),
+        migrations.AlterField(
+            model_name='approximatedirectorystructureindex',
+            name='fingerprint_low',
+            field=models.BigIntegerField(help_text='Signed 64-bit integer form of the last 16 (16-31) hex digits of the fingerprint, used to compute Hamming distances in the database'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.2 on 2026-10-17 01:49
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+# Populate the package sets from the existing ExactFileIndex rows: only the
+# first 100 package ids of a SHA1 are stored
+POPULATE_SQL = """
+INSERT INTO matchcode_exactfilepackageset (sha1, package_ids, packages_count)
+SELECT sha1, (array_agg(package_id ORDER BY package_id))[1:100], count(*)
+FROM matchcode_exactfileindex
+GROUP BY sha1;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchcode', '0003_directory_index_fingerprint_halves'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExactFilePackageSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha1', models.BinaryField(help_text='Binary form of a SHA1 checksum in lowercase hex for a file', max_length=20, unique=True)),
+                ('package_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, help_text='The ids of up to 100 Packages that contain a file with this SHA1', size=None)),
+                ('packages_count', models.IntegerField(default=0, help_text='The number of Packages that contain a file with this SHA1')),
+            ],
+        ),
+        migrations.RunSQL(
+            sql=POPULATE_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.2 on 2026-10-17 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matchcode', '0004_exactfilepackageset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index_name', models.CharField(help_text='The name of the index model', max_length=100, unique=True)),
+                ('generation', models.BigIntegerField(default=0, help_text='The generation of the index, incremented when the index is updated')),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.2 on 2026-10-17 02:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packagedb', '0068_package_indexed_resources_digest'),
+        ('matchcode', '0005_indexgeneration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExactGitBlobIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha1', models.BinaryField(db_index=True, help_text='Binary form of a SHA1 checksum in lowercase hex for a file', max_length=20)),
+                ('package', models.ForeignKey(help_text='The Package that this file is from', on_delete=django.db.models.deletion.CASCADE, to='packagedb.package')),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('sha1', 'package')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.2 on 2026-10-17 02:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packagedb', '0068_package_indexed_resources_digest'),
+        ('matchcode', '0006_exactgitblobindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryColumnSums',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='The full path value of this directory', max_length=2000)),
+                ('files_count', models.IntegerField(help_text='Number of files under this directory')),
+                ('content_count', models.IntegerField(help_text='Number of elements that went into the content fingerprint')),
+                ('content_columns', models.BinaryField(help_text='Content fingerprint column sums as 128 little-endian 32-bit integers', max_length=512)),
+                ('structure_count', models.IntegerField(help_text='Number of elements that went into the structure fingerprint')),
+                ('structure_columns', models.BinaryField(help_text='Structure fingerprint column sums as 128 little-endian 32-bit integers', max_length=512)),
+                ('file_states', models.JSONField(default=dict, help_text='Mapping of {file name: [sha1, size]} of the files directly in this directory when it was last indexed')),
+                ('package', models.ForeignKey(help_text='The Package that this directory is a part of', on_delete=django.db.models.deletion.CASCADE, to='packagedb.package')),
+            ],
+            options={
+                'unique_together': {('package', 'path')},
+            },
+        ),
+    ]
@@ -8,20 +8,38 @@
 #
 
 from collections import defaultdict
+from contextlib import contextmanager
+from copy import copy
 from datetime import datetime
 import binascii
 import logging
 import sys
 
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection
 from django.db import models
+from django.db import transaction
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 from django.forms.models import model_to_dict
 from django.utils.translation import gettext_lazy as _
 
+import numpy
+
 from minecode.management.commands import get_error_message
+from matchcode.bloom import get_bloom_filter
+from matchcode.cache import get_match_cache
+from matchcode.hamming import DEFAULT_THRESHOLD
+from matchcode.hamming import MAX_THRESHOLD
+from matchcode.hamming import get_bigint_halves
+from matchcode.hamming import get_chunk_neighbors
+from matchcode.hamming import get_chunk_search_radii
+from matchcode.snapshot import get_snapshot
 from matchcode_toolkit.fingerprinting import create_halohash_chunks
+from matchcode_toolkit.fingerprinting import DirectoryColumns
 from matchcode_toolkit.fingerprinting import hexstring_to_binarray
 from matchcode_toolkit.fingerprinting import split_fingerprint
-from matchcode_toolkit.halohash import byte_hamming_distance
 from packagedb.models import Package
 
 
@@ -44,6 +62,10 @@ def logger_debug(*args):
 ###############################################################################
 # FILE MATCHING
 ###############################################################################
+# Number of SHA1s looked up in a single query when matching in batches
+SHA1_MATCH_CHUNK_SIZE = 5000
+
+
 class BaseFileIndex(models.Model):
     sha1 = models.BinaryField(
         max_length=20,
@@ -62,16 +84,21 @@ class BaseFileIndex(models.Model):
 
     class Meta:
         abstract = True
+        unique_together = ['sha1', 'package']
 
     @classmethod
     def index(cls, sha1, package):
         try:
             sha1_bin = hexstring_to_binarray(sha1)
-            bfi, created = cls.objects.get_or_create(
-                package=package,
-                sha1=sha1_bin
-            )
+            with transaction.atomic():
+                cls.lock_inserts()
+                bfi, created = cls.objects.get_or_create(
+                    package=package,
+                    sha1=sha1_bin
+                )
             if created:
+                cls.add_to_bloom_filter([sha1_bin])
+                IndexGeneration.bump(cls)
                 logger.info(
                     '{} - Inserted {} for Package {}:\t{}'.format(
                         datetime.utcnow().isoformat(),
@@ -92,15 +119,34 @@ class BaseFileIndex(models.Model):
     def match(cls, sha1):
         """
         Return a list of matched Packages that contains a file with a SHA1 value of `sha1`
+
+        Matches are cached when the match cache is enabled, see `matchcode.cache`.
         """
         if TRACE:
             logger_debug(cls.__name__, 'match:', 'sha1:', sha1)
 
         if not sha1:
-            return cls.objects.none()
+            return []
 
-        sha1_in_bin = hexstring_to_binarray(sha1)
-        matches = cls.objects.filter(sha1=sha1_in_bin)
+        match_cache = get_match_cache()
+        if match_cache:
+            return match_cache.get_or_match(
+                index_name=cls.__name__,
+                fingerprint=sha1,
+                threshold=None,
+                match_function=lambda: cls._match(sha1),
+            )
+        return cls._match(sha1)
+
+    @classmethod
+    def _match(cls, sha1):
+        lookups = cls.get_sha1_lookups([sha1])
+        matches = cls.objects.none()
+        for sha1s_to_lookup, extra_filter in lookups:
+            if sha1s_to_lookup:
+                sha1_in_bin = hexstring_to_binarray(sha1)
+                matches = cls.objects.filter(extra_filter, sha1=sha1_in_bin)
+        matches = list(matches.select_related('package').order_by('pk'))
         if TRACE:
             for match in matches:
                 package = match.package
@@ -108,6 +154,150 @@ class BaseFileIndex(models.Model):
                 logger_debug(cls.__name__, 'match:', 'matched_file:', dct)
         return matches
 
+    @classmethod
+    def lock_inserts(cls, exclusive=False):
+        """
+        Lock the inserts of rows in this index until the end of the current
+        transaction.
+
+        The transactions that insert rows take a shared lock before their
+        first insert and do not block each other. An exclusive lock waits
+        until all these transactions are committed or rolled back, see
+        `get_max_committed_id`.
+        """
+        lock_function = 'pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {lock_function}(hashtext(%s))',
+                [f'matchcode.{cls._meta.db_table}.inserts'],
+            )
+
+    @classmethod
+    def get_max_committed_id(cls):
+        """
+        Return the largest row id of this index such that all the rows with a
+        lower or equal id are committed, or 0 if there are no rows.
+
+        Row ids come from a sequence and a transaction that is still inserting
+        rows may hold ids lower than the largest committed id. The largest id
+        is read under an exclusive insert lock, once all the transactions that
+        were inserting rows are over: the rows inserted later have larger ids.
+        """
+        with transaction.atomic():
+            cls.lock_inserts(exclusive=True)
+            return cls.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    @classmethod
+    def get_sha1_lookups(cls, sha1s):
+        """
+        Return a list of (SHA1s, Q filter) tuples for the SHA1 strings in
+        `sha1s` such that the rows of this index for these SHA1s can be found
+        by looking up each list of sorted SHA1s with its extra Q filter.
+
+        The Bloom filter and the snapshot of this index, when they exist, are
+        used to find the SHA1s that are certainly not in the rows covered by
+        them. These SHA1s are only looked up in the rows indexed later, if any.
+
+        This relies on the prefilters covering all the rows with an id up to
+        their `max_index_id`: this id is read with `get_max_committed_id` and
+        all the rows are inserted under the lock of `lock_inserts`, such that
+        no row with a lower id can be committed after a prefilter is built.
+        """
+        unique_sha1s = sorted(set(sha1 for sha1 in sha1s if sha1))
+        sha1s_to_lookup = unique_sha1s
+        max_covered_index_id = None
+        for prefilter in (get_bloom_filter(cls), get_snapshot(cls)):
+            if not prefilter or not sha1s_to_lookup:
+                continue
+            possible_sha1s = prefilter.contains_many(sha1s_to_lookup)
+            sha1s_to_lookup = [sha1 for sha1 in sha1s_to_lookup if sha1 in possible_sha1s]
+            if max_covered_index_id is None:
+                max_covered_index_id = prefilter.max_index_id
+            else:
+                max_covered_index_id = min(max_covered_index_id, prefilter.max_index_id)
+
+        if max_covered_index_id is None:
+            return [(unique_sha1s, models.Q())]
+
+        lookups = [(sha1s_to_lookup, models.Q())]
+        other_sha1s = sorted(set(unique_sha1s).difference(sha1s_to_lookup))
+        new_rows = models.Q(pk__gt=max_covered_index_id)
+        if other_sha1s and cls.objects.filter(new_rows).exists():
+            # SHA1s that are certainly not in the covered rows can only be in
+            # the rows indexed after the prefilters were built
+            lookups.append((other_sha1s, new_rows))
+        return lookups
+
+    @classmethod
+    def add_to_bloom_filter(cls, sha1s):
+        """
+        Add the `sha1s` list of SHA1 bytes to the Bloom filter of this index,
+        if any.
+        """
+        bloom_filter = get_bloom_filter(cls)
+        if bloom_filter and bloom_filter.data.flags.writeable:
+            bloom_filter.add_many(sha1s)
+
+    @classmethod
+    def match_many_with_low_signal(cls, sha1s, chunk_size=SHA1_MATCH_CHUNK_SIZE):
+        """
+        Return a tuple of ({sha1: [matches]}, {sha1: packages count}) for the
+        SHA1 strings in `sha1s`. The first mapping is the same as returned by
+        `match_many`. The second mapping is of the low-signal SHA1s that are
+        not matched, as they are found in too many packages to be a useful
+        match.
+        """
+        return cls.match_many(sha1s, chunk_size=chunk_size), {}
+
+    @classmethod
+    def match_many(cls, sha1s, chunk_size=SHA1_MATCH_CHUNK_SIZE):
+        """
+        Return a mapping of {sha1: [matches]} for the SHA1 strings in `sha1s`,
+        where the matches of a SHA1 are ordered by primary key.
+
+        The SHA1s are looked up in chunks of `chunk_size` using a single
+        `sha1 IN (...)` query per chunk rather than one query per SHA1. SHA1s
+        that do not match are not present in the returned mapping.
+
+        SHA1s that are certainly not indexed according to the Bloom filter or
+        the snapshot of this index are not looked up, see `get_sha1_lookups`.
+
+        Matches are cached when the match cache is enabled, see `matchcode.cache`:
+        only the SHA1s that are not cached are looked up.
+        """
+        if TRACE:
+            logger_debug(cls.__name__, 'match_many:', 'sha1s:', sha1s)
+
+        match_cache = get_match_cache()
+        if not match_cache:
+            return cls._match_many(sha1s, chunk_size=chunk_size)
+
+        matches_by_sha1 = match_cache.get_or_match_many(
+            index_name=cls.__name__,
+            fingerprints=set(sha1 for sha1 in sha1s if sha1),
+            threshold=None,
+            match_many_function=lambda sha1s: cls._match_many(sha1s, chunk_size=chunk_size),
+        )
+        return {sha1: matches for sha1, matches in matches_by_sha1.items() if matches}
+
+    @classmethod
+    def _match_many(cls, sha1s, chunk_size=SHA1_MATCH_CHUNK_SIZE):
+        matches_by_sha1 = defaultdict(list)
+        for sha1s_to_lookup, extra_filter in cls.get_sha1_lookups(sha1s):
+            for start in range(0, len(sha1s_to_lookup), chunk_size):
+                chunk = sha1s_to_lookup[start:start + chunk_size]
+                sha1s_in_bin = [hexstring_to_binarray(sha1) for sha1 in chunk]
+                matches = (
+                    cls.objects
+                    .filter(extra_filter, sha1__in=sha1s_in_bin)
+                    .select_related('package')
+                    .order_by('pk')
+                )
+                for match in matches.iterator(chunk_size=chunk_size):
+                    matches_by_sha1[match.fingerprint()].append(match)
+
+        return dict(matches_by_sha1)
+
     def fingerprint(self):
         return binascii.hexlify(self.sha1).decode('utf-8')
 
@@ -116,8 +306,252 @@ class ExactPackageArchiveIndex(BaseFileIndex):
     pass
 
 
+class ExactGitBlobIndex(BaseFileIndex):
+    """
+    An index of the git blob SHA1 of the Package files, as computed by git for
+    the files of a repository. The `sha1` field is the binary form of a git
+    blob SHA1.
+    """
+
+
 class ExactFileIndex(BaseFileIndex):
-    pass
+
+    @classmethod
+    def index(cls, sha1, package):
+        result = super().index(sha1, package)
+        if result and result[1]:
+            ExactFilePackageSet.add_packages([(hexstring_to_binarray(sha1), package.id)])
+        return result
+
+    @classmethod
+    def match_many(cls, sha1s, chunk_size=SHA1_MATCH_CHUNK_SIZE):
+        """
+        Return a mapping of {sha1: [matches]} for the SHA1 strings in `sha1s`.
+        See `match_many_with_low_signal`.
+        """
+        matches_by_sha1, _ = cls.match_many_with_low_signal(sha1s, chunk_size=chunk_size)
+        return matches_by_sha1
+
+    @classmethod
+    def match_many_with_low_signal(cls, sha1s, chunk_size=SHA1_MATCH_CHUNK_SIZE):
+        """
+        Return a tuple of ({sha1: [matches]}, {sha1: packages count}) for the
+        SHA1 strings in `sha1s`.
+
+        Unless the MATCHCODE_FILE_INDEX_READ_MODE setting is "rows", the
+        matches are read from the ExactFilePackageSet of each SHA1 and are
+        unsaved ExactFileIndex objects. Low-signal SHA1s of very common files
+        found in too many packages, such as a LICENSE file or an empty file,
+        are not matched and are returned with their packages count instead.
+        In the "dual" read mode, SHA1s without a complete package set are read
+        from the ExactFileIndex rows.
+
+        Matches are cached when the match cache is enabled, see `matchcode.cache`:
+        only the SHA1s that are not cached are looked up.
+        """
+        read_mode = settings.MATCHCODE_FILE_INDEX_READ_MODE
+        if read_mode == FILE_INDEX_READ_ROWS:
+            return super().match_many(sha1s, chunk_size=chunk_size), {}
+
+        match_cache = get_match_cache()
+        if not match_cache:
+            return cls._match_many_with_low_signal(sha1s, read_mode, chunk_size=chunk_size)
+
+        def match_many_function(sha1s):
+            matches_by_sha1, low_signal_sha1s = cls._match_many_with_low_signal(
+                sha1s, read_mode, chunk_size=chunk_size,
+            )
+            # Cache a tuple of (matches, low-signal packages count) for each SHA1
+            return {
+                sha1: (matches_by_sha1.get(sha1, []), low_signal_sha1s.get(sha1))
+                for sha1 in sha1s
+            }
+
+        # The matches read from the package sets are not the same as the
+        # matches of the rows: they are cached under the read mode
+        cached_by_sha1 = match_cache.get_or_match_many(
+            index_name=cls.__name__,
+            fingerprints=set(sha1 for sha1 in sha1s if sha1),
+            threshold=read_mode,
+            match_many_function=match_many_function,
+        )
+        matches_by_sha1 = {}
+        low_signal_sha1s = {}
+        for sha1, (matches, packages_count) in cached_by_sha1.items():
+            if matches:
+                matches_by_sha1[sha1] = matches
+            if packages_count:
+                low_signal_sha1s[sha1] = packages_count
+        return matches_by_sha1, low_signal_sha1s
+
+    @classmethod
+    def _match_many_with_low_signal(cls, sha1s, read_mode, chunk_size=SHA1_MATCH_CHUNK_SIZE):
+        sha1s_to_lookup = sorted(set(
+            sha1
+            for lookup_sha1s, _ in cls.get_sha1_lookups(sha1s)
+            for sha1 in lookup_sha1s
+        ))
+        package_sets = ExactFilePackageSet.match_many(sha1s_to_lookup, chunk_size=chunk_size)
+
+        fallback_sha1s = []
+        package_ids_by_sha1 = {}
+        low_signal_sha1s = {}
+        for sha1 in sha1s_to_lookup:
+            package_set = package_sets.get(sha1)
+            if package_set and package_set.is_complete:
+                package_ids_by_sha1[sha1] = package_set.package_ids
+            elif package_set and package_set.is_low_signal:
+                low_signal_sha1s[sha1] = package_set.packages_count
+            elif read_mode == FILE_INDEX_READ_DUAL:
+                fallback_sha1s.append(sha1)
+            elif package_set:
+                package_ids_by_sha1[sha1] = package_set.package_ids
+
+        package_ids = set(pid for pids in package_ids_by_sha1.values() for pid in pids)
+        packages_by_id = Package.objects.in_bulk(package_ids)
+        matches_by_sha1 = {}
+        for sha1, package_ids in package_ids_by_sha1.items():
+            matches = [
+                cls(sha1=hexstring_to_binarray(sha1), package=packages_by_id[package_id])
+                for package_id in package_ids
+                if package_id in packages_by_id
+            ]
+            if matches:
+                matches_by_sha1[sha1] = matches
+
+        if fallback_sha1s:
+            matches_by_sha1.update(super().match_many(fallback_sha1s, chunk_size=chunk_size))
+        return matches_by_sha1, low_signal_sha1s
+
+
+# Read modes of the ExactFileIndex matches
+# Read the ExactFileIndex rows
+FILE_INDEX_READ_ROWS = 'rows'
+# Read the ExactFilePackageSet and fallback to the ExactFileIndex rows
+FILE_INDEX_READ_DUAL = 'dual'
+# Only read the ExactFilePackageSet
+FILE_INDEX_READ_PACKAGE_SETS = 'package_sets'
+
+# Maximum number of package ids stored in an ExactFilePackageSet. SHA1s found
+# in more packages are low-signal and are not matched.
+PACKAGE_SET_MAX_SIZE = 100
+
+
+class ExactFilePackageSet(models.Model):
+    """
+    A compact layout of the ExactFileIndex with a single row per SHA1 and the
+    ids of the packages that contain a file with this SHA1.
+
+    For very common files, only the first PACKAGE_SET_MAX_SIZE package ids are
+    stored together with the total count of packages.
+    """
+    sha1 = models.BinaryField(
+        max_length=20,
+        unique=True,
+        help_text='Binary form of a SHA1 checksum in lowercase hex for a file',
+    )
+
+    package_ids = ArrayField(
+        base_field=models.IntegerField(),
+        default=list,
+        help_text=f'The ids of up to {PACKAGE_SET_MAX_SIZE} Packages that contain '
+                  f'a file with this SHA1',
+    )
+
+    packages_count = models.IntegerField(
+        default=0,
+        help_text='The number of Packages that contain a file with this SHA1',
+    )
+
+    def __str__(self):
+        return self.fingerprint()
+
+    def fingerprint(self):
+        return binascii.hexlify(self.sha1).decode('utf-8')
+
+    @property
+    def is_low_signal(self):
+        """
+        Return True if this SHA1 is found in too many packages to be a useful
+        match.
+        """
+        return self.packages_count > PACKAGE_SET_MAX_SIZE
+
+    @property
+    def is_complete(self):
+        """
+        Return True if all the package ids of this SHA1 are stored.
+        """
+        return len(self.package_ids) == self.packages_count
+
+    @classmethod
+    def match_many(cls, sha1s, chunk_size=SHA1_MATCH_CHUNK_SIZE):
+        """
+        Return a mapping of {sha1: ExactFilePackageSet} for the SHA1 strings in
+        `sha1s`.
+        """
+        unique_sha1s = sorted(set(sha1 for sha1 in sha1s if sha1))
+        package_sets_by_sha1 = {}
+        for start in range(0, len(unique_sha1s), chunk_size):
+            chunk = unique_sha1s[start:start + chunk_size]
+            sha1s_in_bin = [hexstring_to_binarray(sha1) for sha1 in chunk]
+            for package_set in cls.objects.filter(sha1__in=sha1s_in_bin):
+                package_sets_by_sha1[package_set.fingerprint()] = package_set
+        return package_sets_by_sha1
+
+    @classmethod
+    def add_packages(cls, rows):
+        """
+        Add the `rows` iterable of newly indexed (sha1 bytes, package id) to
+        the package sets of their SHA1.
+
+        All the package sets are upserted in a single statement, in SHA1
+        order, such that concurrent indexing transactions lock the package
+        set rows in the same order and do not deadlock.
+        """
+        rows = sorted(set((bytes(sha1), package_id) for sha1, package_id in rows))
+        if not rows:
+            return
+
+        table = cls._meta.db_table
+        query = f"""
+            INSERT INTO {table} AS package_set (sha1, package_ids, packages_count)
+            SELECT
+                row.sha1,
+                (array_agg(row.package_id ORDER BY row.package_id))[1:{PACKAGE_SET_MAX_SIZE}],
+                count(*)
+            FROM unnest(%s::bytea[], %s::integer[]) AS row (sha1, package_id)
+            GROUP BY row.sha1
+            ORDER BY row.sha1
+            ON CONFLICT (sha1) DO UPDATE SET
+                package_ids = (package_set.package_ids || EXCLUDED.package_ids)[1:{PACKAGE_SET_MAX_SIZE}],
+                packages_count = package_set.packages_count + EXCLUDED.packages_count
+        """
+        sha1s = [sha1 for sha1, _ in rows]
+        package_ids = [package_id for _, package_id in rows]
+        with connection.cursor() as cursor:
+            cursor.execute(query, [sha1s, package_ids])
+
+    @classmethod
+    def remove_package(cls, package_id):
+        """
+        Remove the package with `package_id` from the package sets of the SHA1s
+        of its ExactFileIndex rows. This must be called before these rows are
+        deleted.
+        """
+        table = cls._meta.db_table
+        file_index_table = ExactFileIndex._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table} SET
+                    package_ids = array_remove(package_ids, %s),
+                    packages_count = packages_count - 1
+                WHERE sha1 IN (SELECT sha1 FROM {file_index_table} WHERE package_id = %s)
+                """,
+                [package_id, package_id],
+            )
+        cls.objects.filter(packages_count__lte=0).delete()
 
 
 ################################################################################
@@ -138,6 +572,39 @@ def bah128_ranges(indexed_elements_count, range_ratio=0.05):
     )
 
 
+def get_bit_count_template(connection):
+    """
+    Return an SQL template string of the number of bits set in a bigint
+    `%(expressions)s` for the PostgreSQL `connection`.
+    """
+    if connection.pg_version >= 140000:
+        return 'bit_count((%(expressions)s)::bit(64))'
+    return "length(replace((%(expressions)s)::bit(64)::text, '0', ''))"
+
+
+class BitXorCount(models.Func):
+    """
+    Return the number of bits set in the bitwise XOR of two bigint expressions,
+    e.g., their Hamming distance.
+    """
+    arg_joiner = ' # '
+    output_field = models.IntegerField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        template = get_bit_count_template(connection)
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+
+# Number of directory fingerprints looked up in a single query when matching
+# exact fingerprints in batches
+DIRECTORY_MATCH_CHUNK_SIZE = 1000
+
+# Number of directory fingerprints looked up in a single query when matching
+# approximate fingerprints in batches: each fingerprint is looked up with all
+# the neighbors of its chunks
+APPROXIMATE_DIRECTORY_MATCH_CHUNK_SIZE = 100
+
+
 class BaseDirectoryIndex(models.Model):
     indexed_elements_count = models.IntegerField(
         help_text='Number of elements that went into the fingerprint',
@@ -175,6 +642,16 @@ class BaseDirectoryIndex(models.Model):
         blank=False
     )
 
+    fingerprint_high = models.BigIntegerField(
+        help_text='Signed 64-bit integer form of the first 16 (0-15) hex digits '
+                  'of the fingerprint, used to compute Hamming distances in the database',
+    )
+
+    fingerprint_low = models.BigIntegerField(
+        help_text='Signed 64-bit integer form of the last 16 (16-31) hex digits '
+                  'of the fingerprint, used to compute Hamming distances in the database',
+    )
+
     package = models.ForeignKey(
         Package,
         help_text='The Package that this directory is a part of',
@@ -202,6 +679,7 @@ class BaseDirectoryIndex(models.Model):
         try:
             indexed_elements_count, fp = split_fingerprint(directory_fingerprint)
             fp_chunk1, fp_chunk2, fp_chunk3, fp_chunk4 = create_halohash_chunks(fp)
+            fingerprint_high, fingerprint_low = get_bigint_halves(fp)
             bdi, created = cls.objects.get_or_create(
                 indexed_elements_count=indexed_elements_count,
                 chunk1=fp_chunk1,
@@ -210,8 +688,13 @@ class BaseDirectoryIndex(models.Model):
                 chunk4=fp_chunk4,
                 path=resource_path,
                 package=package,
+                defaults=dict(
+                    fingerprint_high=fingerprint_high,
+                    fingerprint_low=fingerprint_low,
+                ),
             )
             if created:
+                IndexGeneration.bump(cls)
                 logger.info(
                     '{} - Inserted {} for Package {}:\t{}'.format(
                         datetime.utcnow().isoformat(),
@@ -229,76 +712,129 @@ class BaseDirectoryIndex(models.Model):
             logger.error(msg)
 
     @classmethod
-    def match(cls, directory_fingerprint):
+    def from_fingerprint(cls, directory_fingerprint, resource_path, package):
         """
-        Return a list of matched Packages
+        Return a new unsaved BaseDirectoryIndex for the string
+        `directory_fingerprint` of the directory at `resource_path` in `package`
         """
-        if TRACE:
-            logger_debug(cls.__name__, 'match:', 'directory_fingerprint:', directory_fingerprint)
+        indexed_elements_count, fp = split_fingerprint(directory_fingerprint)
+        fp_chunk1, fp_chunk2, fp_chunk3, fp_chunk4 = create_halohash_chunks(fp)
+        fingerprint_high, fingerprint_low = get_bigint_halves(fp)
+        return cls(
+            indexed_elements_count=indexed_elements_count,
+            chunk1=fp_chunk1,
+            chunk2=fp_chunk2,
+            chunk3=fp_chunk3,
+            chunk4=fp_chunk4,
+            fingerprint_high=fingerprint_high,
+            fingerprint_low=fingerprint_low,
+            path=resource_path,
+            package=package,
+        )
 
-        if not directory_fingerprint:
-            return cls.objects.none()
+    @classmethod
+    def get_chunk_lookups(cls, directory_fingerprint, threshold=DEFAULT_THRESHOLD):
+        """
+        Return a list of (chunk field name, [chunk values]) tuples of the chunk
+        values to look up to find every indexed fingerprint within a Hamming
+        distance of `threshold` of `directory_fingerprint`.
 
-        # Step 1: find fingerprints with matching chunks
-        indexed_elements_count, bah128 = split_fingerprint(directory_fingerprint)
-        chunk1, chunk2, chunk3, chunk4 = create_halohash_chunks(bah128)
-        range = bah128_ranges(indexed_elements_count)
-        matches = cls.objects.filter(
-            models.Q(
-                indexed_elements_count__range=range,
-                chunk1=chunk1
-            ) |
-            models.Q(
-                indexed_elements_count__range=range,
-                chunk2=chunk2
-            ) |
-            models.Q(
-                indexed_elements_count__range=range,
-                chunk3=chunk3
-            ) |
-            models.Q(
-                indexed_elements_count__range=range,
-                chunk4=chunk4
+        Candidates are found using multi-index hashing: each chunk of the
+        fingerprint is looked up together with all its neighbors within a
+        search radius derived from `threshold`.
+        """
+        if not 0 <= threshold <= MAX_THRESHOLD:
+            raise ValueError(
+                f'Invalid threshold: {threshold}: must be between 0 and {MAX_THRESHOLD}'
             )
-        )
 
-        if TRACE:
-            for match in matches:
-                dct = model_to_dict(match)
-                logger_debug(cls.__name__, 'match:', 'matched_package:', dct)
+        _, bah128 = split_fingerprint(directory_fingerprint)
+        chunks = create_halohash_chunks(bah128)
+        radii = get_chunk_search_radii(threshold, chunks_count=len(chunks))
+        chunk_fields = ['chunk1', 'chunk2', 'chunk3', 'chunk4']
+        return [
+            (chunk_field, list(get_chunk_neighbors(bytes(chunk), radius)))
+            for chunk_field, chunk, radius in zip(chunk_fields, chunks, radii)
+            if radius >= 0
+        ]
 
-        # Step 2: calculate Hamming distance of all matches
+    @classmethod
+    def get_candidates(cls, directory_fingerprint, threshold=DEFAULT_THRESHOLD):
+        """
+        Return a queryset of the candidate matches for `directory_fingerprint`
+        that is guaranteed to contain every indexed fingerprint within a
+        Hamming distance of `threshold` that has a similar indexed elements
+        count. See `get_chunk_lookups`.
+        """
+        chunks_query = models.Q()
+        for chunk_field, chunks in cls.get_chunk_lookups(directory_fingerprint, threshold):
+            if len(chunks) == 1:
+                chunks_query |= models.Q(**{chunk_field: chunks[0]})
+            else:
+                chunks_query |= models.Q(**{f'{chunk_field}__in': chunks})
 
-        # Store all close matches in a dictionary of querysets
-        matches_by_hamming_distance = defaultdict(cls.objects.none)
-        for match in matches:
-            # Get fingerprint from the match
-            fp = match.fingerprint()
-            _, match_bah128 = split_fingerprint(fp)
+        indexed_elements_count, _ = split_fingerprint(directory_fingerprint)
+        range = bah128_ranges(indexed_elements_count)
+        return cls.objects.filter(
+            chunks_query,
+            indexed_elements_count__range=range,
+        )
 
-            # Perform Hamming distance calculation between the fingerprint we
-            # are looking up and a potential match fingerprint
-            hd = byte_hamming_distance(bah128, match_bah128)
+    @classmethod
+    def match(cls, directory_fingerprint, threshold=DEFAULT_THRESHOLD):
+        """
+        Return a list of matches for `directory_fingerprint` within a Hamming
+        distance of `threshold`, ranked from the lowest to the highest Hamming
+        distance. The Hamming distance of each match is available in its
+        `hamming_distance` attribute.
 
-            # TODO: try other thresholds if this is too restrictive
-            if hd < 8:
-                # Save match to `matches_by_hamming_distance` by adding the matched object to the queryset
-                matches_by_hamming_distance[hd] |= cls.objects.filter(pk=match.pk)
+        If there are exact matches, only the exact matches are returned.
 
+        Matches are cached when the match cache is enabled, see `matchcode.cache`.
+        """
         if TRACE:
-            logger_debug(list(matches_by_hamming_distance.items()))
+            logger_debug(cls.__name__, 'match:', 'directory_fingerprint:', directory_fingerprint)
+
+        if not directory_fingerprint:
+            return []
+
+        match_cache = get_match_cache()
+        if match_cache:
+            return match_cache.get_or_match(
+                index_name=cls.__name__,
+                fingerprint=directory_fingerprint,
+                threshold=threshold,
+                match_function=lambda: cls._match(directory_fingerprint, threshold),
+            )
+        return cls._match(directory_fingerprint, threshold)
+
+    @classmethod
+    def _match(cls, directory_fingerprint, threshold):
+        # Step 1: find candidate fingerprints with close enough chunks and
+        # compute their Hamming distance in the database, only returning the
+        # candidates within the threshold
+        _, bah128 = split_fingerprint(directory_fingerprint)
+        fingerprint_high, fingerprint_low = get_bigint_halves(bah128)
+        hamming_distance = (
+            BitXorCount('fingerprint_high', models.Value(fingerprint_high))
+            + BitXorCount('fingerprint_low', models.Value(fingerprint_low))
+        )
+        candidates = (
+            cls.get_candidates(directory_fingerprint, threshold=threshold)
+            .annotate(hamming_distance=hamming_distance)
+            .filter(hamming_distance__lte=threshold)
+        )
 
-        # Step 3: order matches from lowest Hamming distance to highest Hamming distance
+        # Step 2: order matches from lowest Hamming distance to highest Hamming
+        # distance. If we have an exact match, disregard the others.
         # TODO: consider limiting matches for brevity
-        good_matches = cls.objects.none()
-        for hamming_distance, match in sorted(matches_by_hamming_distance.items()):
-            if hamming_distance == 0:
-                # If we have an exact match, return and disregard others
-                good_matches |= match
-                break
-            else:
-                # If we don't have an exact match, add all close matches we have
-                good_matches |= match
+        good_matches = list(
+            candidates
+            .select_related('package')
+            .order_by('hamming_distance', 'pk')
+        )
+        if good_matches and good_matches[0].hamming_distance == 0:
+            good_matches = [m for m in good_matches if m.hamming_distance == 0]
 
         if TRACE:
             for match in good_matches:
@@ -307,6 +843,176 @@ class BaseDirectoryIndex(models.Model):
 
         return good_matches
 
+    @classmethod
+    def match_many(cls, directory_fingerprints, threshold=DEFAULT_THRESHOLD, chunk_size=DIRECTORY_MATCH_CHUNK_SIZE):
+        """
+        Return a mapping of {directory fingerprint: [matches]} for the
+        `directory_fingerprints` strings with the same matches as `match`.
+        Fingerprints that do not match are not present in the returned mapping.
+
+        The exact matches of all the fingerprints are looked up together in
+        chunks of `chunk_size` fingerprints. Only the fingerprints without an
+        exact match are then matched approximately, also in batches, see
+        `match_many_approximate`.
+
+        Matches are cached when the match cache is enabled, see `matchcode.cache`:
+        only the fingerprints that are not cached are looked up.
+        """
+        if TRACE:
+            logger_debug(cls.__name__, 'match_many:', 'directory_fingerprints:', directory_fingerprints)
+
+        match_cache = get_match_cache()
+        if not match_cache:
+            return cls._match_many(directory_fingerprints, threshold, chunk_size=chunk_size)
+
+        matches_by_fingerprint = match_cache.get_or_match_many(
+            index_name=cls.__name__,
+            fingerprints=set(fp for fp in directory_fingerprints if fp),
+            threshold=threshold,
+            match_many_function=lambda fingerprints: cls._match_many(
+                fingerprints, threshold, chunk_size=chunk_size,
+            ),
+        )
+        return {fp: matches for fp, matches in matches_by_fingerprint.items() if matches}
+
+    @classmethod
+    def _match_many(cls, directory_fingerprints, threshold, chunk_size=DIRECTORY_MATCH_CHUNK_SIZE):
+        fingerprints = sorted(set(fp for fp in directory_fingerprints if fp))
+        matches_by_fingerprint = defaultdict(list)
+        for start in range(0, len(fingerprints), chunk_size):
+            chunk = fingerprints[start:start + chunk_size]
+            # Mapping of {(fingerprint high, fingerprint low): [(fingerprint, indexed elements count range)]}
+            fingerprints_by_halves = defaultdict(list)
+            chunks_by_field = defaultdict(set)
+            for fingerprint in chunk:
+                indexed_elements_count, bah128 = split_fingerprint(fingerprint)
+                halves = get_bigint_halves(bah128)
+                fingerprints_by_halves[halves].append(
+                    (fingerprint, bah128_ranges(indexed_elements_count))
+                )
+                for index, fp_chunk in enumerate(create_halohash_chunks(bah128), 1):
+                    chunks_by_field[f'chunk{index}__in'].add(bytes(fp_chunk))
+
+            # Each chunk of a candidate is a chunk of one of the fingerprints:
+            # the exact matches are checked on their fingerprint halves
+            candidates = (
+                cls.objects
+                .filter(**chunks_by_field)
+                .select_related('package')
+                .order_by('pk')
+            )
+            for candidate in candidates.iterator(chunk_size=chunk_size):
+                halves = candidate.fingerprint_high, candidate.fingerprint_low
+                for fingerprint, (min_count, max_count) in fingerprints_by_halves.get(halves, []):
+                    if min_count <= candidate.indexed_elements_count <= max_count:
+                        candidate.hamming_distance = 0
+                        matches_by_fingerprint[fingerprint].append(candidate)
+
+        if threshold:
+            unmatched_fingerprints = [
+                fingerprint for fingerprint in fingerprints
+                if fingerprint not in matches_by_fingerprint
+            ]
+            matches_by_fingerprint.update(
+                cls.match_many_approximate(unmatched_fingerprints, threshold)
+            )
+
+        return dict(matches_by_fingerprint)
+
+    @classmethod
+    def match_many_approximate(
+        cls,
+        directory_fingerprints,
+        threshold=DEFAULT_THRESHOLD,
+        chunk_size=APPROXIMATE_DIRECTORY_MATCH_CHUNK_SIZE,
+    ):
+        """
+        Return a mapping of {directory fingerprint: [matches]} of the matches
+        within a Hamming distance of `threshold` of the `directory_fingerprints`
+        strings, ranked from the lowest to the highest Hamming distance as in
+        `match`.
+
+        The fingerprints are looked up in chunks of `chunk_size` fingerprints
+        with a single query per chunk: the neighbors of the chunks of all the
+        fingerprints are joined against the chunk columns of this index and
+        the Hamming distances of the candidates are computed and filtered on
+        `threshold` in the database.
+        """
+        table = cls._meta.db_table
+        bit_count = get_bit_count_template(connection)
+        hamming_distance = (
+            bit_count % dict(expressions='directory_index.fingerprint_high # query.fingerprint_high')
+            + ' + '
+            + bit_count % dict(expressions='directory_index.fingerprint_low # query.fingerprint_low')
+        )
+        candidates_by_chunk = ' UNION '.join(
+            f"""
+            SELECT query_chunk.query_id, directory_index.id
+            FROM query_chunk
+            JOIN {table} AS directory_index ON directory_index.{chunk_field} = query_chunk.chunk
+            WHERE query_chunk.chunk_field = '{chunk_field}'
+            """
+            for chunk_field in ('chunk1', 'chunk2', 'chunk3', 'chunk4')
+        )
+        query = f"""
+            WITH query AS (
+                SELECT * FROM unnest(
+                    %s::integer[], %s::bigint[], %s::bigint[], %s::integer[], %s::integer[]
+                ) AS query (query_id, fingerprint_high, fingerprint_low, min_count, max_count)
+            ),
+            query_chunk AS (
+                SELECT * FROM unnest(%s::integer[], %s::text[], %s::bytea[])
+                AS query_chunk (query_id, chunk_field, chunk)
+            ),
+            candidate AS ({candidates_by_chunk})
+            SELECT candidate.query_id, directory_index.id, {hamming_distance} AS hamming_distance
+            FROM candidate
+            JOIN query ON query.query_id = candidate.query_id
+            JOIN {table} AS directory_index ON directory_index.id = candidate.id
+            WHERE directory_index.indexed_elements_count BETWEEN query.min_count AND query.max_count
+            AND {hamming_distance} <= %s
+        """
+
+        fingerprints = sorted(set(fp for fp in directory_fingerprints if fp))
+        matches_by_fingerprint = {}
+        for start in range(0, len(fingerprints), chunk_size):
+            chunk = fingerprints[start:start + chunk_size]
+            queries = []
+            query_chunks = []
+            for query_id, fingerprint in enumerate(chunk):
+                indexed_elements_count, bah128 = split_fingerprint(fingerprint)
+                fingerprint_high, fingerprint_low = get_bigint_halves(bah128)
+                min_count, max_count = bah128_ranges(indexed_elements_count)
+                queries.append((query_id, fingerprint_high, fingerprint_low, min_count, max_count))
+                for chunk_field, chunk_values in cls.get_chunk_lookups(fingerprint, threshold):
+                    for chunk_value in chunk_values:
+                        query_chunks.append((query_id, chunk_field, chunk_value))
+
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    query,
+                    [list(column) for column in zip(*queries)]
+                    + [list(column) for column in zip(*query_chunks)]
+                    + [threshold],
+                )
+                rows = cursor.fetchall()
+
+            matches_by_id = cls.objects.select_related('package').in_bulk(
+                set(index_id for _, index_id, _ in rows)
+            )
+            for query_id, index_id, distance in sorted(rows, key=lambda row: (row[0], row[2], row[1])):
+                # An indexed fingerprint can match several query fingerprints
+                # with a different distance
+                match = copy(matches_by_id[index_id])
+                match.hamming_distance = distance
+                matches_by_fingerprint.setdefault(chunk[query_id], []).append(match)
+
+        for fingerprint, matches in matches_by_fingerprint.items():
+            # If we have an exact match, disregard the others as in `match`
+            if matches[0].hamming_distance == 0:
+                matches_by_fingerprint[fingerprint] = [m for m in matches if m.hamming_distance == 0]
+        return matches_by_fingerprint
+
     def get_chunks(self):
         chunk1 = binascii.hexlify(self.chunk1)
         chunk2 = binascii.hexlify(self.chunk2)
@@ -327,3 +1033,283 @@ class ApproximateDirectoryStructureIndex(BaseDirectoryIndex):
 
 class ApproximateDirectoryContentIndex(BaseDirectoryIndex):
     pass
+
+
+# Stored BitAverageHaloHash columns are little-endian 32-bit signed integers
+COLUMNS_DTYPE = numpy.dtype('<i4')
+
+
+def columns_to_bytes(columns):
+    """
+    Return the compact bytes form of the `columns` numpy array of
+    BitAverageHaloHash column sums.
+    """
+    info = numpy.iinfo(COLUMNS_DTYPE)
+    if columns.size and (columns.min() < info.min or columns.max() > info.max):
+        raise ValueError('BitAverageHaloHash column sums overflow 32-bit integers')
+    return columns.astype(COLUMNS_DTYPE).tobytes()
+
+
+def columns_from_bytes(data):
+    """
+    Return a numpy array of BitAverageHaloHash column sums from their compact
+    bytes form `data`.
+    """
+    return numpy.frombuffer(bytes(data), dtype=COLUMNS_DTYPE).astype(numpy.int64)
+
+
+class DirectoryColumnSums(models.Model):
+    """
+    The sums of the BitAverageHaloHash columns of the content and structure
+    features of all the files under a directory of a Package.
+
+    These sums are persisted so that the directory fingerprints of a Package
+    can be updated incrementally when some of its files change: the features
+    of the changed files are added to or subtracted from the sums of their
+    ancestor directories, instead of fingerprinting again the whole Package.
+    """
+    package = models.ForeignKey(
+        Package,
+        help_text='The Package that this directory is a part of',
+        null=False,
+        on_delete=models.CASCADE,
+    )
+
+    path = models.CharField(
+        max_length=2000,
+        help_text=_('The full path value of this directory'),
+    )
+
+    files_count = models.IntegerField(
+        help_text='Number of files under this directory',
+    )
+
+    content_count = models.IntegerField(
+        help_text='Number of elements that went into the content fingerprint',
+    )
+
+    content_columns = models.BinaryField(
+        max_length=512,
+        help_text='Content fingerprint column sums as 128 little-endian 32-bit integers',
+    )
+
+    structure_count = models.IntegerField(
+        help_text='Number of elements that went into the structure fingerprint',
+    )
+
+    structure_columns = models.BinaryField(
+        max_length=512,
+        help_text='Structure fingerprint column sums as 128 little-endian 32-bit integers',
+    )
+
+    file_states = models.JSONField(
+        default=dict,
+        help_text='Mapping of {file name: [sha1, size]} of the files directly '
+                  'in this directory when it was last indexed',
+    )
+
+    class Meta:
+        unique_together = ['package', 'path']
+
+    def __str__(self):
+        return f'{self.package_id}: {self.path}'
+
+    @classmethod
+    def from_directory_columns(cls, package, path, directory_columns, file_states=None):
+        """
+        Return a new unsaved DirectoryColumnSums of the directory at `path` in
+        `package` from the `directory_columns` DirectoryColumns.
+        """
+        return cls(
+            package=package,
+            path=path,
+            files_count=directory_columns.files_count,
+            content_count=directory_columns.content_count,
+            content_columns=columns_to_bytes(directory_columns.content_columns),
+            structure_count=directory_columns.structure_count,
+            structure_columns=columns_to_bytes(directory_columns.structure_columns),
+            file_states=file_states or {},
+        )
+
+    def to_directory_columns(self):
+        """
+        Return a DirectoryColumns of these column sums.
+        """
+        return DirectoryColumns(
+            files_count=self.files_count,
+            content_count=self.content_count,
+            content_columns=columns_from_bytes(self.content_columns),
+            structure_count=self.structure_count,
+            structure_columns=columns_from_bytes(self.structure_columns),
+        )
+
+    @classmethod
+    def replace(cls, column_sums, batch_size=1000):
+        """
+        Save the `column_sums` list of DirectoryColumnSums, replacing the
+        existing rows of the same Package directories.
+        """
+        cls.objects.bulk_create(
+            column_sums,
+            batch_size=batch_size,
+            update_conflicts=True,
+            # Django 4.1 uses the field names as the ON CONFLICT columns
+            unique_fields=['package_id', 'path'],
+            update_fields=[
+                'files_count',
+                'content_count',
+                'content_columns',
+                'structure_count',
+                'structure_columns',
+                'file_states',
+            ],
+        )
+
+
+################################################################################
+# INDEXING
+################################################################################
+class IndexingShard(models.Model):
+    """
+    A range of Package ids indexed by a worker of the `index_packages` command.
+    The progress of each shard is recorded such that an interrupted indexing
+    run can be resumed.
+    """
+    start_package_id = models.IntegerField(
+        help_text='The first Package id of this shard',
+    )
+
+    end_package_id = models.IntegerField(
+        help_text='The Package id right after the last Package id of this shard',
+    )
+
+    last_indexed_package_id = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text='The id of the last Package indexed in this shard',
+    )
+
+    completed_date = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='Timestamp set when all the Packages of this shard are indexed',
+    )
+
+    class Meta:
+        ordering = ['start_package_id']
+        unique_together = ['start_package_id', 'end_package_id']
+
+    def __str__(self):
+        return f'{self.start_package_id}-{self.end_package_id}'
+
+    def get_packages_to_index(self):
+        """
+        Return a queryset of the Packages of this shard that are not indexed yet
+        """
+        packages = Package.objects.filter(
+            id__gte=self.start_package_id,
+            id__lt=self.end_package_id,
+        )
+        if self.last_indexed_package_id is not None:
+            packages = packages.filter(id__gt=self.last_indexed_package_id)
+        return packages.order_by('id')
+
+
+# Set of the names of the indexes to bump at the end of a
+# `IndexGeneration.bump_once` block or None outside of such a block
+_deferred_bumps = None
+
+
+class IndexGeneration(models.Model):
+    """
+    A generation counter of an index, incremented whenever rows are added to or
+    removed from this index. Cached matches of an older generation of an index
+    are not used.
+    """
+    index_name = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text='The name of the index model',
+    )
+
+    generation = models.BigIntegerField(
+        default=0,
+        help_text='The generation of the index, incremented when the index is updated',
+    )
+
+    def __str__(self):
+        return f'{self.index_name}: {self.generation}'
+
+    @classmethod
+    def get_generations(cls):
+        """
+        Return a mapping of {index name: generation} of all the indexes.
+        """
+        return dict(cls.objects.values_list('index_name', 'generation'))
+
+    @classmethod
+    def bump(cls, index_class):
+        """
+        Increment the generation of the `index_class` index model once the
+        current transaction, if any, is committed.
+
+        Within a `bump_once` block, the generation is only incremented once
+        at the end of the block.
+        """
+        index_name = index_class.__name__
+        if _deferred_bumps is not None:
+            _deferred_bumps.add(index_name)
+            return
+        transaction.on_commit(lambda: cls.increment([index_name]))
+
+    @classmethod
+    def increment(cls, index_names):
+        """
+        Increment the generations of the indexes with `index_names` and expire
+        the generations of the match cache.
+        """
+        for index_name in sorted(index_names):
+            updated = cls.objects.filter(index_name=index_name).update(
+                generation=models.F('generation') + 1,
+            )
+            if not updated:
+                cls.objects.get_or_create(index_name=index_name, defaults=dict(generation=1))
+
+        match_cache = get_match_cache()
+        if match_cache:
+            match_cache.expire_generations()
+
+    @classmethod
+    @contextmanager
+    def bump_once(cls):
+        """
+        Context manager that increments the generation of each index updated
+        in the block only once, at the end of the block, rather than on each
+        update. Use this for an indexing run or a batch of indexing
+        transactions such that concurrent indexing processes do not all
+        update the same generation rows and the matches cache is not
+        invalidated over and over while indexing.
+        """
+        global _deferred_bumps
+        if _deferred_bumps is not None:
+            # Nested blocks are bumped at the end of the outermost block
+            yield
+            return
+
+        _deferred_bumps = set()
+        try:
+            yield
+        finally:
+            index_names = _deferred_bumps
+            _deferred_bumps = None
+            if index_names:
+                transaction.on_commit(lambda: cls.increment(index_names))
+
+
+@receiver(pre_delete, sender=Package)
+def remove_deleted_package_from_package_sets(sender, instance, **kwargs):
+    """
+    Remove a deleted Package from the ExactFilePackageSet of its files, before
+    its ExactFileIndex rows are deleted in cascade.
+    """
+    ExactFilePackageSet.remove_package(instance.id)
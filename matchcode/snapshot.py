@@ -0,0 +1,246 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+"""
+Read-only snapshots of the SHA1 file indexes for exact matching.
+
+A snapshot file stores the distinct SHA1s of a BaseFileIndex model as a sorted
+array of 20-byte SHA1s. The file is memory-mapped so a snapshot is shared by
+all the worker processes of a host through the OS page cache, and SHA1s are
+looked up with a binary search without any database query. A snapshot is only
+used to skip the SHA1s that are not indexed: the matches of the other SHA1s
+are always queried from the index.
+
+A snapshot covers the index rows up to the largest row id recorded in its
+header. It can be updated incrementally with the rows added since then.
+Deleted rows are only removed from a snapshot by a full rebuild.
+"""
+
+import os
+import struct
+
+from django.conf import settings
+import numpy
+
+from matchcode_toolkit.fingerprinting import hexstring_to_binarray
+
+
+SNAPSHOT_MAGIC = b'MCSHA1\x00\x00'
+SNAPSHOT_VERSION = 1
+
+# magic, version, reserved, SHA1s count, max index row id
+SNAPSHOT_HEADER = struct.Struct('<8sIIQQ')
+
+SHA1_DTYPE = numpy.dtype('S20')
+
+# Number of rows fetched at once from the database when building a snapshot
+SNAPSHOT_BUILD_CHUNK_SIZE = 100000
+
+
+class Sha1Snapshot:
+    """
+    A memory-mapped snapshot of the distinct SHA1s of a BaseFileIndex model.
+    """
+
+    def __init__(self, sha1s, max_index_id=0, location=None):
+        self.sha1s = sha1s
+        self.max_index_id = max_index_id
+        self.location = location
+
+    def __len__(self):
+        return len(self.sha1s)
+
+    @classmethod
+    def load(cls, location):
+        """
+        Return a Sha1Snapshot memory-mapped read-only from the snapshot file
+        at `location`.
+        """
+        with open(location, 'rb') as snapshot_file:
+            header = snapshot_file.read(SNAPSHOT_HEADER.size)
+        magic, version, _, count, max_index_id = SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f'Invalid SHA1 snapshot file: {location}')
+
+        if not count:
+            sha1s = numpy.empty(0, dtype=SHA1_DTYPE)
+        else:
+            sha1s = numpy.memmap(
+                location,
+                dtype=SHA1_DTYPE,
+                mode='r',
+                offset=SNAPSHOT_HEADER.size,
+                shape=(count,),
+            )
+        return cls(sha1s, max_index_id=max_index_id, location=location)
+
+    def __contains__(self, sha1):
+        return bool(self.contains_many([sha1]))
+
+    def contains_many(self, sha1s):
+        """
+        Return a set of the SHA1 hex strings of `sha1s` that are in this
+        snapshot.
+        """
+        sha1s = [sha1 for sha1 in set(sha1s) if sha1]
+        if not sha1s or not len(self):
+            return set()
+
+        queries = numpy.array(
+            [bytes(hexstring_to_binarray(sha1)) for sha1 in sha1s],
+            dtype=SHA1_DTYPE,
+        )
+        positions = numpy.searchsorted(self.sha1s, queries, side='left')
+        # A SHA1 greater than all the SHA1s of the snapshot is at its end
+        found = self.sha1s[numpy.minimum(positions, len(self) - 1)] == queries
+        return {sha1 for sha1, is_found in zip(sha1s, found.tolist()) if is_found}
+
+
+def get_snapshot_location(index_class, directory=None):
+    """
+    Return the location of the snapshot file of the `index_class` BaseFileIndex
+    model in `directory` or in the MATCHCODE_SNAPSHOT_DIR setting directory.
+    Return None if there is no snapshot directory.
+    """
+    directory = directory or settings.MATCHCODE_SNAPSHOT_DIR
+    if not directory:
+        return
+    return os.path.join(directory, f'{index_class.__name__.lower()}.sha1snapshot')
+
+
+# Mapping of {snapshot location: (modification time, Sha1Snapshot)} of the
+# snapshots loaded in this process
+_snapshots_cache = {}
+
+
+def get_snapshot(index_class):
+    """
+    Return the current Sha1Snapshot of the `index_class` BaseFileIndex model or
+    None if there is no snapshot. A snapshot is loaded once per process and
+    reloaded when its file is replaced.
+    """
+    location = get_snapshot_location(index_class)
+    if not location:
+        return
+
+    try:
+        mtime = os.stat(location).st_mtime_ns
+    except FileNotFoundError:
+        return
+
+    cached = _snapshots_cache.get(location)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    snapshot = Sha1Snapshot.load(location)
+    _snapshots_cache[location] = mtime, snapshot
+    return snapshot
+
+
+def build_snapshot(index_class, location, incremental=False, chunk_size=SNAPSHOT_BUILD_CHUNK_SIZE):
+    """
+    Build a snapshot file at `location` of the distinct SHA1s of all the rows
+    of the `index_class` BaseFileIndex model.
+
+    If `incremental` is True and a snapshot already exists at `location`, only
+    the rows added since that snapshot was built are fetched and merged in.
+
+    The snapshot file is replaced atomically: processes that use the previous
+    snapshot keep a valid mapping of it.
+
+    Return the new Sha1Snapshot.
+    """
+    previous = None
+    if incremental and os.path.exists(location):
+        previous = Sha1Snapshot.load(location)
+
+    # Ignore rows inserted while the snapshot is built
+    max_index_id = index_class.get_max_committed_id()
+    rows = index_class.objects.filter(pk__lte=max_index_id)
+    if previous:
+        max_index_id = max(max_index_id, previous.max_index_id)
+        rows = rows.filter(pk__gt=previous.max_index_id)
+    rows = rows.order_by('sha1').values_list('sha1', flat=True).distinct()
+    new_sha1s = iter_sha1_chunks(rows, chunk_size)
+
+    temp_location = f'{location}.tmp'
+    count = 0
+    with open(temp_location, 'wb') as snapshot_file:
+        snapshot_file.write(b'\x00' * SNAPSHOT_HEADER.size)
+
+        def write_sha1s(sha1s):
+            nonlocal count
+            snapshot_file.write(numpy.asarray(sha1s, dtype=SHA1_DTYPE).tobytes())
+            count += len(sha1s)
+
+        if previous:
+            merge_sha1s(previous.sha1s, new_sha1s, write_sha1s, chunk_size)
+        else:
+            for sha1s in new_sha1s:
+                write_sha1s(sha1s)
+
+        snapshot_file.seek(0)
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, count, max_index_id)
+        snapshot_file.write(header)
+
+    os.replace(temp_location, location)
+    return Sha1Snapshot.load(location)
+
+
+def iter_sha1_chunks(sha1s, chunk_size=SNAPSHOT_BUILD_CHUNK_SIZE):
+    """
+    Yield arrays of at most `chunk_size` SHA1s of the `sha1s` QuerySet of
+    binary SHA1 values.
+    """
+    chunk = []
+    for sha1 in sha1s.iterator(chunk_size=chunk_size):
+        chunk.append(bytes(sha1))
+        if len(chunk) >= chunk_size:
+            yield numpy.array(chunk, dtype=SHA1_DTYPE)
+            chunk = []
+    if chunk:
+        yield numpy.array(chunk, dtype=SHA1_DTYPE)
+
+
+def merge_sha1s(previous_sha1s, new_sha1s, write_sha1s, chunk_size=SNAPSHOT_BUILD_CHUNK_SIZE):
+    """
+    Call `write_sha1s` with arrays of the distinct SHA1s of the sorted
+    `previous_sha1s` array merged with the `new_sha1s` iterable of sorted
+    arrays of SHA1s, in sorted order.
+
+    Both inputs are read in chunks of `chunk_size` SHA1s at most: only one
+    chunk of each is in memory at a time.
+    """
+    new_sha1s = iter(new_sha1s)
+    pending = numpy.empty(0, dtype=SHA1_DTYPE)
+    start = 0
+    while True:
+        if not len(pending):
+            pending = next(new_sha1s, None)
+            if pending is None:
+                break
+            continue
+
+        window = numpy.asarray(previous_sha1s[start:start + chunk_size])
+        if not len(window):
+            write_sha1s(numpy.unique(pending))
+            pending = numpy.empty(0, dtype=SHA1_DTYPE)
+            continue
+
+        # Write all the SHA1s of both chunks up to the smallest of their last
+        # SHA1s: the next SHA1s of the other input may still come before
+        limit = min(window[-1], pending[-1])
+        window_end = numpy.searchsorted(window, limit, side='right')
+        pending_end = numpy.searchsorted(pending, limit, side='right')
+        write_sha1s(numpy.union1d(window[:window_end], pending[:pending_end]))
+        start += window_end
+        pending = pending[pending_end:]
+
+    for chunk_start in range(start, len(previous_sha1s), chunk_size):
+        write_sha1s(numpy.unique(previous_sha1s[chunk_start:chunk_start + chunk_size]))
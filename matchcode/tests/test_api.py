@@ -7,6 +7,7 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+import json
 import os
 
 from django.urls import reverse
@@ -14,8 +15,14 @@ from django.urls import reverse
 from packagedb.models import Package
 
 from matchcode.indexing import index_package_directories
+from matchcode.models import ExactFileIndex
+from matchcode.models import ExactFilePackageSet
+from matchcode.models import ExactGitBlobIndex
+from matchcode.models import PACKAGE_SET_MAX_SIZE
+from matchcode.utils import index_packages_sha1
 from matchcode.utils import load_resources_from_scan
 from matchcode.utils import MatchcodeTestCase
+from matchcode_toolkit.fingerprinting import hexstring_to_binarray
 
 
 class ApproximateDirectoryStructureIndexAPITestCase(MatchcodeTestCase):
@@ -134,6 +141,49 @@ class ApproximateDirectoryStructureIndexAPITestCase(MatchcodeTestCase):
         expected_package = 'http://testserver' + reverse('api:package-detail', args=[self.test_package2.uuid])
         self.assertEqual(expected_package, result['package'])
 
+    def test_api_approximate_directory_content_index_match_no_common_chunk(self):
+        # This test fingerprint has one bit flipped in each of its four chunks
+        test_fingerprint = '00000007af7d63775c78fa506b5353f4ffa7df44'
+        response = self.client.get(
+            reverse('api:approximatedirectorycontentindex-match'),
+            data={'fingerprint': test_fingerprint}
+        )
+        results = response.data
+        self.assertEqual(1, len(results))
+        result = results[0]
+        expected_matched_fingerprint = '00000007af7d63765c78fa516b5353f5ffa7df45'
+        self.assertEqual(expected_matched_fingerprint, result['matched_fingerprint'])
+        self.assertEqual(4, result['hamming_distance'])
+
+    def test_api_approximate_directory_content_index_match_threshold(self):
+        # This test fingerprint has a hamming distance of 9 from the expected fingerprint
+        test_fingerprint = '00000007af7d63705c78fa516b5353f5ffa7d000'
+        response = self.client.get(
+            reverse('api:approximatedirectorycontentindex-match'),
+            data={'fingerprint': test_fingerprint}
+        )
+        self.assertEqual(0, len(response.data))
+
+        response = self.client.get(
+            reverse('api:approximatedirectorycontentindex-match'),
+            data={'fingerprint': test_fingerprint, 'threshold': 10}
+        )
+        results = response.data
+        self.assertEqual(1, len(results))
+        result = results[0]
+        expected_matched_fingerprint = '00000007af7d63765c78fa516b5353f5ffa7df45'
+        self.assertEqual(expected_matched_fingerprint, result['matched_fingerprint'])
+        self.assertEqual(9, result['hamming_distance'])
+
+    def test_api_approximate_directory_content_index_match_invalid_threshold(self):
+        test_fingerprint = '00000007af7d63765c78fa516b5353f5ffa7df45'
+        for threshold in ('foo', -1, 17):
+            response = self.client.get(
+                reverse('api:approximatedirectorycontentindex-match'),
+                data={'fingerprint': test_fingerprint, 'threshold': threshold}
+            )
+            self.assertEqual(400, response.status_code)
+
     def test_api_approximate_directory_content_index_match(self):
         test_fingerprint = '00000007af7d63765c78fa516b5353f5ffa7df45'
         response = self.client.get(
@@ -161,3 +211,183 @@ class ApproximateDirectoryStructureIndexAPITestCase(MatchcodeTestCase):
         self.assertEqual(test_fingerprint, result['matched_fingerprint'])
         expected_package = 'http://testserver' + reverse('api:package-detail', args=[self.test_package2.uuid])
         self.assertEqual(expected_package, result['package'])
+
+
+class MatchAPITestCase(MatchcodeTestCase):
+    BASE_DIR = os.path.join(os.path.dirname(__file__), 'testfiles')
+
+    def setUp(self):
+        # Execute the superclass' setUp method before creating our own
+        # DB objects
+        super().setUp()
+
+        self.test_package1, _ = Package.objects.get_or_create(
+            filename='plugin-request-2.4.1.tgz',
+            sha1='7295749caddd3c52be472eef6623a7b441ed17d6',
+            size=7269,
+            name='plugin-request',
+            version='2.4.1',
+            download_url='https://registry.npmjs.org/@umijs/plugin-request/-/plugin-request-2.4.1.tgz',
+            type='npm',
+        )
+        load_resources_from_scan(self.get_test_loc('match/nested/plugin-request-2.4.1-ip.json'), self.test_package1)
+        index_package_directories(self.test_package1)
+
+        self.test_package2, _ = Package.objects.get_or_create(
+            filename='underscore-1.10.9.tgz',
+            sha1='ba7a9cfc15873e67821611503a34a7c26bf7264f',
+            size=26569,
+            name='underscore',
+            version='1.10.9',
+            download_url='https://registry.npmjs.org/@types/underscore/-/underscore-1.10.9.tgz',
+            type='npm',
+        )
+        load_resources_from_scan(self.get_test_loc('match/nested/underscore-1.10.9-ip.json'), self.test_package2)
+        index_package_directories(self.test_package2)
+
+
+    def get_batch_matches(self, data):
+        response = self.client.post(
+            reverse('api:match-list'),
+            data=data,
+            content_type='application/json',
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_api_match_batch(self):
+        index_packages_sha1()
+        data = {
+            'archive_sha1s': [
+                self.test_package1.sha1,
+                self.test_package2.sha1.upper(),
+                '0000000000000000000000000000000000000000',
+            ],
+            'directory_content_fingerprints': [
+                '00000007af7d63765c78fa516b5353f5ffa7df45',
+                '00000007af7d63765c78fa516b5353f5ffa7d000',
+                '000000020e1d2124040134564e1941a6a620db34',
+            ],
+            'directory_structure_fingerprints': [
+                '00000004d10982208810240820080a6a3e852486',
+            ],
+        }
+        lines = self.get_batch_matches(data)
+        summary = lines.pop()['summary']
+
+        package1 = 'http://testserver' + reverse('api:package-detail', args=[self.test_package1.uuid])
+        package2 = 'http://testserver' + reverse('api:package-detail', args=[self.test_package2.uuid])
+        expected = [
+            ('exact-archive', self.test_package1.sha1, package1),
+            ('exact-archive', self.test_package2.sha1, package2),
+            ('approximate-content', '00000007af7d63765c78fa516b5353f5ffa7d000', package1),
+            ('approximate-content', '00000007af7d63765c78fa516b5353f5ffa7df45', package1),
+            ('approximate-structure', '00000004d10982208810240820080a6a3e852486', package2),
+        ]
+        results = sorted(
+            (line['match_type'], line.get('sha1') or line.get('fingerprint'), line['package'])
+            for line in lines
+        )
+        self.assertEqual(sorted(expected), results)
+
+        distances = {
+            line['fingerprint']: line['hamming_distance']
+            for line in lines if line['match_type'] == 'approximate-content'
+        }
+        self.assertEqual({
+            '00000007af7d63765c78fa516b5353f5ffa7df45': 0,
+            '00000007af7d63765c78fa516b5353f5ffa7d000': 7,
+        }, distances)
+
+        expected_counts = {
+            'exact-archive': 2,
+            'exact-file': 0,
+            'exact-git-blob': 0,
+            'approximate-content': 2,
+            'approximate-structure': 1,
+        }
+        self.assertEqual(expected_counts, summary['matches_counts'])
+        self.assertEqual(set(expected_counts), set(summary['durations']))
+        self.assertIn('total_duration', summary)
+
+    def test_api_match_batch_top_packages(self):
+        file_sha1s = ['a' * 40, 'b' * 40, 'c' * 40]
+        for sha1 in file_sha1s[:2]:
+            ExactFileIndex.index(sha1, self.test_package1)
+        ExactFileIndex.index('d' * 40, self.test_package1)
+        ExactFileIndex.index(file_sha1s[0], self.test_package2)
+
+        lines = self.get_batch_matches({'file_sha1s': file_sha1s, 'top_packages': 1})
+        summary = lines.pop()['summary']
+        package1 = 'http://testserver' + reverse('api:package-detail', args=[self.test_package1.uuid])
+        expected = [{
+            'package_score': {
+                'package': package1,
+                'purl': self.test_package1.package_url,
+                'matched_files_count': 2,
+                'package_files_count': 3,
+                'coverage': 0.6667,
+                'containment': 0.6667,
+            }
+        }]
+        self.assertEqual(expected, lines)
+        self.assertEqual(1, summary['matches_counts']['package-score'])
+        self.assertNotIn('exact-file', summary['matches_counts'])
+
+    def test_api_match_batch_git_blob(self):
+        ExactGitBlobIndex.index('a' * 40, self.test_package1)
+        lines = self.get_batch_matches({'git_blob_sha1s': ['A' * 40, 'b' * 40]})
+        summary = lines.pop()['summary']
+        package1 = 'http://testserver' + reverse('api:package-detail', args=[self.test_package1.uuid])
+        expected = [{'match_type': 'exact-git-blob', 'sha1': 'a' * 40, 'package': package1}]
+        self.assertEqual(expected, lines)
+        self.assertEqual(1, summary['matches_counts']['exact-git-blob'])
+
+    def test_api_match_batch_low_signal(self):
+        low_signal_sha1 = 'a' * 40
+        package_ids = range(1000, 1000 + PACKAGE_SET_MAX_SIZE + 1)
+        ExactFilePackageSet.add_packages(
+            (hexstring_to_binarray(low_signal_sha1), package_id) for package_id in package_ids
+        )
+        ExactFileIndex.index('b' * 40, self.test_package1)
+
+        lines = self.get_batch_matches({'file_sha1s': [low_signal_sha1, 'b' * 40]})
+        summary = lines.pop()['summary']
+        package1 = 'http://testserver' + reverse('api:package-detail', args=[self.test_package1.uuid])
+        expected = [
+            {'match_type': 'exact-file', 'sha1': 'b' * 40, 'package': package1},
+            {'low_signal': {
+                'match_type': 'exact-file',
+                'sha1': low_signal_sha1,
+                'packages_count': PACKAGE_SET_MAX_SIZE + 1,
+            }},
+        ]
+        self.assertEqual(expected, lines)
+        self.assertEqual(1, summary['matches_counts']['exact-file'])
+        self.assertEqual({'exact-file': 1}, summary['low_signal_counts'])
+
+    def test_api_exact_git_blob_index_list_sha1_lookup(self):
+        ExactGitBlobIndex.index('a' * 40, self.test_package1)
+        ExactGitBlobIndex.index('b' * 40, self.test_package2)
+        response = self.client.get(reverse('api:exactgitblobindex-list'), data={'sha1': 'a' * 40})
+        self.assertEqual(200, response.status_code)
+        results = response.data['results']
+        self.assertEqual(1, len(results))
+        self.assertEqual('a' * 40, results[0]['sha1'])
+
+    def test_api_match_batch_invalid_request(self):
+        invalid_requests = [
+            {'file_sha1s': ['not-a-sha1']},
+            {'directory_content_fingerprints': '00000007af7d63765c78fa516b5353f5ffa7df45'},
+            {'threshold': 17},
+            {'top_packages': -1},
+        ]
+        for data in invalid_requests:
+            response = self.client.post(
+                reverse('api:match-list'),
+                data=data,
+                content_type='application/json',
+            )
+            self.assertEqual(400, response.status_code)
@@ -0,0 +1,102 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import json
+
+from django.core import management
+from django.test.utils import override_settings
+
+from matchcode.benchmark import BENCHMARKS
+from matchcode.benchmark import compare_benchmark_results
+from matchcode.benchmark import generate_corpus
+from matchcode.bloom import build_bloom_filter
+from matchcode.bloom import get_bloom_filter_location
+from matchcode.models import ExactFileIndex
+from matchcode.utils import MatchcodeTestCase
+from minecode.utils import get_temp_dir
+from minecode.utils import get_temp_file
+from packagedb.models import Package
+
+
+class BenchmarkTestCase(MatchcodeTestCase):
+
+    def test_generate_corpus(self):
+        corpus = generate_corpus(packages_count=4, files_count=20, depth=2, overlap=0.5, seed=1)
+        self.assertEqual(corpus, generate_corpus(packages_count=4, files_count=20, depth=2, overlap=0.5, seed=1))
+        self.assertEqual(['package0', 'package1'], corpus.vendored_package_names)
+
+        for name, files in corpus.packages:
+            package_files = [f for f in files if f['type'] == 'file']
+            self.assertEqual(20, len(package_files))
+            for f in files:
+                self.assertTrue(f['path'].startswith(name))
+                self.assertTrue(f['path'].count('/') <= 3)
+
+        codebase_files = [f for f in corpus.codebase_files if f['type'] == 'file']
+        self.assertEqual(80, len(codebase_files))
+        package_sha1s = {f['sha1'] for _, files in corpus.packages for f in files if f.get('sha1')}
+        vendored = [f for f in codebase_files if f['sha1'] in package_sha1s]
+        self.assertTrue(38 <= len(vendored) <= 40)
+        self.assertEqual(len(vendored), len([f for f in vendored if f['path'].startswith('codebase/vendor/')]))
+
+    def test_benchmark_matchcode_command(self):
+        output = get_temp_file('benchmark_matchcode', extension='.json')
+        management.call_command(
+            'benchmark_matchcode',
+            output=output,
+            rounds=1,
+            packages=2,
+            files=10,
+        )
+        with open(output) as f:
+            results = json.load(f)
+
+        self.assertEqual(
+            [benchmark.name for benchmark in BENCHMARKS],
+            [benchmark['name'] for benchmark in results['benchmarks']],
+        )
+        for benchmark in results['benchmarks']:
+            self.assertEqual(1, benchmark['stats']['rounds'])
+            self.assertTrue(benchmark['stats']['items'] > 0)
+        self.assertEqual(2, results['params']['packages_count'])
+
+        threshold_benchmark = results['directory-thresholds']
+        self.assertEqual('ApproximateDirectoryContentIndex', threshold_benchmark['index'])
+        self.assertTrue(threshold_benchmark['queries'] > 0)
+        self.assertEqual(
+            [0, 2, 4, 6, 8, 10, 12, 14, 16],
+            [stats['threshold'] for stats in threshold_benchmark['thresholds']],
+        )
+        self.assertEqual(1, threshold_benchmark['thresholds'][0]['avg_matches'])
+        # The corpus is not left in the database
+        self.assertFalse(Package.objects.filter(namespace='matchcode-benchmark').exists())
+
+        comparisons = compare_benchmark_results(results, results)
+        self.assertEqual(len(BENCHMARKS), len(comparisons))
+        for _, previous_mean, current_mean, ratio in comparisons:
+            self.assertEqual(previous_mean, current_mean)
+
+    def test_benchmark_matchcode_command_does_not_update_the_bloom_filters(self):
+        bloom_filter_dir = get_temp_dir('bloom')
+        location = get_bloom_filter_location(ExactFileIndex, bloom_filter_dir)
+        build_bloom_filter(ExactFileIndex, location)
+        with open(location, 'rb') as f:
+            expected = f.read()
+
+        with override_settings(MATCHCODE_BLOOM_FILTER_DIR=bloom_filter_dir):
+            management.call_command(
+                'benchmark_matchcode',
+                output=get_temp_file('benchmark_matchcode', extension='.json'),
+                benchmarks=['bulk-indexing'],
+                rounds=1,
+                packages=2,
+                files=10,
+            )
+        with open(location, 'rb') as f:
+            self.assertEqual(expected, f.read())
@@ -0,0 +1,177 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import hashlib
+import threading
+
+from django.db import connection
+from django.db import transaction
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from matchcode.bloom import build_bloom_filter
+from matchcode.bloom import get_bloom_filter
+from matchcode.bloom import get_bloom_filter_location
+from matchcode.bloom import Sha1BloomFilter
+from matchcode.indexing import bulk_index_packages
+from matchcode.models import ExactFileIndex
+from matchcode.models import ExactPackageArchiveIndex
+from matchcode.utils import MatchcodeTestCase
+from minecode.utils import get_temp_dir
+from packagedb.models import Package
+
+
+def get_sha1s(prefix, count):
+    return [hashlib.sha1(f'{prefix}{i}'.encode()).hexdigest() for i in range(count)]
+
+
+class Sha1BloomFilterTestCase(MatchcodeTestCase):
+
+    def test_add_many_and_contains_many(self):
+        bloom_filter = Sha1BloomFilter.create(capacity=1000, false_positive_rate=0.01)
+        indexed = get_sha1s('indexed', 1000)
+        bloom_filter.add_many(bytes.fromhex(sha1) for sha1 in indexed)
+
+        self.assertEqual(set(indexed), bloom_filter.contains_many(indexed))
+        self.assertIn(indexed[0], bloom_filter)
+
+        others = get_sha1s('other', 10000)
+        false_positives = bloom_filter.contains_many(others)
+        self.assertLess(len(false_positives) / len(others), 0.02)
+
+        stats = bloom_filter.get_stats()
+        self.assertEqual(1000, stats['items_count'])
+        self.assertEqual(16384 // 8, stats['size_bytes'])
+        self.assertLess(stats['false_positive_rate'], 0.01)
+        self.assertLess(stats['expected_false_positive_rate'], 0.01)
+
+    def test_save_and_load(self):
+        location = get_temp_dir(prefix='bloom') + '/test.bloom'
+        bloom_filter = Sha1BloomFilter.create(capacity=10, max_index_id=42)
+        sha1s = get_sha1s('indexed', 10)
+        bloom_filter.add_many(bytes.fromhex(sha1) for sha1 in sha1s)
+        bloom_filter.save(location)
+
+        loaded = Sha1BloomFilter.load(location, writable=True)
+        self.assertEqual(42, loaded.max_index_id)
+        self.assertEqual(10, loaded.items_count)
+        self.assertEqual(set(sha1s), loaded.contains_many(sha1s))
+
+        # Additions to a writable Bloom filter are written to its file
+        new_sha1 = get_sha1s('new', 1)[0]
+        loaded.add_many([bytes.fromhex(new_sha1)])
+        loaded.data.flush()
+        reloaded = Sha1BloomFilter.load(location)
+        self.assertIn(new_sha1, reloaded)
+        self.assertEqual(11, reloaded.items_count)
+
+
+class ExactFileIndexBloomFilterTestCase(MatchcodeTestCase):
+
+    def setUp(self):
+        super(ExactFileIndexBloomFilterTestCase, self).setUp()
+        self.bloom_filter_dir = get_temp_dir(prefix='bloom')
+        self.package = Package.objects.create(
+            name='test',
+            version='1.0',
+            type='maven',
+            download_url='https://test.com/test-1.0.jar',
+        )
+        self.sha1s = get_sha1s('indexed', 20)
+        for sha1 in self.sha1s:
+            ExactFileIndex.index(sha1, self.package)
+
+    def test_build_bloom_filter_and_match(self):
+        location = get_bloom_filter_location(ExactFileIndex, directory=self.bloom_filter_dir)
+        bloom_filter = build_bloom_filter(ExactFileIndex, location)
+        self.assertEqual(20, bloom_filter.items_count)
+        self.assertEqual(set(self.sha1s), bloom_filter.contains_many(self.sha1s))
+
+        other_sha1s = get_sha1s('other', 20)
+        with override_settings(MATCHCODE_BLOOM_FILTER_DIR=self.bloom_filter_dir):
+            self.assertTrue(get_bloom_filter(ExactFileIndex))
+            lookups = ExactFileIndex.get_sha1_lookups(self.sha1s + other_sha1s)
+            self.assertEqual(1, len(lookups))
+            sha1s_to_lookup, _ = lookups[0]
+            self.assertEqual(sorted(self.sha1s), [s for s in sha1s_to_lookup if s in self.sha1s])
+            self.assertLess(len(sha1s_to_lookup), 25)
+
+            matches = ExactFileIndex.match_many(self.sha1s[:2] + other_sha1s)
+            self.assertEqual(sorted(self.sha1s[:2]), sorted(matches))
+
+            # SHA1s indexed after the Bloom filter was built are matched
+            new_sha1 = get_sha1s('new', 1)[0]
+            ExactFileIndex.index(new_sha1, self.package)
+            self.assertIn(new_sha1, get_bloom_filter(ExactFileIndex))
+            self.assertEqual([self.package], [m.package for m in ExactFileIndex.match(new_sha1)])
+
+            response = self.client.get(f'/api/exact_file_index/?sha1={new_sha1}&sha1={other_sha1s[0]}')
+            self.assertEqual(1, response.data['count'])
+
+
+class ExactFileIndexMaxCommittedIdTestCase(TransactionTestCase):
+
+    def test_get_max_committed_id_waits_for_inserting_transactions(self):
+        package = Package.objects.create(
+            name='test',
+            version='1.0',
+            type='maven',
+            download_url='https://test.com/test-1.0.jar',
+            sha1=get_sha1s('archive', 1)[0],
+        )
+        ExactFileIndex.index(get_sha1s('indexed', 1)[0], package)
+        committed_id = ExactFileIndex.get_max_committed_id()
+        self.assertEqual(ExactFileIndex.objects.latest('pk').pk, committed_id)
+
+        inserted = threading.Event()
+        commit = threading.Event()
+
+        def insert_rows():
+            # An indexing transaction that is not committed yet
+            try:
+                with transaction.atomic():
+                    ExactFileIndex.index(get_sha1s('inserting', 1)[0], package)
+                    inserted.set()
+                    commit.wait(10)
+            finally:
+                connection.close()
+
+        max_ids = []
+
+        def get_max_committed_id(index_class=ExactFileIndex):
+            try:
+                max_ids.append(index_class.get_max_committed_id())
+            finally:
+                connection.close()
+
+        inserter = threading.Thread(target=insert_rows)
+        inserter.start()
+        self.assertTrue(inserted.wait(10))
+        reader = threading.Thread(target=get_max_committed_id)
+        reader.start()
+        reader.join(0.5)
+        # The max id is not read while rows may be committed with a lower id
+        self.assertTrue(reader.is_alive())
+        self.assertEqual([], max_ids)
+
+        commit.set()
+        inserter.join(10)
+        reader.join(10)
+        self.assertEqual([ExactFileIndex.objects.latest('pk').pk], max_ids)
+        self.assertGreater(max_ids[0], committed_id)
+
+        # Rows inserted in bulk take the same lock
+        with transaction.atomic():
+            bulk_index_packages([package])
+            reader = threading.Thread(target=get_max_committed_id, args=[ExactPackageArchiveIndex])
+            reader.start()
+            reader.join(0.5)
+            self.assertTrue(reader.is_alive())
+        reader.join(10)
+        self.assertEqual(ExactPackageArchiveIndex.objects.latest('pk').pk, max_ids[1])
@@ -0,0 +1,241 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+from django.core.cache import caches
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from matchcode.cache import get_match_cache
+from matchcode.cache import MatchCache
+from matchcode.indexing import bulk_index_packages
+from matchcode.models import ApproximateDirectoryContentIndex
+from matchcode.models import ExactFileIndex
+from matchcode.models import IndexGeneration
+from matchcode.utils import MatchcodeTestCase
+from packagedb.models import Package
+
+
+class MatchCacheTestCase(MatchcodeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.generations = {}
+        self.match_calls = []
+
+    def get_match_function(self, matches):
+        def match_function():
+            self.match_calls.append(matches)
+            return matches
+        return match_function
+
+    def test_get_or_match_lru_eviction(self):
+        match_cache = MatchCache(max_size=2, get_generations=lambda: self.generations)
+        match_cache.get_or_match('index', 'a', 0, self.get_match_function(['match-a']))
+        match_cache.get_or_match('index', 'b', 0, self.get_match_function([]))
+        self.assertEqual(['match-a'], match_cache.get_or_match('index', 'a', 0, self.get_match_function(None)))
+        # The least recently used entry "b" is evicted
+        match_cache.get_or_match('index', 'c', 0, self.get_match_function(['match-c']))
+        self.assertEqual([], match_cache.get_or_match('index', 'b', 0, self.get_match_function([])))
+
+        self.assertEqual([['match-a'], [], ['match-c'], []], self.match_calls)
+        expected = dict(
+            size=2,
+            max_size=2,
+            hits=1,
+            shared_hits=0,
+            misses=4,
+            evictions=2,
+            hit_ratio=0.2,
+        )
+        self.assertEqual(expected, match_cache.get_stats())
+
+    def test_get_or_match_is_keyed_by_index_and_threshold(self):
+        match_cache = MatchCache(max_size=10, get_generations=lambda: self.generations)
+        match_cache.get_or_match('index1', 'a', 0, self.get_match_function(['1-0']))
+        match_cache.get_or_match('index1', 'a', 5, self.get_match_function(['1-5']))
+        match_cache.get_or_match('index2', 'a', 0, self.get_match_function(['2-0']))
+        self.assertEqual(['1-5'], match_cache.get_or_match('index1', 'a', 5, None))
+        self.assertEqual(3, match_cache.get_stats()['misses'])
+
+    def test_get_or_match_generation_invalidation(self):
+        match_cache = MatchCache(max_size=10, get_generations=lambda: dict(self.generations))
+        match_cache.get_or_match('index', 'a', 0, self.get_match_function(['old']))
+
+        self.generations['index'] = 1
+        matches = match_cache.get_or_match('index', 'a', 0, self.get_match_function(['new']))
+        self.assertEqual(['new'], matches)
+
+        # Other indexes are not invalidated
+        match_cache.get_or_match('other', 'a', 0, self.get_match_function(['other']))
+        self.generations['index'] = 2
+        self.assertEqual(['other'], match_cache.get_or_match('other', 'a', 0, None))
+
+    def test_get_or_match_generation_ttl(self):
+        match_cache = MatchCache(
+            max_size=10,
+            get_generations=lambda: dict(self.generations),
+            generation_ttl=3600,
+        )
+        match_cache.get_or_match('index', 'a', 0, self.get_match_function(['old']))
+        self.generations['index'] = 1
+        self.assertEqual(['old'], match_cache.get_or_match('index', 'a', 0, None))
+
+        match_cache.expire_generations()
+        matches = match_cache.get_or_match('index', 'a', 0, self.get_match_function(['new']))
+        self.assertEqual(['new'], matches)
+
+    def test_get_or_match_shared_cache(self):
+        shared_cache = caches['default']
+        shared_cache.clear()
+        match_cache1 = MatchCache(
+            max_size=10,
+            get_generations=lambda: self.generations,
+            shared_cache=shared_cache,
+        )
+        match_cache2 = MatchCache(
+            max_size=10,
+            get_generations=lambda: self.generations,
+            shared_cache=shared_cache,
+        )
+        match_cache1.get_or_match('index', 'a', 0, self.get_match_function(['match-a']))
+        self.assertEqual(['match-a'], match_cache2.get_or_match('index', 'a', 0, None))
+        self.assertEqual(1, match_cache2.get_stats()['shared_hits'])
+        self.assertEqual(['match-a'], match_cache2.get_or_match('index', 'a', 0, None))
+        self.assertEqual(1, match_cache2.get_stats()['hits'])
+
+    def test_get_or_match_many(self):
+        match_cache = MatchCache(max_size=10, get_generations=lambda: self.generations)
+        match_cache.get_or_match('index', 'a', 0, self.get_match_function(['match-a']))
+
+        def match_many_function(fingerprints):
+            self.match_calls.append(sorted(fingerprints))
+            return {'b': ['match-b']}
+
+        matches = match_cache.get_or_match_many('index', ['a', 'b', 'c'], 0, match_many_function)
+        self.assertEqual({'a': ['match-a'], 'b': ['match-b'], 'c': []}, matches)
+        matches = match_cache.get_or_match_many('index', ['a', 'b', 'c'], 0, None)
+        self.assertEqual({'a': ['match-a'], 'b': ['match-b'], 'c': []}, matches)
+
+        self.assertEqual([['match-a'], ['b', 'c']], self.match_calls)
+        self.assertEqual(4, match_cache.get_stats()['hits'])
+        self.assertEqual(3, match_cache.get_stats()['misses'])
+
+    def test_get_or_match_many_shared_cache(self):
+        shared_cache = caches['default']
+        shared_cache.clear()
+        match_cache1 = MatchCache(
+            max_size=10,
+            get_generations=lambda: self.generations,
+            shared_cache=shared_cache,
+        )
+        match_cache2 = MatchCache(
+            max_size=10,
+            get_generations=lambda: self.generations,
+            shared_cache=shared_cache,
+        )
+        match_cache1.get_or_match_many('index', ['a', 'b'], 0, lambda fingerprints: {'a': ['match-a']})
+        matches = match_cache2.get_or_match_many('index', ['a', 'b'], 0, None)
+        self.assertEqual({'a': ['match-a'], 'b': []}, matches)
+        self.assertEqual(2, match_cache2.get_stats()['shared_hits'])
+        self.assertEqual(0, match_cache2.get_stats()['misses'])
+
+    def test_index_generation_bump(self):
+        package = Package.objects.create(
+            download_url='https://test.com/test.tar.gz',
+            type='generic',
+            name='test',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ExactFileIndex.index('a' * 40, package)
+        self.assertEqual({'ExactFileIndex': 1}, IndexGeneration.get_generations())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            IndexGeneration.bump(ExactFileIndex)
+        self.assertEqual({'ExactFileIndex': 2}, IndexGeneration.get_generations())
+
+    def test_index_generation_bump_once(self):
+        package = Package.objects.create(
+            download_url='https://test.com/test.tar.gz',
+            type='generic',
+            name='test',
+            sha1='b' * 40,
+        )
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with IndexGeneration.bump_once():
+                ExactFileIndex.index('a' * 40, package)
+                ExactFileIndex.index('c' * 40, package)
+                bulk_index_packages([package])
+                with IndexGeneration.bump_once():
+                    IndexGeneration.bump(ExactFileIndex)
+                self.assertEqual({}, IndexGeneration.get_generations())
+        self.assertEqual(1, len(callbacks))
+        expected = {'ExactFileIndex': 1, 'ExactPackageArchiveIndex': 1}
+        self.assertEqual(expected, IndexGeneration.get_generations())
+
+    @override_settings(MATCHCODE_MATCH_CACHE_SIZE=100, MATCHCODE_MATCH_CACHE_GENERATION_TTL=3600)
+    def test_match_is_cached_and_invalidated_on_index(self):
+        package = Package.objects.create(
+            download_url='https://test.com/test.tar.gz',
+            type='generic',
+            name='test',
+        )
+        sha1 = 'a' * 40
+        match_cache = get_match_cache()
+        match_cache.clear()
+        match_cache.expire_generations()
+
+        self.assertEqual([], ExactFileIndex.match(sha1))
+        with self.assertNumQueries(0):
+            self.assertEqual([], ExactFileIndex.match(sha1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ExactFileIndex.index(sha1, package)
+        self.assertEqual([package], [m.package for m in ExactFileIndex.match(sha1)])
+
+        response = self.client.get(reverse('api:match-cache-stats'))
+        self.assertEqual(1, response.data['hits'])
+        self.assertEqual(2, response.data['misses'])
+
+    @override_settings(MATCHCODE_MATCH_CACHE_SIZE=100, MATCHCODE_MATCH_CACHE_GENERATION_TTL=3600)
+    def test_match_many_is_cached_and_invalidated_on_index(self):
+        package = Package.objects.create(
+            download_url='https://test.com/test.tar.gz',
+            type='generic',
+            name='test',
+        )
+        sha1 = 'a' * 40
+        other_sha1 = 'b' * 40
+        fingerprint = '00000010' + 'c' * 32
+        with self.captureOnCommitCallbacks(execute=True):
+            ExactFileIndex.index(sha1, package)
+            ApproximateDirectoryContentIndex.index(fingerprint, 'test', package)
+        match_cache = get_match_cache()
+        match_cache.clear()
+        match_cache.expire_generations()
+
+        for read_mode in ('rows', 'dual', 'package_sets'):
+            with override_settings(MATCHCODE_FILE_INDEX_READ_MODE=read_mode):
+                matches = ExactFileIndex.match_many([sha1, other_sha1])
+                self.assertEqual([package], [m.package for m in matches[sha1]])
+                with self.assertNumQueries(0):
+                    self.assertEqual(
+                        [package],
+                        [m.package for m in ExactFileIndex.match_many([sha1, other_sha1])[sha1]],
+                    )
+                    self.assertEqual([sha1], list(ExactFileIndex.match_many([other_sha1, sha1])))
+
+        matches = ApproximateDirectoryContentIndex.match_many([fingerprint])
+        self.assertEqual([package], [m.package for m in matches[fingerprint]])
+        with self.assertNumQueries(0):
+            matches = ApproximateDirectoryContentIndex.match_many([fingerprint])
+        self.assertEqual([package], [m.package for m in matches[fingerprint]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ExactFileIndex.index(other_sha1, package)
+        self.assertEqual({sha1, other_sha1}, set(ExactFileIndex.match_many([sha1, other_sha1])))
@@ -10,10 +10,15 @@
 import os
 
 from commoncode.resource import VirtualCodebase
+from django.test.utils import override_settings
+from django.utils import timezone
 
 from matchcode_toolkit.fingerprinting import compute_directory_fingerprints
 from matchcode_toolkit.fingerprinting import hexstring_to_binarray
 from matchcode.indexing import _create_virtual_codebase_from_package_resources
+from matchcode.indexing import bulk_index_packages
+from matchcode.indexing import DIRECTORY_FINGERPRINTS_STATS
+from matchcode.indexing import incremental_index_packages
 from matchcode.indexing import index_directory_fingerprints
 from matchcode.indexing import index_package_archives
 from matchcode.indexing import index_package_directories
@@ -22,8 +27,12 @@ from matchcode.management.commands import index_packages
 from matchcode.models import ApproximateDirectoryContentIndex
 from matchcode.models import ApproximateDirectoryStructureIndex
 from matchcode.models import create_halohash_chunks
+from matchcode.models import DirectoryColumnSums
 from matchcode.models import ExactPackageArchiveIndex
 from matchcode.models import ExactFileIndex
+from matchcode.models import ExactFilePackageSet
+from matchcode.models import ExactGitBlobIndex
+from matchcode.models import IndexingShard
 from matchcode.utils import load_resources_from_scan
 from matchcode.utils import MatchcodeTestCase
 from packagedb.models import Package
@@ -199,3 +208,187 @@ class IndexPackagesTestCase(MatchcodeTestCase):
         expected_adsi_fingerprint = '00000002160440008028c38c24a8038040006040'
         self.assertEqual(expected_adci_fingerprint, adci.fingerprint())
         self.assertEqual(expected_adsi_fingerprint, adsi.fingerprint())
+
+    def test_bulk_index_packages(self):
+        stats = bulk_index_packages([self.test_package1])
+        self.assertEqual([1, 1, 1, 2, 1], [
+            stats['ExactPackageArchiveIndex'][0],
+            stats['ApproximateDirectoryContentIndex'][0],
+            stats['ApproximateDirectoryStructureIndex'][0],
+            stats['ExactFileIndex'][0],
+            stats[DIRECTORY_FINGERPRINTS_STATS][0],
+        ])
+        self.assertEqual(1, ExactPackageArchiveIndex.objects.count())
+        self.assertEqual(2, ExactFileIndex.objects.count())
+        self.assertEqual(1, ApproximateDirectoryContentIndex.objects.count())
+        self.assertEqual(1, ApproximateDirectoryStructureIndex.objects.count())
+
+        adsi = ApproximateDirectoryStructureIndex.objects.get()
+        self.assertEqual('00000002160440008028c38c24a8038040006040', adsi.fingerprint())
+        self.assertEqual('test', adsi.path)
+
+        # Indexing again does not create duplicated rows, but the existing
+        # rows are counted as submitted
+        stats = bulk_index_packages([self.test_package1], batch_size=1)
+        self.assertEqual(1, stats['ExactPackageArchiveIndex'][0])
+        self.assertEqual(1, ExactPackageArchiveIndex.objects.count())
+        self.assertEqual(2, ExactFileIndex.objects.count())
+        package_sets = ExactFilePackageSet.objects.all()
+        self.assertEqual(2, len(package_sets))
+        for package_set in package_sets:
+            self.assertEqual([self.test_package1.id], package_set.package_ids)
+            self.assertEqual(1, package_set.packages_count)
+        self.assertEqual(1, ApproximateDirectoryContentIndex.objects.count())
+        self.assertEqual(1, ApproximateDirectoryStructureIndex.objects.count())
+
+    def test_bulk_index_packages_git_blobs(self):
+        resources = list(Resource.objects.filter(package=self.test_package1, is_file=True))
+        git_sha1s = ['1' * 40, 'A' * 40]
+        for resource, git_sha1 in zip(resources, git_sha1s):
+            resource.git_sha1 = git_sha1
+            resource.save()
+
+        stats = bulk_index_packages([self.test_package1])
+        self.assertEqual(2, stats['ExactGitBlobIndex'][0])
+        indexed = sorted(index.fingerprint() for index in ExactGitBlobIndex.objects.all())
+        self.assertEqual(['1' * 40, 'a' * 40], indexed)
+        self.assertEqual([self.test_package1], [m.package for m in ExactGitBlobIndex.match('a' * 40)])
+
+        # Indexing again does not create duplicated rows
+        bulk_index_packages([self.test_package1], batch_size=1)
+        self.assertEqual(2, ExactGitBlobIndex.objects.count())
+
+    def test_index_packages_shards(self):
+        test_package2 = Package.objects.create(
+            filename='abbot-0.12.4.jar',
+            sha1='61d28a27d919ce8690a40f4f335b9d591ceb16e9',
+            name='abbot',
+            version='0.12.4',
+            download_url='http://repo1.maven.org/maven2/abbot/abbot/0.12.4/abbot-0.12.4.jar',
+            type='maven',
+        )
+        index_packages.create_shards(shard_size=1)
+        shards = list(IndexingShard.objects.all())
+        expected = [
+            (self.test_package1.id, self.test_package1.id + 1),
+            (test_package2.id, test_package2.id + 1),
+        ]
+        self.assertEqual(expected, [(s.start_package_id, s.end_package_id) for s in shards])
+
+        # Index the first shard only, as if the run was interrupted
+        index_packages.index_shard(shards[0].id)
+        self.assertEqual(1, ExactPackageArchiveIndex.objects.count())
+        shards[0].refresh_from_db()
+        self.assertEqual(self.test_package1.id, shards[0].last_indexed_package_id)
+        self.assertTrue(shards[0].completed_date)
+
+        package_indexer = index_packages.Command()
+        package_indexer.handle(resume=True)
+        self.assertEqual(2, ExactPackageArchiveIndex.objects.count())
+        self.assertFalse(IndexingShard.objects.filter(completed_date__isnull=True))
+        self.assertEqual(2, IndexingShard.objects.count())
+
+    def test_index_packages_incremental(self):
+        packages_count, _ = index_packages.index_modified_packages()
+        self.assertEqual(1, packages_count)
+        self.test_package1.refresh_from_db()
+        self.assertTrue(self.test_package1.last_indexed_date)
+        self.assertTrue(self.test_package1.indexed_resources_digest)
+        self.assertEqual(2, ExactFileIndex.objects.count())
+        file_index_ids = set(ExactFileIndex.objects.values_list('id', flat=True))
+
+        # Unmodified Packages are not indexed again
+        packages_count, _ = index_packages.index_modified_packages()
+        self.assertEqual(0, packages_count)
+
+        # Modified Packages are indexed again, but their files and directories
+        # are not indexed again when their Resources have not changed
+        self.test_package1.last_modified_date = timezone.now()
+        self.test_package1.save()
+        packages_count, stats = index_packages.index_modified_packages()
+        self.assertEqual(1, packages_count)
+        self.assertEqual(['ExactPackageArchiveIndex'], list(stats))
+        self.assertEqual(file_index_ids, set(ExactFileIndex.objects.values_list('id', flat=True)))
+
+        # Files and directories are indexed again when Resources have changed
+        Resource.objects.create(
+            package=self.test_package1,
+            path='test/new.txt',
+            sha1='3f5e8ab3a4b5d0a7d9bd1e0f2b1e7b8a9c0d1e2f',
+            size=10,
+            is_file=True,
+        )
+        self.test_package1.last_modified_date = timezone.now()
+        self.test_package1.save()
+        previous_digest = self.test_package1.indexed_resources_digest
+        packages_count, stats = index_packages.index_modified_packages()
+        self.assertEqual(1, packages_count)
+        self.assertEqual(3, stats['ExactFileIndex'][0])
+        self.assertEqual(3, ExactFileIndex.objects.count())
+        self.assertEqual(3, ExactFilePackageSet.objects.filter(packages_count=1).count())
+        self.assertEqual(1, ApproximateDirectoryContentIndex.objects.count())
+        self.test_package1.refresh_from_db()
+        self.assertNotEqual(previous_digest, self.test_package1.indexed_resources_digest)
+
+    def get_directory_index_rows(self):
+        return {
+            model_class.__name__: sorted(
+                (index.path, index.fingerprint())
+                for index in model_class.objects.filter(package=self.test_package1)
+            )
+            for model_class in (ApproximateDirectoryContentIndex, ApproximateDirectoryStructureIndex)
+        }
+
+    def get_column_sums(self):
+        return {
+            column_sums.path: (column_sums.to_directory_columns(), column_sums.file_states)
+            for column_sums in DirectoryColumnSums.objects.filter(package=self.test_package1)
+        }
+
+    @override_settings(MATCHCODE_DIRECTORY_COLUMN_SUMS=True)
+    def test_incremental_index_packages_with_directory_column_sums(self):
+        bulk_index_packages([self.test_package1])
+        self.assertEqual({'test', 'test/dir'}, set(self.get_column_sums()))
+        self.test_package1.refresh_from_db()
+
+        Resource.objects.filter(package=self.test_package1, path='test/a').update(
+            sha1='3f5e8ab3a4b5d0a7d9bd1e0f2b1e7b8a9c0d1e2f',
+            size=20,
+        )
+        Resource.objects.create(
+            package=self.test_package1,
+            path='test/dir/new',
+            sha1='a' * 40,
+            size=10,
+            is_file=True,
+        )
+        Resource.objects.create(package=self.test_package1, path='test/sub', is_file=False)
+        Resource.objects.create(
+            package=self.test_package1,
+            path='test/sub/c',
+            sha1='b' * 40,
+            size=30,
+            is_file=True,
+        )
+        stats = incremental_index_packages([self.test_package1])
+        self.assertEqual(3, stats['DirectoryColumnSums'][0])
+        incremental_rows = self.get_directory_index_rows()
+        incremental_column_sums = self.get_column_sums()
+        self.assertEqual({'test', 'test/dir', 'test/sub'}, set(incremental_column_sums))
+
+        # The incremental update gives the same fingerprints as indexing all
+        # the directories again
+        ApproximateDirectoryContentIndex.objects.all().delete()
+        ApproximateDirectoryStructureIndex.objects.all().delete()
+        DirectoryColumnSums.objects.all().delete()
+        bulk_index_packages([self.test_package1])
+        self.assertEqual(self.get_directory_index_rows(), incremental_rows)
+        self.assertEqual(self.get_column_sums(), incremental_column_sums)
+
+        # Removed directories are removed from the indexes
+        self.test_package1.refresh_from_db()
+        Resource.objects.filter(package=self.test_package1, path__startswith='test/dir').delete()
+        incremental_index_packages([self.test_package1])
+        self.assertEqual({'test', 'test/sub'}, set(self.get_column_sums()))
+        paths = {path for path, _ in self.get_directory_index_rows()['ApproximateDirectoryContentIndex']}
+        self.assertEqual({'test'}, paths)
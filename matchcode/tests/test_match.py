@@ -8,9 +8,13 @@
 #
 
 import os
+from unittest import mock
 
 import attr
+from commoncode.resource import Resource
 from commoncode.resource import VirtualCodebase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from packagedb.models import Package
 
 from matchcode_toolkit.fingerprinting import compute_directory_fingerprints
@@ -19,8 +23,15 @@ from matchcode.match import EXACT_PACKAGE_ARCHIVE_MATCH
 from matchcode.match import APPROXIMATE_DIRECTORY_STRUCTURE_MATCH
 from matchcode.match import APPROXIMATE_DIRECTORY_CONTENT_MATCH
 from matchcode.match import EXACT_FILE_MATCH
+from matchcode.match import EXACT_GIT_BLOB_MATCH
 from matchcode.match import do_match
+from matchcode.match import get_package_scores
+from matchcode.match import iter_git_ls_tree_files
+from matchcode.match import MatchSession
 from matchcode.match import path_suffixes
+from matchcode.match import PackagePathTrie
+from matchcode.models import ExactFileIndex
+from matchcode.models import ExactGitBlobIndex
 from matchcode.utils import index_package_files_sha1
 from matchcode.utils import index_packages_sha1
 from matchcode.utils import load_resources_from_scan
@@ -116,6 +127,97 @@ class MatchPackagesTestCase(MatchcodeTestCase):
         expected = self.get_test_loc('models/match-test-approximate-directory-structure-results.json')
         self.check_codebase(vc, expected, regen=False)
 
+    def test_do_match_individual_file_match_loads_package_paths_once(self):
+        input_file = self.get_test_loc('models/match-test.json')
+        vc = VirtualCodebase(
+            location=input_file,
+            codebase_attributes=dict(
+                matches=attr.ib(default=attr.Factory(list))
+            ),
+            resource_attributes=dict(
+                matched_to=attr.ib(default=attr.Factory(list))
+            )
+        )
+        with CaptureQueriesContext(connection) as context:
+            match_count = do_match(vc, EXACT_FILE_MATCH)
+        self.assertTrue(match_count)
+        # The Resource paths of the single matched package are loaded once
+        resource_queries = [
+            query for query in context.captured_queries
+            if 'FROM "packagedb_resource"' in query['sql']
+        ]
+        self.assertEqual(1, len(resource_queries))
+
+    def test_do_match_with_session_saves_matched_resources_once(self):
+        input_file = self.get_test_loc('models/match-test.json')
+        vc = VirtualCodebase(
+            location=input_file,
+            codebase_attributes=dict(
+                matches=attr.ib(default=attr.Factory(list))
+            ),
+            resource_attributes=dict(
+                matched_to=attr.ib(default=attr.Factory(list))
+            )
+        )
+        vc = compute_directory_fingerprints(vc)
+        session = MatchSession(vc)
+        saved_paths = []
+        original_save = Resource.save
+
+        def save(resource, codebase):
+            saved_paths.append(resource.path)
+            return original_save(resource, codebase)
+
+        with mock.patch.object(Resource, 'save', save):
+            for match_type in (APPROXIMATE_DIRECTORY_CONTENT_MATCH, EXACT_FILE_MATCH):
+                do_match(vc, match_type, session=session)
+            self.assertEqual([], saved_paths)
+            updated_count = session.flush()
+
+        self.assertTrue(updated_count)
+        self.assertEqual(updated_count, len(saved_paths))
+        self.assertEqual(len(set(saved_paths)), len(saved_paths))
+        matched_paths = [
+            resource.path for resource in vc.walk()
+            if resource.extra_data.get('matched')
+        ]
+        self.assertEqual(sorted(session.matched_paths), sorted(matched_paths))
+
+    def test_get_package_scores(self):
+        package_sha1s = [
+            fingerprint.fingerprint()
+            for fingerprint in ExactFileIndex.objects.filter(package=self.test_package4)
+        ]
+        self.assertTrue(len(package_sha1s) > 2)
+        # A package that contains two of the files
+        for sha1 in package_sha1s[:2] + ['b' * 40]:
+            ExactFileIndex.index(sha1, self.test_package1)
+
+        codebase_sha1s = package_sha1s[1:] + ['0' * 40, None]
+        with self.assertNumQueries(2):
+            scores = get_package_scores(codebase_sha1s)
+
+        matched_count = len(package_sha1s) - 1
+        expected = [
+            dict(
+                package=self.test_package4,
+                matched_files_count=matched_count,
+                package_files_count=len(package_sha1s),
+                coverage=round(matched_count / len(package_sha1s), 4),
+                containment=round(matched_count / (matched_count + 1), 4),
+            ),
+            dict(
+                package=self.test_package1,
+                matched_files_count=1,
+                package_files_count=3,
+                coverage=0.3333,
+                containment=round(1 / (matched_count + 1), 4),
+            ),
+        ]
+        self.assertEqual(expected, scores)
+        self.assertEqual(expected[:1], get_package_scores(codebase_sha1s, limit=1))
+        self.assertEqual([], get_package_scores([]))
+
     def test_do_match_approximate_directory_content_match(self):
         input_file = self.get_test_loc('models/match-test.json')
         vc = run_do_match_from_scan(input_file, APPROXIMATE_DIRECTORY_CONTENT_MATCH)
@@ -129,6 +231,33 @@ class MatchPackagesTestCase(MatchcodeTestCase):
         self.check_codebase(vc, expected, regen=False)
 
 
+    def test_do_match_git_blob_match(self):
+        ExactGitBlobIndex.index('1' * 40, self.test_package4)
+        ls_tree_lines = [
+            f'100644 blob {"1" * 40}\tsrc/main.c\n',
+            f'100644 blob {"2" * 40}\tsrc/other.c\n',
+            f'120000 blob {"1" * 40}\tsrc/link.c\n',
+        ]
+        vc = VirtualCodebase(
+            location=dict(files=list(iter_git_ls_tree_files(ls_tree_lines))),
+            codebase_attributes=dict(
+                matches=attr.ib(default=attr.Factory(list))
+            ),
+            resource_attributes=dict(
+                matched_to=attr.ib(default=attr.Factory(list))
+            )
+        )
+        self.assertEqual(1, do_match(vc, EXACT_GIT_BLOB_MATCH))
+
+        matched = {
+            resource.path: resource.matched_to
+            for resource in vc.walk() if resource.matched_to
+        }
+        self.assertEqual({'src/main.c': [self.test_package4.package_url]}, matched)
+        match_types = [package['match_type'] for package in vc.attributes.matches]
+        self.assertEqual(['exact-git-blob'], match_types)
+
+
 class MatchNestedPackagesTestCase(MatchcodeTestCase):
     BASE_DIR = os.path.join(os.path.dirname(__file__), 'testfiles')
     maxDiff = None
@@ -168,6 +297,29 @@ class MatchNestedPackagesTestCase(MatchcodeTestCase):
         expected = self.get_test_loc('match/nested/nested-expected.json')
         self.check_codebase(vc, expected, regen=False)
 
+    def test_match_session_prunes_matched_subtrees(self):
+        input_file = self.get_test_loc('match/nested/nested.json')
+        vc = VirtualCodebase(
+            location=input_file,
+            codebase_attributes=dict(
+                matches=attr.ib(default=attr.Factory(list))
+            ),
+            resource_attributes=dict(
+                matched_to=attr.ib(default=attr.Factory(list))
+            )
+        )
+        vc = compute_directory_fingerprints(vc)
+        session = MatchSession(vc)
+        do_match(vc, APPROXIMATE_DIRECTORY_STRUCTURE_MATCH, session=session)
+        self.assertTrue(session.matched_subtree_paths)
+
+        walked_paths = [resource.path for resource in session.walk()]
+        for subtree_path in session.matched_subtree_paths:
+            self.assertIn(subtree_path, walked_paths)
+            descendants = [path for path in walked_paths if path.startswith(subtree_path + '/')]
+            self.assertEqual([], descendants)
+        self.assertLess(len(walked_paths), len(list(vc.walk())))
+
 
 class MatchUtilityFunctionsTestCase(MatchcodeTestCase):
     def test_path_suffixes(self):
@@ -175,6 +327,23 @@ class MatchUtilityFunctionsTestCase(MatchcodeTestCase):
         expected = ['foo/bar/baz/qux', 'bar/baz/qux', 'baz/qux', 'qux']
         self.assertEqual(expected, suffixes)
 
+    def test_package_path_trie(self):
+        trie = PackagePathTrie(['foo/bar/baz/qux', 'qux2', 'bar/baz'])
+        self.assertTrue(trie.has_path_suffix('/foo/bar/baz/qux'))
+        self.assertTrue(trie.has_path_suffix('root/foo/bar/baz/qux'))
+        self.assertTrue(trie.has_path_suffix('root/qux2'))
+        self.assertTrue(trie.has_path_suffix('root/foo/bar/baz'))
+        self.assertFalse(trie.has_path_suffix('bar/baz/qux'))
+        self.assertFalse(trie.has_path_suffix('root/baz'))
+        self.assertFalse(trie.has_path_suffix('root/qux2/qux/'))
+
+    def test_package_path_trie_has_path_suffix_same_as_path_suffixes(self):
+        paths = ['a/b/c', 'b/c', 'x/y', 'd/e/f/g', 'z']
+        trie = PackagePathTrie(paths)
+        for path in ['r/a/b/c', 'r/x/y/z', 'r/e/f/g', 'e/f/g', 'c', 'a/b', '/z']:
+            expected = any(suffix in paths for suffix in path_suffixes(path))
+            self.assertEqual(expected, trie.has_path_suffix(path), path)
+
 
 class DirectoryMatchingTestCase(MatchcodeTestCase):
     BASE_DIR = os.path.join(os.path.dirname(__file__), 'testfiles')
@@ -0,0 +1,215 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+from io import StringIO
+import json
+import os
+
+from django.core import management
+
+from matchcode.indexing import index_package_directories
+from matchcode.management.commands.match_scan import iter_scan_chunks
+from matchcode.management.commands.match_scan import iter_scan_resources
+from matchcode.management.commands.match_scan import match_scan
+from matchcode.models import ExactFilePackageSet
+from matchcode.models import ExactGitBlobIndex
+from matchcode.models import PACKAGE_SET_MAX_SIZE
+from matchcode.utils import index_package_files_sha1
+from matchcode.utils import load_resources_from_scan
+from matchcode.utils import MatchcodeTestCase
+from matchcode_toolkit.fingerprinting import hexstring_to_binarray
+from minecode.utils import get_temp_file
+from packagedb.models import Package
+
+
+class MatchScanTestCase(MatchcodeTestCase):
+    BASE_DIR = os.path.join(os.path.dirname(__file__), 'testfiles')
+    maxDiff = None
+
+    def setUp(self):
+        super(MatchScanTestCase, self).setUp()
+        self.test_package, _ = Package.objects.get_or_create(
+            filename='test.tar.gz',
+            sha1='deadbeef',
+            size=42589,
+            name='test',
+            version='0.01',
+            download_url='https://test.com/test.tar.gz',
+            type='maven'
+        )
+        self.scan = self.get_test_loc('models/match-test.json')
+        load_resources_from_scan(self.scan, self.test_package)
+        index_package_directories(self.test_package)
+        index_package_files_sha1(self.test_package, self.scan)
+
+    def test_iter_scan_resources(self):
+        resources = list(iter_scan_resources(self.scan))
+        with open(self.scan) as f:
+            expected_paths = [r['path'] for r in json.load(f)['files']]
+        self.assertEqual(expected_paths, [r['path'] for r in resources])
+        for resource in resources:
+            self.assertFalse(set(resource) - {'path', 'type', 'size', 'sha1', 'md5', 'is_archive'})
+
+    def test_iter_scan_chunks(self):
+        resources = [
+            dict(path='root', type='directory'),
+            dict(path='root/a', type='directory'),
+            dict(path='root/a/1', type='file'),
+            dict(path='root/a/2', type='file'),
+            dict(path='root/b', type='directory'),
+            dict(path='root/b/c', type='directory'),
+            dict(path='root/b/c/1', type='file'),
+            dict(path='root/b/c/2', type='file'),
+            dict(path='root/b/c/3', type='file'),
+            dict(path='root/b/1', type='file'),
+            dict(path='root/1', type='file'),
+            dict(path='other', type='directory'),
+            dict(path='other/1', type='file'),
+        ]
+        chunks = [
+            ([resource['path'] for resource in chunk], sorted(partial_paths))
+            for chunk, partial_paths in iter_scan_chunks(iter(resources), max_resources=3)
+        ]
+        expected = [
+            (['root', 'root/a', 'root/a/1', 'root/a/2'], ['root']),
+            (['root', 'root/b', 'root/b/c', 'root/b/c/1', 'root/b/c/2', 'root/b/c/3'], ['root', 'root/b', 'root/b/c']),
+            (['root', 'root/b', 'root/b/1'], ['root', 'root/b']),
+            (['root', 'root/1'], ['root']),
+            (['other', 'other/1'], []),
+        ]
+        self.assertEqual(expected, chunks)
+
+    def test_iter_scan_chunks_is_streamed(self):
+        read_paths = []
+
+        def iter_resources():
+            yield dict(path='root', type='directory')
+            for i in range(10):
+                path = f'root/{i}'
+                read_paths.append(path)
+                yield dict(path=path, type='file')
+
+        for chunk, _ in iter_scan_chunks(iter_resources(), max_resources=4):
+            # Each chunk is yielded before the next Resources are read and
+            # contains at most 4 Resources and their partial ancestor
+            self.assertIn(chunk[-1]['path'], read_paths[-2:])
+            self.assertLessEqual(len(chunk), 5)
+
+    def test_match_scan_in_chunks(self):
+        output = get_temp_file('match_scan', extension='.jsonl')
+        with open(output, 'w') as f:
+            _, chunk_count = match_scan(self.scan, f, max_resources=2)
+        with open(output) as f:
+            lines = [json.loads(line) for line in f]
+
+        self.assertEqual(3, chunk_count)
+        # The test and test/a directories do not fit in a chunk and are not
+        # matched as a whole, but their files are
+        purl = self.test_package.package_url
+        matched_resources = [line['resource'] for line in lines if 'resource' in line]
+        self.assertEqual(
+            ['test/c', 'test/a/acegi-security-0.51.jar', 'test/a/dojoz-0.4.1-1.jar', 'test/b/abbot-0.12.3.jar'],
+            [matched_resource['path'] for matched_resource in matched_resources],
+        )
+        for matched_resource in matched_resources:
+            self.assertEqual([purl], matched_resource['matched_to'])
+        self.assertEqual(
+            [(purl, 'exact-file')],
+            [(line['package']['purl'], line['package']['match_type']) for line in lines if 'package' in line],
+        )
+
+    def test_match_scan_low_signal_files(self):
+        with open(self.scan) as f:
+            sha1 = next(r['sha1'] for r in json.load(f)['files'] if r['path'] == 'test/c')
+        package_ids = range(1000, 1000 + PACKAGE_SET_MAX_SIZE + 1)
+        ExactFilePackageSet.add_packages(
+            (hexstring_to_binarray(sha1), package_id) for package_id in package_ids
+        )
+
+        output = StringIO()
+        match_scan(self.scan, output, max_resources=2)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        low_signal_resources = [
+            line['resource'] for line in lines
+            if 'resource' in line and not line['resource']['matched_to']
+        ]
+        expected = [dict(
+            path='test/c',
+            type='file',
+            sha1=sha1,
+            matched_to=[],
+            low_signal_packages_count=PACKAGE_SET_MAX_SIZE + 1,
+        )]
+        self.assertEqual(expected, low_signal_resources)
+
+    def test_match_scan_command(self):
+        output = get_temp_file('match_scan', extension='.jsonl')
+        management.call_command('match_scan', self.scan, output)
+        with open(output) as f:
+            lines = [json.loads(line) for line in f]
+
+        matched_resources = [line['resource'] for line in lines if 'resource' in line]
+        matched_packages = [line['package'] for line in lines if 'package' in line]
+        purl = self.test_package.package_url
+        self.assertTrue(matched_resources)
+        for matched_resource in matched_resources:
+            self.assertEqual([purl], matched_resource['matched_to'])
+        self.assertEqual(
+            [(purl, 'approximate-content')],
+            [(p['purl'], p['match_type']) for p in matched_packages],
+        )
+
+    def test_match_git_tree_command(self):
+        ExactGitBlobIndex.index('1' * 40, self.test_package)
+        ls_tree = get_temp_file('match_git_tree', extension='.txt')
+        with open(ls_tree, 'w') as f:
+            f.write(f'100644 blob {"1" * 40}\tsrc/main.c\n')
+            f.write(f'100644 blob {"2" * 40}\t"src/caf\\303\\251.c"\n')
+            f.write(f'160000 commit {"3" * 40}\tvendor/lib\n')
+
+        output = get_temp_file('match_git_tree', extension='.jsonl')
+        management.call_command('match_git_tree', ls_tree, output, root_name='repo')
+        with open(output) as f:
+            lines = [json.loads(line) for line in f]
+
+        purl = self.test_package.package_url
+        expected = [
+            dict(resource=dict(
+                path='repo/src/main.c',
+                type='file',
+                sha1=None,
+                matched_to=[purl],
+                git_sha1='1' * 40,
+            )),
+        ]
+        self.assertEqual(expected, [line for line in lines if 'resource' in line])
+        self.assertEqual(
+            [(purl, 'exact-git-blob')],
+            [(line['package']['purl'], line['package']['match_type']) for line in lines if 'package' in line],
+        )
+
+        management.call_command('match_git_tree', ls_tree, output, top_packages=5)
+        with open(output) as f:
+            package_scores = [json.loads(line)['package_score'] for line in f if 'package_score' in line]
+        self.assertEqual([purl], [score['purl'] for score in package_scores])
+        self.assertEqual(0.5, package_scores[0]['containment'])
+
+    def test_match_scan_command_top_packages(self):
+        output = get_temp_file('match_scan', extension='.jsonl')
+        management.call_command('match_scan', self.scan, output, top_packages=5)
+        with open(output) as f:
+            lines = [json.loads(line) for line in f]
+
+        self.assertFalse([line for line in lines if 'package' in line])
+        package_scores = [line['package_score'] for line in lines if 'package_score' in line]
+        self.assertEqual(1, len(package_scores))
+        package_score = package_scores[0]
+        self.assertEqual(self.test_package.package_url, package_score['purl'])
+        self.assertEqual(1.0, package_score['coverage'])
+        self.assertEqual(1.0, package_score['containment'])
@@ -7,7 +7,11 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+import binascii
 import os
+import random
+
+from django.test import override_settings
 
 from commoncode.resource import VirtualCodebase
 from packagedb.models import Package
@@ -15,12 +19,16 @@ import attr
 
 from matchcode_toolkit.fingerprinting import compute_directory_fingerprints
 from matchcode_toolkit.fingerprinting import hexstring_to_binarray
+from matchcode.benchmark import benchmark_threshold
+from matchcode.benchmark import flip_random_bits
 from matchcode.management.commands.index_packages import index_package_directories
 from matchcode.models import ApproximateDirectoryContentIndex
 from matchcode.models import ApproximateDirectoryStructureIndex
 from matchcode.models import create_halohash_chunks
 from matchcode.models import ExactPackageArchiveIndex
 from matchcode.models import ExactFileIndex
+from matchcode.models import ExactFilePackageSet
+from matchcode.models import PACKAGE_SET_MAX_SIZE
 from matchcode.utils import index_packages_sha1
 from matchcode.utils import index_package_files_sha1
 from matchcode.utils import load_resources_from_scan
@@ -102,6 +110,25 @@ class ExactPackageArchiveIndexModelTestCase(BaseModelTest):
         expected = [self.test_package1_metadata]
         self.assertEqual(expected, result)
 
+    def test_ExactPackageArchiveIndex_match_many(self):
+        sha1s = [
+            '51d28a27d919ce8690a40f4f335b9d591ceb16e9',
+            'ae9d68fd6a29906606c2d9407d1cc0749ef84588',
+            '51d28a27d919ce8690a40f4f335b9d591ceb16e9',
+            '0000000000000000000000000000000000000000',
+            None,
+        ]
+        results = ExactPackageArchiveIndex.match_many(sha1s, chunk_size=1)
+        results = {
+            sha1: [m.package.to_dict() for m in matches]
+            for sha1, matches in results.items()
+        }
+        expected = {
+            '51d28a27d919ce8690a40f4f335b9d591ceb16e9': [self.test_package1_metadata],
+            'ae9d68fd6a29906606c2d9407d1cc0749ef84588': [self.test_package2_metadata],
+        }
+        self.assertEqual(expected, results)
+
 
 class ExactFileIndexModelTestCase(BaseModelTest):
     def test_ExactFileIndex_match(self):
@@ -129,6 +156,100 @@ class ExactFileIndexModelTestCase(BaseModelTest):
         expected = self.get_test_loc('models/exact-file-matching-standalone-test-results.json')
         self.check_codebase(codebase, expected, regen=False)
 
+    def test_ExactFileIndex_match_many_read_modes(self):
+        sha1s = [
+            bytes(sha1) for sha1 in
+            ExactFileIndex.objects.filter(package=self.test_package4).values_list('sha1', flat=True)
+        ]
+        ExactFilePackageSet.add_packages((sha1, self.test_package4.id) for sha1 in sha1s)
+        hex_sha1s = [binascii.hexlify(sha1).decode('utf-8') for sha1 in sha1s]
+
+        results = {}
+        for read_mode in ('rows', 'dual', 'package_sets'):
+            with override_settings(MATCHCODE_FILE_INDEX_READ_MODE=read_mode):
+                matches_by_sha1 = ExactFileIndex.match_many(hex_sha1s)
+            results[read_mode] = {
+                sha1: [m.package.id for m in matches]
+                for sha1, matches in matches_by_sha1.items()
+            }
+        self.assertEqual(len(set(hex_sha1s)), len(results['rows']))
+        self.assertEqual(results['rows'], results['dual'])
+        self.assertEqual(results['rows'], results['package_sets'])
+
+    def test_ExactFileIndex_match_many_dual_read_falls_back_to_rows(self):
+        sha1 = ExactFileIndex.objects.filter(package=self.test_package4).first().fingerprint()
+        self.assertFalse(ExactFilePackageSet.objects.exists())
+
+        with override_settings(MATCHCODE_FILE_INDEX_READ_MODE='dual'):
+            results = ExactFileIndex.match_many([sha1])
+        self.assertEqual([self.test_package4.id], [m.package.id for m in results[sha1]])
+
+        with override_settings(MATCHCODE_FILE_INDEX_READ_MODE='package_sets'):
+            results = ExactFileIndex.match_many([sha1])
+        self.assertEqual({}, results)
+
+    def test_ExactFilePackageSet_low_signal_sha1(self):
+        sha1 = 'a' * 40
+        sha1_bin = hexstring_to_binarray(sha1)
+        package_ids = range(1000, 1000 + PACKAGE_SET_MAX_SIZE + 5)
+        ExactFilePackageSet.add_packages((sha1_bin, package_id) for package_id in package_ids)
+        ExactFilePackageSet.add_packages([(sha1_bin, 5000)])
+
+        package_set = ExactFilePackageSet.objects.get()
+        self.assertEqual(PACKAGE_SET_MAX_SIZE, len(package_set.package_ids))
+        self.assertEqual(PACKAGE_SET_MAX_SIZE + 6, package_set.packages_count)
+        self.assertTrue(package_set.is_low_signal)
+
+        with override_settings(MATCHCODE_FILE_INDEX_READ_MODE='dual'):
+            with self.assertNumQueries(1):
+                matches, low_signal_sha1s = ExactFileIndex.match_many_with_low_signal([sha1])
+            self.assertEqual({}, matches)
+            self.assertEqual({sha1: PACKAGE_SET_MAX_SIZE + 6}, low_signal_sha1s)
+            self.assertEqual({}, ExactFileIndex.match_many([sha1]))
+        with override_settings(MATCHCODE_FILE_INDEX_READ_MODE='rows'):
+            _, low_signal_sha1s = ExactFileIndex.match_many_with_low_signal([sha1])
+            self.assertEqual({}, low_signal_sha1s)
+
+    def test_ExactFilePackageSet_remove_package(self):
+        sha1s = [
+            bytes(sha1) for sha1 in
+            ExactFileIndex.objects.filter(package=self.test_package4).values_list('sha1', flat=True)
+        ]
+        ExactFilePackageSet.add_packages((sha1, self.test_package4.id) for sha1 in sha1s)
+        ExactFilePackageSet.add_packages([(sha1s[0], self.test_package1.id)])
+
+        ExactFilePackageSet.remove_package(self.test_package4.id)
+        package_set = ExactFilePackageSet.objects.get()
+        self.assertEqual(sha1s[0], bytes(package_set.sha1))
+        self.assertEqual([self.test_package1.id], package_set.package_ids)
+        self.assertEqual(1, package_set.packages_count)
+
+    def test_ExactFilePackageSet_add_packages_in_a_single_query(self):
+        sha1s = [hexstring_to_binarray(c * 40) for c in 'cba']
+        rows = [(sha1, package_id) for sha1 in sha1s for package_id in (3, 1, 2, 1)]
+        with self.assertNumQueries(1):
+            ExactFilePackageSet.add_packages(rows)
+        package_sets = ExactFilePackageSet.objects.order_by('sha1')
+        self.assertEqual(
+            [(c * 40, [1, 2, 3], 3) for c in 'abc'],
+            [(p.fingerprint(), p.package_ids, p.packages_count) for p in package_sets],
+        )
+
+    def test_ExactFilePackageSet_package_removed_on_delete(self):
+        sha1s = [
+            bytes(sha1) for sha1 in
+            ExactFileIndex.objects.filter(package=self.test_package4).values_list('sha1', flat=True)
+        ]
+        ExactFilePackageSet.add_packages((sha1, self.test_package4.id) for sha1 in sha1s)
+        ExactFileIndex.index(binascii.hexlify(sha1s[0]).decode('utf-8'), self.test_package1)
+
+        self.test_package4.delete()
+        package_set = ExactFilePackageSet.objects.get()
+        self.assertEqual([self.test_package1.id], package_set.package_ids)
+
+        Package.objects.filter(pk=self.test_package1.pk).delete()
+        self.assertFalse(ExactFilePackageSet.objects.exists())
+
 
 class ApproximateDirectoryMatchingIndexModelTestCase(MatchcodeTestCase):
     BASE_DIR = os.path.join(os.path.dirname(__file__), 'testfiles')
@@ -209,6 +330,91 @@ class ApproximateDirectoryMatchingIndexModelTestCase(MatchcodeTestCase):
         expected = self.get_test_loc('models/directory-matching/async-0.2.9-i-expected-content.json')
         self.check_codebase(codebase, expected, regen=False)
 
+    def test_ApproximateDirectoryContentIndex_match_is_ranked_with_distances(self):
+        scan_location = self.get_test_loc('models/directory-matching/async-0.2.9-i.json')
+        vc = VirtualCodebase(location=scan_location)
+        codebase = compute_directory_fingerprints(vc)
+
+        for resource in codebase.walk(topdown=True):
+            if resource.is_file:
+                continue
+            fp = resource.extra_data.get('directory_content', '')
+            matches = ApproximateDirectoryContentIndex.match(fp)
+            distances = [match.hamming_distance for match in matches]
+            self.assertEqual(sorted(distances), distances)
+            self.assertTrue(all(d < 8 for d in distances))
+            if 0 in distances:
+                self.assertEqual([0] * len(distances), distances)
+
+    def test_ApproximateDirectoryContentIndex_match_distances_computed_in_database(self):
+        rng = random.Random(7)
+        fingerprints = [
+            index.fingerprint()
+            for index in ApproximateDirectoryContentIndex.objects.all()
+        ]
+        for fingerprint in fingerprints:
+            altered = flip_random_bits(fingerprint, 12, rng)
+            matches = ApproximateDirectoryContentIndex.match(altered, threshold=16)
+            self.assertIn(fingerprint, [m.fingerprint() for m in matches])
+            for match in matches:
+                expected = bin(int(altered[8:], 16) ^ int(match.fingerprint()[8:], 16)).count('1')
+                self.assertEqual(expected, match.hamming_distance)
+
+    def test_ApproximateDirectoryContentIndex_match_many_approximate(self):
+        rng = random.Random(11)
+        fingerprints = [
+            index.fingerprint()
+            for index in ApproximateDirectoryContentIndex.objects.all()
+        ]
+        altered_fingerprints = [flip_random_bits(fp, 9, rng) for fp in fingerprints]
+        with self.assertNumQueries(2):
+            matches_by_fingerprint = ApproximateDirectoryContentIndex.match_many_approximate(
+                altered_fingerprints, threshold=16,
+            )
+
+        for altered in altered_fingerprints:
+            expected = [
+                (m.pk, m.hamming_distance)
+                for m in ApproximateDirectoryContentIndex.match(altered, threshold=16)
+            ]
+            results = [
+                (m.pk, m.hamming_distance)
+                for m in matches_by_fingerprint.get(altered, [])
+            ]
+            self.assertEqual(expected, results)
+
+        # One exact query and one approximate query with its matches
+        with self.assertNumQueries(3):
+            ApproximateDirectoryContentIndex.match_many(altered_fingerprints, threshold=16)
+
+    def test_ApproximateDirectoryContentIndex_get_candidates_recall(self):
+        rng = random.Random(42)
+        fingerprints = [
+            index.fingerprint()
+            for index in ApproximateDirectoryContentIndex.objects.all()
+        ]
+        for threshold in (0, 3, 5, 8, 11, 16):
+            for fingerprint in fingerprints:
+                altered = flip_random_bits(fingerprint, threshold, rng)
+                candidates = ApproximateDirectoryContentIndex.get_candidates(altered, threshold=threshold)
+                candidate_fingerprints = [c.fingerprint() for c in candidates]
+                self.assertIn(fingerprint, candidate_fingerprints)
+
+    def test_ApproximateDirectoryContentIndex_get_candidates_invalid_threshold(self):
+        fingerprint = ApproximateDirectoryContentIndex.objects.all()[0].fingerprint()
+        with self.assertRaises(ValueError):
+            ApproximateDirectoryContentIndex.get_candidates(fingerprint, threshold=17)
+
+    def test_benchmark_threshold(self):
+        fingerprints = [
+            index.fingerprint()
+            for index in ApproximateDirectoryContentIndex.objects.all()
+        ]
+        low = benchmark_threshold(ApproximateDirectoryContentIndex, fingerprints, 0)
+        high = benchmark_threshold(ApproximateDirectoryContentIndex, fingerprints, 16)
+        self.assertEqual(1, low['avg_matches'])
+        self.assertLessEqual(low['avg_candidates'], high['avg_candidates'])
+
 
 class MatchcodeModelUtilsTestCase(MatchcodeTestCase):
     def test_create_halohash_chunks(self):
@@ -0,0 +1,137 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import os
+
+from django.test.utils import override_settings
+import numpy
+
+from matchcode.models import ExactPackageArchiveIndex
+from matchcode.snapshot import build_snapshot
+from matchcode.snapshot import get_snapshot
+from matchcode.snapshot import get_snapshot_location
+from matchcode.snapshot import merge_sha1s
+from matchcode.snapshot import Sha1Snapshot
+from matchcode.snapshot import SHA1_DTYPE
+from matchcode.utils import MatchcodeTestCase
+from minecode.utils import get_temp_dir
+from packagedb.models import Package
+
+
+class Sha1SnapshotTestCase(MatchcodeTestCase):
+
+    def setUp(self):
+        super(Sha1SnapshotTestCase, self).setUp()
+        self.snapshot_dir = get_temp_dir(prefix='snapshot')
+        self.location = get_snapshot_location(ExactPackageArchiveIndex, directory=self.snapshot_dir)
+        self.sha1s = [
+            'ffd28a27d919ce8690a40f4f335b9d591ceb16e9',
+            '51d28a27d919ce8690a40f4f335b9d591ceb1600',
+            'ae9d68fd6a29906606c2d9407d1cc0749ef84588',
+        ]
+        self.packages = []
+        for i, sha1 in enumerate(self.sha1s):
+            package = Package.objects.create(
+                name='test',
+                version=str(i),
+                type='maven',
+                sha1=sha1,
+                download_url=f'https://test.com/test-{i}.jar',
+            )
+            ExactPackageArchiveIndex.index(sha1, package)
+            self.packages.append(package)
+
+        # A SHA1 found in two packages
+        ExactPackageArchiveIndex.index(self.sha1s[0], self.packages[1])
+
+    def test_build_snapshot_and_contains(self):
+        snapshot = build_snapshot(ExactPackageArchiveIndex, self.location)
+        # A SHA1 found in two packages is stored once
+        self.assertEqual(3, len(snapshot))
+        self.assertEqual(ExactPackageArchiveIndex.objects.latest('pk').pk, snapshot.max_index_id)
+        self.assertEqual(sorted(snapshot.sha1s.tolist()), snapshot.sha1s.tolist())
+
+        self.assertIn(self.sha1s[1], snapshot)
+        self.assertNotIn('0000000000000000000000000000000000000000', snapshot)
+        self.assertNotIn('ffffffffffffffffffffffffffffffffffffffff', snapshot)
+        # Trailing null bytes are part of the SHA1
+        self.assertNotIn('51d28a27d919ce8690a40f4f335b9d591ceb1600'[:-2] + '01', snapshot)
+
+        results = snapshot.contains_many(self.sha1s + ['00' * 20, None])
+        self.assertEqual(set(self.sha1s), results)
+
+    def test_build_snapshot_incremental(self):
+        build_snapshot(ExactPackageArchiveIndex, self.location)
+        package = Package.objects.create(
+            name='test',
+            version='new',
+            type='maven',
+            download_url='https://test.com/test-new.jar',
+        )
+        new_sha1s = [
+            '0000000000000000000000000000000000000001',
+            '8000000000000000000000000000000000000000',
+            'ffd28a27d919ce8690a40f4f335b9d591ceb16ea',
+        ]
+        for sha1 in new_sha1s:
+            ExactPackageArchiveIndex.index(sha1, package)
+        ExactPackageArchiveIndex.index(self.sha1s[2], package)
+
+        # Use tiny chunks to merge across chunk boundaries
+        snapshot = build_snapshot(
+            ExactPackageArchiveIndex, self.location, incremental=True, chunk_size=2)
+        full_location = os.path.join(self.snapshot_dir, 'full')
+        full_snapshot = build_snapshot(ExactPackageArchiveIndex, full_location)
+        self.assertEqual(6, len(snapshot))
+        self.assertEqual(full_snapshot.sha1s.tolist(), snapshot.sha1s.tolist())
+        self.assertEqual(full_snapshot.max_index_id, snapshot.max_index_id)
+        self.assertEqual(set(self.sha1s + new_sha1s), snapshot.contains_many(self.sha1s + new_sha1s))
+
+    def test_merge_sha1s(self):
+        previous = numpy.array([b'\x01', b'\x03', b'\x05', b'\x07'], dtype=SHA1_DTYPE)
+        new_chunks = [
+            numpy.array([b'\x00', b'\x03', b'\x04'], dtype=SHA1_DTYPE),
+            numpy.array([b'\x08', b'\x09'], dtype=SHA1_DTYPE),
+        ]
+        written = []
+        merge_sha1s(previous, new_chunks, written.append, chunk_size=2)
+        self.assertTrue(all(len(chunk) <= 4 for chunk in written))
+        self.assertEqual(
+            [b'', b'\x01', b'\x03', b'\x04', b'\x05', b'\x07', b'\x08', b'\x09'],
+            numpy.concatenate(written).tolist(),
+        )
+
+    def test_build_empty_snapshot(self):
+        ExactPackageArchiveIndex.objects.all().delete()
+        snapshot = build_snapshot(ExactPackageArchiveIndex, self.location)
+        self.assertEqual(0, len(snapshot))
+        self.assertEqual(set(), Sha1Snapshot.load(self.location).contains_many(self.sha1s))
+
+    def test_match_many_uses_snapshot(self):
+        build_snapshot(ExactPackageArchiveIndex, self.location)
+        missing_sha1 = '0000000000000000000000000000000000000001'
+        with override_settings(MATCHCODE_SNAPSHOT_DIR=self.snapshot_dir):
+            self.assertTrue(get_snapshot(ExactPackageArchiveIndex))
+            # SHA1s that are not in the snapshot are not looked up in the
+            # database, only the existence of newly indexed rows is checked
+            with self.assertNumQueries(1):
+                results = ExactPackageArchiveIndex.match_many([missing_sha1], chunk_size=1)
+            self.assertEqual({}, results)
+
+            # Rows indexed after the snapshot was built are still matched
+            package = Package.objects.create(
+                name='test',
+                version='new',
+                type='maven',
+                download_url='https://test.com/test-new.jar',
+            )
+            ExactPackageArchiveIndex.index(missing_sha1, package)
+            results = ExactPackageArchiveIndex.match_many([missing_sha1, self.sha1s[1]])
+            self.assertEqual([package], [m.package for m in results[missing_sha1]])
+            self.assertEqual([self.packages[1]], [m.package for m in results[self.sha1s[1]]])
@@ -0,0 +1,113 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import logging
+import os
+import sys
+import time
+
+from django.core.management.base import CommandError
+
+from minecode.management.commands import VerboseCommand
+from packagedb.export import COMPRESSIONS
+from packagedb.export import EXPORT_CHUNK_SIZE
+from packagedb.export import EXPORT_SHARD_SIZE
+from packagedb.export import EXPORTS
+from packagedb.export import export
+
+
+TRACE = False
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout)
+logger.setLevel(logging.INFO)
+
+
+class Command(VerboseCommand):
+    help = (
+        'Export the Packages or the Resources of the PackageDB as newline-'
+        'delimited JSON files, sharded by package type and number of rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'kind',
+            choices=sorted(EXPORTS),
+            help='Export the Packages or the Resources.',
+        )
+        parser.add_argument(
+            'output_dir',
+            type=str,
+            help='Directory where the exported files are written.',
+        )
+        parser.add_argument(
+            '--type',
+            dest='package_types',
+            nargs='+',
+            help='Export only the Packages of these package types. '
+                 'Export the Packages of all types by default.',
+        )
+        parser.add_argument(
+            '--fields',
+            nargs='+',
+            help='Names of the exported columns. Export all the columns by default.',
+        )
+        parser.add_argument(
+            '--shard-size',
+            type=int,
+            default=EXPORT_SHARD_SIZE,
+            help='Maximum number of rows in each exported file.',
+        )
+        parser.add_argument(
+            '--compression',
+            choices=[compression for compression in COMPRESSIONS if compression],
+            help='Compress the exported files.',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Number of parallel processes, each exporting one package type at a time.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Number of rows fetched from the database at a time.',
+        )
+
+    def handle(self, *args, **options):
+        logger.setLevel(self.get_verbosity(**options))
+
+        output_dir = options['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+
+        start = time.time()
+        try:
+            results = export(
+                kind=options['kind'],
+                output_dir=output_dir,
+                package_types=options['package_types'],
+                columns=options['fields'],
+                shard_size=options['shard_size'],
+                compression=options['compression'],
+                processes=options['processes'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        total = 0
+        for package_type, count, locations in results:
+            total += count
+            logger.info(f'{package_type}: {count} rows in {len(locations)} files')
+
+        duration = time.time() - start
+        rows_per_second = int(total / duration) if duration else total
+        logger.info(f'Exported {total} rows in {duration:.1f} seconds ({rows_per_second} rows/sec)')
@@ -7,29 +7,25 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
-import json
 import sys
 
-from packagedb.models import Package
+from packagedb.export import EXPORTS
+from packagedb.export import get_export_queryset
+from packagedb.export import iter_ndjson
+from packagedb.export import write_ndjson_shards
 
 
 def dump_purls(package_type, output):
     """
-    Dump packagedb purls for ``package_type`` as JSON lines in the ``output`` files
+    Dump packagedb purls for ``package_type`` as JSON lines in the ``output``
+    files, with one file per million purls.
+    Return the list of written files.
     """
-    compact_separators = (u',', u':',)
-    out = None
-    for i, package in enumerate(Package.objects.filter(type=package_type).all()):
-        if not output:
-            out = open(f"{output}-{i}.json", "w")
-        purl = dict(purl=package.package_url, download_url=package.download_url)
-        if not i % 500:
-            print(f"#{i} purl: {package.package_url}")
-        out.write(json.dumps(purl, separators=compact_separators))
-        out.write('\n')
-        if not i % 1000000:
-            out.close()
-            out = None
+    queryset = get_export_queryset('packages', package_type)
+    rows = EXPORTS['packages'].iter_rows(queryset, columns=['purl', 'download_url'])
+    count, locations = write_ndjson_shards(iter_ndjson(rows), location_prefix=output)
+    print(f"Dumped {count} purls in {len(locations)} files")
+    return locations
 
 
 if __name__ == "__main__":
@@ -37,4 +33,3 @@ if __name__ == "__main__":
     package_type = args[0]
     output = args[1]
     dump_purls(package_type=package_type, output=output)
-
@@ -7,12 +7,14 @@ import signal
 import sys
 
 from django.db import transaction
+from django.utils import timezone
 
 from packagedcode.utils import combine_expressions
 
 from matchcode.models import ApproximateDirectoryContentIndex
 from matchcode.models import ApproximateDirectoryStructureIndex
 from matchcode.models import ExactFileIndex
+from matchcode.models import IndexGeneration
 from minecode.management import scanning
 from minecode.management.commands import get_error_message
 from minecode.models import ScannableURI
@@ -70,7 +72,12 @@ class Command(scanning.ScanningCommand):
                 api_auth_headers=cls.api_auth_headers,
                 get_scan_data_save_loc=get_scan_data_save_loc
             )
-            scan_index_errors = index_package_files(package, scan_data)
+            # Bump the index generations once for all the indexed Resources
+            with IndexGeneration.bump_once():
+                scan_index_errors = index_package_files(package, scan_data)
+            # The Package Resources have changed and must be indexed again
+            package.last_modified_date = timezone.now()
+            package_updated = True
 
             summary = scanning.get_scan_summary(
                 scannable_uri.scan_uuid,
@@ -0,0 +1,33 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import logging
+import sys
+
+from minecode.management.commands import VerboseCommand
+from packagedb.models import Package
+
+
+TRACE = False
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout)
+logger.setLevel(logging.INFO)
+
+
+class Command(VerboseCommand):
+    help = (
+        'Rank the versions of the Packages that have some versions without a '
+        'rank and update their latest version.'
+    )
+
+    def handle(self, *args, **options):
+        logger.setLevel(self.get_verbosity(**options))
+        count = Package.objects.rank_unranked_versions()
+        logger.info(f'Ranked the versions of {count} packages')
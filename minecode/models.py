@@ -784,6 +784,33 @@ class PriorityResourceURIManager(models.Manager):
             )
             return priority_resource_uri
 
+    def insert_many(self, uris, batch_size=1000):
+        """
+        Create new PriorityResourceURIs for each URI of the `uris` list, with
+        the same rules as `insert`, and return the list of created
+        PriorityResourceURIs.
+        A URI is skipped when it already has a request that has not been
+        processed yet.
+        """
+        uris = list(dict.fromkeys(uris))
+        pending_uris = set(
+            self.filter(
+                uri__in=uris,
+                package_url__in=uris,
+                processed_date__isnull=True,
+            ).values_list('uri', flat=True)
+        )
+
+        priority_resource_uris = []
+        for uri in uris:
+            if uri in pending_uris:
+                continue
+            priority_resource_uri = self.model(uri=uri, package_url=uri)
+            priority_resource_uri.normalize_fields()
+            priority_resource_uris.append(priority_resource_uri)
+
+        return self.bulk_create(priority_resource_uris, batch_size=batch_size)
+
     def in_progress(self):
         """
         Limit the QuerySet to PriorityResourceURI being processed.
@@ -13,6 +13,9 @@ import os
 from mock import Mock
 from mock import patch
 
+from django.utils import timezone
+
+from matchcode.management.commands.index_packages import index_modified_packages
 from matchcode.models import ExactFileIndex
 from minecode.management.commands.process_scans import Command
 from minecode.management.commands.process_scans import get_scan_status
@@ -67,9 +70,11 @@ class ProcessScansTest(MiningTestCase, JsonBasedTesting):
         expected_resources_loc = self.get_test_loc('scancodeio/get_scan_data_expected_resources.json')
         self.check_expected_results(results, expected_resources_loc, regen=False)
 
-    @patch('requests.get')
-    def test_ProcessScansTest_process_scan(self, mock_get):
-        # Set up mock responses
+    def set_up_scan_responses(self, mock_get):
+        """
+        Set up the `mock_get` mock of `requests.get` to return the scan info,
+        data and summary of a completed scan.
+        """
         mock_scan_info_response = Mock()
         scan_info_loc = self.get_test_loc('scancodeio/get_scan_info.json')
         with open(scan_info_loc, 'rb') as f:
@@ -87,6 +92,11 @@ class ProcessScansTest(MiningTestCase, JsonBasedTesting):
 
         mock_get.side_effect = [mock_scan_info_response, mock_scan_data_response, mock_scan_summary_response]
 
+    @patch('requests.get')
+    def test_ProcessScansTest_process_scan(self, mock_get):
+        # Set up mock responses
+        self.set_up_scan_responses(mock_get)
+
         # Set up ScannableURI
         scan_uuid = '54dc4afe-70ea-4f1c-9ed3-989efd9a991f'
         scannable_uri = ScannableURI.objects.create(
@@ -108,3 +118,27 @@ class ProcessScansTest(MiningTestCase, JsonBasedTesting):
         result = ExactFileIndex.objects.filter(package=self.package1)
         self.assertEqual(45, result.count())
 
+    @patch('requests.get')
+    def test_ProcessScansTest_process_scan_package_is_indexed_again(self, mock_get):
+        self.set_up_scan_responses(mock_get)
+        self.package1.last_indexed_date = timezone.now()
+        self.package1.save()
+        self.assertFalse(Package.objects.needs_indexing().exists())
+
+        scannable_uri = ScannableURI.objects.create(
+            uri='https://repo1.maven.org/maven2/maven/wagon-api/20040705.181715/wagon-api-20040705.181715.jar',
+            scan_uuid='54dc4afe-70ea-4f1c-9ed3-989efd9a991f',
+            scan_status=ScannableURI.SCAN_COMPLETED,
+            package=self.package1
+        )
+        Command.process_scan(scannable_uri)
+
+        # The Package with new scanned Resources is selected for incremental indexing
+        self.assertEqual([self.package1], list(Package.objects.needs_indexing()))
+
+        packages_count, _ = index_modified_packages()
+        self.assertEqual(1, packages_count)
+        self.assertFalse(Package.objects.needs_indexing().exists())
+        self.package1.refresh_from_db()
+        self.assertTrue(self.package1.indexed_resources_digest)
+        self.assertEqual(45, ExactFileIndex.objects.filter(package=self.package1).count())
@@ -7,8 +7,10 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import FilterSet
 from django_filters.filters import Filter
 from django_filters.filters import OrderingFilter
@@ -29,9 +31,16 @@ from minecode import visitors  # NOQA
 from minecode import priority_router
 from minecode.models import PriorityResourceURI
 from minecode.route import NoRouteAvailable
+from packagedb.cache import get_enhanced_package_cache
+from packagedb.cache import get_package_set_cache_key
+from packagedb.export import EXPORTS
+from packagedb.export import iter_gzip
+from packagedb.export import iter_ndjson
 from packagedb.models import Package
 from packagedb.models import Resource
 from packagedb.serializers import DependentPackageSerializer
+from packagedb.serializers import MAX_BULK_LOOKUP_PACKAGES
+from packagedb.serializers import PackageBulkLookupSerializer
 from packagedb.serializers import ResourceAPISerializer
 from packagedb.serializers import PackageAPISerializer
 from packagedb.serializers import PartySerializer
@@ -77,11 +86,53 @@ class ResourceFilter(FilterSet):
     )
 
 
-class ResourceViewSet(viewsets.ReadOnlyModelViewSet):
+class ExportMixin:
+    """
+    Add an `export` action that streams all the filtered objects of a
+    ViewSet as newline-delimited JSON.
+    """
+    # Name of the packagedb.export export of the ViewSet objects
+    export_kind = None
+
+    @action(detail=False)
+    def export(self, request, *args, **kwargs):
+        """
+        Stream all the objects matching the filters as newline-delimited JSON,
+        with one JSON object per line. The exported columns can be selected
+        with a comma-separated list of `fields` and the output can be gzip
+        compressed with `compression=gzip`.
+        """
+        export = EXPORTS[self.export_kind]
+        fields = request.query_params.get('fields')
+        columns = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+        try:
+            columns = export.validate_columns(columns)
+        except ValueError as e:
+            return Response({'status': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        compression = request.query_params.get('compression')
+        if compression not in (None, 'gzip'):
+            message = {'status': f'Unsupported compression: {compression}'}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lines = iter_ndjson(export.iter_rows(queryset, columns=columns))
+        if compression == 'gzip':
+            response = StreamingHttpResponse(iter_gzip(lines), content_type='application/gzip')
+            filename = f'{self.export_kind}.ndjson.gz'
+        else:
+            response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+            filename = f'{self.export_kind}.ndjson'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ResourceViewSet(ExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Resource.objects.prefetch_related('package')
     serializer_class = ResourceAPISerializer
     filterset_class = ResourceFilter
     lookup_field = 'sha1'
+    export_kind = 'resources'
 
 
 class MultiplePackageURLFilter(Filter):
@@ -181,11 +232,12 @@ class PackageFilter(FilterSet):
         )
 
 
-class PackageViewSet(viewsets.ReadOnlyModelViewSet):
+class PackageViewSet(ExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Package.objects.all()
     serializer_class = PackageAPISerializer
     lookup_field = 'uuid'
     filterset_class = PackageFilter
+    export_kind = 'packages'
 
     @action(detail=True, methods=['get'])
     def latest_version(self, request, *args, **kwargs):
@@ -207,6 +259,8 @@ class PackageViewSet(viewsets.ReadOnlyModelViewSet):
     def resources(self, request, *args, **kwargs):
         """
         Return the Resources associated with the current Package.
+        With cursor pagination, the Resources are returned with the link to
+        the next and previous pages.
         """
         package = self.get_object()
 
@@ -214,6 +268,8 @@ class PackageViewSet(viewsets.ReadOnlyModelViewSet):
         paginated_qs = self.paginate_queryset(qs)
 
         serializer = ResourceAPISerializer(paginated_qs, many=True, context={'request': request})
+        if getattr(self.paginator, 'is_cursor_paginated', False):
+            return self.get_paginated_response(serializer.data)
         return Response(serializer.data)
 
     @action(detail=False)
@@ -282,6 +338,76 @@ class PackageViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = PackageAPISerializer(packages, many=True, context={'request': request})
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def bulk_lookup(self, request, *args, **kwargs):
+        """
+        Return the Packages of each purl of a JSON list of `purls`, keyed by
+        input purl, where each result has a `status` of "found", "not_found"
+        or "invalid" and the list of matched `packages`.
+
+        At most MAX_BULK_LOOKUP_PACKAGES Packages are returned for each purl,
+        with the smallest ids first: a result is `truncated` when a purl, such
+        as a purl without a version, matches more Packages.
+
+        When `enqueue_missing` is true, the collection of the Package data of
+        the valid purls that are not found is requested.
+        """
+        serializer = PackageBulkLookupSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        purls = serializer.validated_data['purls']
+        enqueue_missing = serializer.validated_data['enqueue_missing']
+
+        packages = Package.objects.prefetch_related('dependencies', 'parties')
+        # Fetch one more Package per purl to detect truncated results
+        packages_by_purl = packages.lookup_purls(purls, limit=MAX_BULK_LOOKUP_PACKAGES + 1)
+        truncated_purls = set()
+        for purl, matches in packages_by_purl.items():
+            if matches and len(matches) > MAX_BULK_LOOKUP_PACKAGES:
+                del matches[MAX_BULK_LOOKUP_PACKAGES:]
+                truncated_purls.add(purl)
+
+        matched_packages = {
+            package.id: package
+            for matches in packages_by_purl.values() if matches
+            for package in matches
+        }
+        package_serializer = PackageAPISerializer(
+            list(matched_packages.values()),
+            many=True,
+            context={'request': request},
+        )
+        package_data_by_id = dict(zip(matched_packages, package_serializer.data))
+
+        results = {}
+        missing_purls = []
+        for purl, matches in packages_by_purl.items():
+            if matches is None:
+                lookup_status = 'invalid'
+            elif matches:
+                lookup_status = 'found'
+            else:
+                lookup_status = 'not_found'
+                missing_purls.append(purl)
+            results[purl] = {
+                'status': lookup_status,
+                'packages': [package_data_by_id[package.id] for package in matches or []],
+                'truncated': purl in truncated_purls,
+            }
+
+        enqueued = []
+        if enqueue_missing and missing_purls:
+            enqueued = PriorityResourceURI.objects.insert_many(missing_purls)
+
+        summary = {
+            'found': sum(1 for r in results.values() if r['status'] == 'found'),
+            'not_found': len(missing_purls),
+            'invalid': sum(1 for r in results.values() if r['status'] == 'invalid'),
+            'enqueued': len(enqueued),
+        }
+        return Response({'results': results, 'summary': summary})
+
     @action(detail=True)
     def get_enhanced_package_data(self, request, *args, **kwargs):
         """
@@ -346,9 +472,40 @@ def get_enhanced_package(package):
     """
     Return package data from `package`, where the data has been enhanced by
     other packages in the same package_set.
+    The enhanced data of all the packages of the package_set are cached
+    together when a cache is configured.
+    """
+    package_set = package.package_set
+    if not package_set:
+        return _get_enhanced_package(package, [package])
+
+    cache = get_enhanced_package_cache()
+    if cache is None:
+        return _get_enhanced_package(package, get_package_set_packages(package_set))
+
+    key = get_package_set_cache_key(package_set)
+    enhanced_packages = cache.get(key)
+    if enhanced_packages is None:
+        enhanced_packages = get_enhanced_package_set(package_set)
+        cache.set(key, enhanced_packages, settings.PACKAGEDB_ENHANCED_PACKAGE_CACHE_TIMEOUT)
+
+    package_data = enhanced_packages.get(str(package.uuid))
+    if package_data is None:
+        # The package was added to the package_set after it was cached
+        return _get_enhanced_package(package, get_package_set_packages(package_set))
+    return package_data
+
+
+def get_package_set_packages(package_set):
+    """
+    Return a list of the Packages of `package_set`, with their parties and
+    dependencies prefetched, sorted in the order used to enhance their data.
     """
     packages = Package.objects.filter(
-        package_set=package.package_set
+        package_set=package_set
+    ).prefetch_related(
+        'parties',
+        'dependencies',
     ).order_by(
         'type',
         'namespace',
@@ -358,7 +515,19 @@ def get_enhanced_package(package):
         'subpath',
         'package_content',
     )
-    return _get_enhanced_package(package, packages)
+    return list(packages)
+
+
+def get_enhanced_package_set(package_set):
+    """
+    Return a mapping of {Package uuid: enhanced package data} for all the
+    Packages of `package_set`.
+    """
+    packages = get_package_set_packages(package_set)
+    return {
+        str(package.uuid): _get_enhanced_package(package, packages)
+        for package in packages
+    }
 
 
 def _get_enhanced_package(package, packages):
@@ -371,7 +540,8 @@ def _get_enhanced_package(package, packages):
     for peer in packages:
         if peer == package:
             mixing = True
-            package_data = package.to_dict()
+            # Use the peer as its parties and dependencies may be prefetched
+            package_data = peer.to_dict()
             continue
         if not mixing:
             continue
@@ -390,8 +560,9 @@ def _get_enhanced_package(package, packages):
                 package_data[field] = peer_value
                 enhanced = True
         if enhanced:
-            extra_data = package_data.get('extra_data', {})
-            enhanced_by = extra_data.get('enhanced_by', [])
+            # Copy the extra_data to not modify the extra_data of the package
+            extra_data = dict(package_data.get('extra_data') or {})
+            enhanced_by = list(extra_data.get('enhanced_by', []))
             enhanced_by.append(peer.purl)
             extra_data['enhanced_by'] = enhanced_by
             package_data['extra_data'] = extra_data
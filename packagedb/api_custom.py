@@ -7,6 +7,7 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+from rest_framework.pagination import CursorPagination
 from rest_framework.pagination import PageNumberPagination
 
 
@@ -20,3 +21,62 @@ class PageSizePagination(PageNumberPagination):
     page_size = 10
     max_page_size = 100
     page_size_query_param = 'page_size'
+
+
+class PrimaryKeyCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the indexed primary key, such as the monotonic `id`
+    column, such that the response time stays the same however deep a client
+    pages: pages are selected with `WHERE id > <last id> LIMIT <page size>`
+    without a COUNT or an OFFSET.
+    A page_size parameter can be provided, limited to 100 results per page max.
+    """
+    ordering = 'pk'
+    page_size = 10
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+
+
+class PageSizeOrCursorPagination(PageSizePagination):
+    """
+    Page number pagination with a page_size parameter, as PageSizePagination,
+    with an opt-in keyset pagination as PrimaryKeyCursorPagination when the
+    `pagination=cursor` or `cursor` parameters are provided. Results are
+    always ordered by primary key in cursor mode.
+    For example:
+    http://api.example.org/packages/?pagination=cursor&page_size=100
+    and then follow the `next` links.
+    """
+    pagination_query_param = 'pagination'
+    cursor_paginator_class = PrimaryKeyCursorPagination
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.pagination_query_param) == 'cursor'
+            or self.cursor_paginator_class.cursor_query_param in request.query_params
+        )
+
+    @property
+    def is_cursor_paginated(self):
+        return self.cursor_paginator is not None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.use_cursor(request):
+            self.cursor_paginator = None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.cursor_paginator = self.cursor_paginator_class()
+        page = self.cursor_paginator.paginate_queryset(queryset, request, view)
+        self.display_page_controls = self.cursor_paginator.display_page_controls
+        return page
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
@@ -0,0 +1,55 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+"""
+A cache of the enhanced data of the Packages of a package set.
+
+The enhanced data of all the Packages of a package set are computed at once
+and cached as a mapping of {Package uuid: enhanced Package data} in the
+Django cache backend configured with PACKAGEDB_ENHANCED_PACKAGE_CACHE_BACKEND.
+
+A cached package set is invalidated when one of its Packages, or a Party or
+a DependentPackage of one of its Packages, is saved or deleted. Bulk creates
+and QuerySet updates do not send signals and are not invalidated: their
+cached package sets expire after PACKAGEDB_ENHANCED_PACKAGE_CACHE_TIMEOUT
+seconds.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def get_enhanced_package_cache():
+    """
+    Return the cache backend of the enhanced package data or None if enhanced
+    package data are not cached.
+    """
+    backend = settings.PACKAGEDB_ENHANCED_PACKAGE_CACHE_BACKEND
+    if backend:
+        return caches[backend]
+
+
+def get_package_set_cache_key(package_set):
+    return f'packagedb:enhanced-package-set:{package_set}'
+
+
+def invalidate_package_set(package_set):
+    """
+    Remove the cached enhanced package data of `package_set`.
+    """
+    cache = get_enhanced_package_cache()
+    if cache is None or not package_set:
+        return
+
+    key = get_package_set_cache_key(package_set)
+    cache.delete(key)
+    # Delete the entry again once committed, as a concurrent request may
+    # have cached the data that was visible before the commit
+    transaction.on_commit(lambda: cache.delete(key))
@@ -0,0 +1,318 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+"""
+Bulk export of Packages and Resources as newline-delimited JSON (NDJSON).
+
+Rows are read with a server-side cursor in a transaction as plain values of
+the selected columns rather than as model instances, such that a whole table
+can be exported with a constant memory use.
+"""
+
+from functools import partial
+from multiprocessing import pool
+import gzip
+import os
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db import transaction
+from django.db.models import F
+
+from packageurl import PackageURL
+
+from packagedb.models import Package
+from packagedb.models import Resource
+
+
+# Number of rows fetched from the server-side cursor at a time
+EXPORT_CHUNK_SIZE = 2000
+
+# Number of rows in each exported NDJSON file
+EXPORT_SHARD_SIZE = 1000000
+
+COMPRESSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+PURL_FIELDS = ('type', 'namespace', 'name', 'version', 'qualifiers', 'subpath')
+
+# Fields that cannot be exported
+EXCLUDED_FIELDS = ('id', 'search_vector', 'package')
+
+
+class Export:
+    """
+    The exportable columns of a model. Each column is either a field of the
+    model, the computed `purl` of a Package or a field of a related model
+    such as the `package_uuid` of a Resource.
+    """
+
+    def __init__(self, model, purl_prefix='', related_columns=None):
+        self.model = model
+        # Prefix of the lookups of the purl fields of this model
+        self.purl_prefix = purl_prefix
+        # Mapping of {column name: lookup of the related field}
+        self.related_columns = related_columns or {}
+
+    @property
+    def columns(self):
+        """
+        Return a list of the names of all the exportable columns.
+        """
+        field_names = [
+            field.name for field in self.model._meta.concrete_fields
+            if field.name not in EXCLUDED_FIELDS
+        ]
+        return ['purl'] + list(self.related_columns) + field_names
+
+    def validate_columns(self, columns):
+        """
+        Return the list of `columns` or all the exportable columns if no
+        columns are provided. Raise a ValueError for unknown columns.
+        """
+        available_columns = self.columns
+        if not columns:
+            return available_columns
+        unknown = [column for column in columns if column not in available_columns]
+        if unknown:
+            raise ValueError(
+                'Unknown {} columns: {}'.format(
+                    self.model._meta.verbose_name, ', '.join(unknown)
+                )
+            )
+        return list(columns)
+
+    @property
+    def model_fields(self):
+        return {field.name for field in self.model._meta.concrete_fields}
+
+    def iter_rows(self, queryset, columns=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Yield a mapping of {column: value} for each object of `queryset`, in
+        `id` order, for each of the selected `columns`.
+
+        The rows are read in a transaction opened on the first row and closed
+        after the last row, when this generator is consumed: outside of a
+        transaction PostgreSQL server-side cursors are WITH HOLD cursors that
+        are fully materialized on the server before the first row is read.
+        """
+        columns = self.validate_columns(columns)
+        with_purl = 'purl' in columns
+
+        values = [column for column in columns if column in self.model_fields]
+        expressions = {
+            column: F(lookup)
+            for column, lookup in self.related_columns.items()
+            if column in columns
+        }
+        if with_purl:
+            for field in PURL_FIELDS:
+                expressions[f'_purl_{field}'] = F(f'{self.purl_prefix}{field}')
+
+        queryset = (
+            queryset
+            .prefetch_related(None)
+            .order_by('id')
+            .values(*values, **expressions)
+        )
+        with transaction.atomic(using=queryset.db):
+            for row in queryset.iterator(chunk_size=chunk_size):
+                if with_purl:
+                    row['purl'] = get_purl(*(row.pop(f'_purl_{field}') for field in PURL_FIELDS))
+                yield {column: row[column] for column in columns}
+
+
+EXPORTS = {
+    'packages': Export(Package),
+    'resources': Export(
+        Resource,
+        purl_prefix='package__',
+        related_columns={'package_uuid': 'package__uuid'},
+    ),
+}
+
+
+def get_purl(type, namespace, name, version, qualifiers, subpath):
+    """
+    Return a purl string built from the purl fields or an empty string, as
+    for `Package.package_url`.
+    """
+    try:
+        return str(PackageURL(type, namespace, name, version, qualifiers, subpath))
+    except ValueError:
+        return ''
+
+
+def get_export_queryset(kind, package_type=None):
+    """
+    Return a QuerySet of the objects of the `kind` of export, limited to the
+    Packages of `package_type` if provided.
+    """
+    export = EXPORTS[kind]
+    queryset = export.model.objects.all()
+    if package_type is not None:
+        queryset = queryset.filter(**{f'{export.purl_prefix}type': package_type})
+    return queryset
+
+
+def iter_ndjson(rows):
+    """
+    Yield a line of compact JSON for each mapping of `rows`.
+    """
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def iter_gzip(lines):
+    """
+    Yield chunks of bytes of the gzip compressed text `lines`.
+    """
+    # A wbits of 31 writes a gzip header and trailer
+    compressor = zlib.compressobj(wbits=31)
+    for line in lines:
+        chunk = compressor.compress(line.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def open_export_file(location, compression=None):
+    """
+    Return a text file object opened for writing at `location`, compressed with
+    the `compression` algorithm if provided.
+    """
+    if compression == 'gzip':
+        return gzip.open(location, 'wt', encoding='utf-8')
+
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('The zstandard package is required for zstd compression.')
+        return zstandard.open(location, 'wt', encoding='utf-8')
+
+    if compression:
+        raise ValueError(f'Unknown compression: {compression}')
+    return open(location, 'w', encoding='utf-8')
+
+
+def write_ndjson_shards(lines, location_prefix, shard_size=EXPORT_SHARD_SIZE, compression=None):
+    """
+    Write the NDJSON `lines` in files of `shard_size` lines at most, named
+    after `location_prefix` and numbered from 0.
+
+    Return a tuple of (written lines count, list of file locations)
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression: {compression}')
+
+    extension = '.ndjson' + COMPRESSIONS[compression]
+    locations = []
+    output = None
+    count = 0
+    try:
+        for line in lines:
+            if not count % shard_size:
+                if output:
+                    output.close()
+                location = f'{location_prefix}-{len(locations):05d}{extension}'
+                locations.append(location)
+                output = open_export_file(location, compression)
+            output.write(line)
+            count += 1
+    finally:
+        if output:
+            output.close()
+    return count, locations
+
+
+def export_package_type(
+    package_type,
+    kind,
+    output_dir,
+    columns=None,
+    shard_size=EXPORT_SHARD_SIZE,
+    compression=None,
+    chunk_size=EXPORT_CHUNK_SIZE,
+):
+    """
+    Export the objects of the `kind` of export for the Packages of
+    `package_type` in NDJSON files of `output_dir`.
+
+    Return a tuple of (package type, exported rows count, list of file locations)
+    """
+    queryset = get_export_queryset(kind, package_type)
+    rows = EXPORTS[kind].iter_rows(queryset, columns=columns, chunk_size=chunk_size)
+
+    location_prefix = os.path.join(output_dir, f'{kind}-{package_type or "untyped"}')
+    count, locations = write_ndjson_shards(
+        iter_ndjson(rows),
+        location_prefix=location_prefix,
+        shard_size=shard_size,
+        compression=compression,
+    )
+    return package_type, count, locations
+
+
+def export(
+    kind,
+    output_dir,
+    package_types=None,
+    columns=None,
+    shard_size=EXPORT_SHARD_SIZE,
+    compression=None,
+    processes=1,
+    chunk_size=EXPORT_CHUNK_SIZE,
+):
+    """
+    Export the objects of the `kind` of export ("packages" or "resources") as
+    NDJSON files in `output_dir`, with one set of files per package type.
+    Export the `package_types` Packages or the Packages of all types if not
+    provided, using `processes` parallel worker processes.
+
+    Return a list of (package type, exported rows count, list of file
+    locations) tuples.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f'Unknown export: {kind}')
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression: {compression}')
+    # Fail early on unknown columns rather than in a worker
+    columns = EXPORTS[kind].validate_columns(columns)
+
+    if not package_types:
+        package_types = list(
+            Package.objects
+            .order_by('type')
+            .values_list('type', flat=True)
+            .distinct()
+        )
+
+    export_type = partial(
+        export_package_type,
+        kind=kind,
+        output_dir=output_dir,
+        columns=columns,
+        shard_size=shard_size,
+        compression=compression,
+        chunk_size=chunk_size,
+    )
+
+    if processes > 1:
+        # Each worker process must open its own database connection
+        connections.close_all()
+        with pool.Pool(processes=processes) as workers:
+            return list(workers.imap(export_type, package_types))
+
+    return [export_type(package_type) for package_type in package_types]
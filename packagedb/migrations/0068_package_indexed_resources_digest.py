@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-17 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packagedb', '0067_alter_resource_md5_alter_resource_sha1_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='indexed_resources_digest',
+            field=models.CharField(blank=True, help_text='MD5 digest of the path, SHA1 and size of the Resources of this Package at the last indexing. Used to detect Resource changes.', max_length=32, null=True),
+        ),
+    ]
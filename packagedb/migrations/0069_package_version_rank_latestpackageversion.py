@@ -0,0 +1,41 @@
+# Generated by Django 4.1.2 on 2026-10-17 02:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packagedb', '0068_package_indexed_resources_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestPackageVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(blank=True, max_length=16)),
+                ('namespace', models.CharField(blank=True, max_length=255)),
+                ('name', models.CharField(blank=True, max_length=100)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='package',
+            name='version_rank',
+            field=models.BigIntegerField(blank=True, help_text='Sparse rank of the version of this Package among all the versions of the Packages with the same type, namespace and name, sorted using the version scheme of the package type. Only the order of the ranks is meaningful.', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['type', 'namespace', 'name', 'version_rank'], name='packagedb_p_type_9db091_idx'),
+        ),
+        migrations.AddField(
+            model_name='latestpackageversion',
+            name='package',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='packagedb.package'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='latestpackageversion',
+            unique_together={('type', 'namespace', 'name')},
+        ),
+    ]
@@ -15,13 +15,24 @@ import natsort
 from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
+from django.db import connections
 from django.db import models
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from packageurl import PackageURL
 from packageurl.contrib.django.models import PackageURLMixin
 from packageurl.contrib.django.models import PackageURLQuerySetMixin
+from packageurl.contrib.django.utils import purl_to_lookups
+
+from packagedb.cache import get_enhanced_package_cache
+from packagedb.cache import invalidate_package_set
+
+from univers.version_range import RANGE_CLASS_BY_SCHEMES
 
 TRACE = False
 
@@ -30,11 +41,71 @@ logging.basicConfig(stream=sys.stdout)
 logger.setLevel(logging.INFO)
 
 
-def sort_version(packages):
+# Fields of a Package that determine its version rank
+VERSION_FIELDS = ('type', 'namespace', 'name', 'version')
+
+# Gap between the ranks of consecutive versions, such that a new version is
+# ranked between the previous and next versions without changing their ranks
+VERSION_RANK_GAP = 2 ** 20
+
+natural_version_key = natsort.natsort_keygen(key=lambda version: version.replace('.', '~') + 'z')
+
+
+def get_version_sort_key(package_type):
+    """
+    Return a sort key function for the version strings of Packages of
+    `package_type`. Versions are compared with the univers version scheme of
+    the package type if any. Versions that are not valid in this scheme are
+    sorted naturally before the valid versions.
+    """
+    range_class = RANGE_CLASS_BY_SCHEMES.get(package_type)
+    version_class = range_class and range_class.version_class
+
+    def version_sort_key(version):
+        if version_class:
+            try:
+                return 1, version_class(version)
+            # univers raises various exceptions for invalid versions
+            except Exception:
+                pass
+        return 0, natural_version_key(version)
+
+    return version_sort_key
+
+
+def get_new_version_rank(version, ranked_versions, version_sort_key):
     """
-    Return the packages sorted by version.
+    Return a rank for `version` between the ranks of its previous and next
+    versions in the `ranked_versions` list of (version, rank) tuples sorted by
+    rank, or None if there is no free rank left between them.
+    The position of `version` is found with a binary search, such that only
+    the sort keys of a few versions are computed.
     """
-    return natsort.natsorted(packages, key=lambda p: p.version.replace('.', '~')+'z')
+    for ranked_version, rank in ranked_versions:
+        if ranked_version == version:
+            return rank
+
+    key = version_sort_key(version)
+    low = 0
+    high = len(ranked_versions)
+    while low < high:
+        middle = (low + high) // 2
+        if key < version_sort_key(ranked_versions[middle][0]):
+            high = middle
+        else:
+            low = middle + 1
+
+    previous_rank = ranked_versions[low - 1][1] if low else None
+    next_rank = ranked_versions[low][1] if low < len(ranked_versions) else None
+    if previous_rank is None and next_rank is None:
+        return 0
+    if previous_rank is None:
+        return next_rank - VERSION_RANK_GAP
+    if next_rank is None:
+        return previous_rank + VERSION_RANK_GAP
+    if next_rank - previous_rank < 2:
+        return
+    return (previous_rank + next_rank) // 2
 
 
 class PackageQuerySet(PackageURLQuerySetMixin, models.QuerySet):
@@ -47,6 +118,255 @@ class PackageQuerySet(PackageURLQuerySetMixin, models.QuerySet):
         if created:
             return package
 
+    def needs_indexing(self):
+        """
+        Return a QuerySet of Packages that have never been indexed or that have
+        been modified since they were last indexed.
+        """
+        return self.filter(
+            models.Q(last_indexed_date__isnull=True)
+            | models.Q(last_modified_date__gt=models.F('last_indexed_date'))
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create the `objs` Packages in bulk and rank their versions, such that
+        the versions of bulk-created Packages are ranked at write time as for
+        the Packages saved one at a time.
+        """
+        objs = super().bulk_create(objs, *args, **kwargs)
+        names = sorted(set(package.get_version_fields()[:3] for package in objs))
+        for type, namespace, name in names:
+            self.update_version_ranks(type, namespace, name)
+
+        ranks_by_id = dict(
+            self.filter(id__in=[package.id for package in objs if package.id])
+            .values_list('id', 'version_rank')
+        )
+        for package in objs:
+            if package.id in ranks_by_id:
+                package.version_rank = ranks_by_id[package.id]
+                package._loaded_version_fields = package.get_version_fields()
+        return objs
+
+    def rank_unranked_versions(self):
+        """
+        Rank all the versions of the Packages that have some versions without
+        a rank, such as Packages created before the versions were ranked.
+
+        Return the number of ranked type, namespace and name.
+        """
+        names = (
+            self.filter(version_rank__isnull=True)
+            .order_by('type', 'namespace', 'name')
+            .values_list('type', 'namespace', 'name')
+            .distinct()
+        )
+        count = 0
+        for type, namespace, name in names.iterator():
+            self.update_version_ranks(type, namespace, name)
+            count += 1
+        return count
+
+    def lock_versions(self, type, namespace, name):
+        """
+        Lock the versions of the Packages with `type`, `namespace` and `name`
+        until the end of the current transaction, such that their version
+        ranks are updated by one transaction at a time.
+        A transaction-level advisory lock is used, as there may be no Package
+        rows to lock yet.
+        """
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(hashtext(%s))',
+                [f'packagedb.package.versions:{type}/{namespace}/{name}'],
+            )
+
+    def update_version_ranks(self, type, namespace, name):
+        """
+        Set the `version_rank` of all the versions of the Packages with `type`,
+        `namespace` and `name`, spaced by VERSION_RANK_GAP, and update their
+        LatestPackageVersion. Only the Packages with a changed rank are
+        updated.
+
+        Return the latest version Package id or None if there are no Packages.
+        """
+        with transaction.atomic(using=self.db):
+            self.lock_versions(type, namespace, name)
+            versions = list(
+                self.filter(type=type, namespace=namespace, name=name)
+                .values_list('id', 'version', 'version_rank')
+            )
+
+            version_sort_key = get_version_sort_key(type)
+            sorted_versions = sorted({version for _, version, _ in versions}, key=version_sort_key)
+            rank_by_version = {
+                version: rank * VERSION_RANK_GAP
+                for rank, version in enumerate(sorted_versions)
+            }
+
+            changed = []
+            for package_id, version, version_rank in versions:
+                rank = rank_by_version[version]
+                if rank != version_rank:
+                    changed.append(self.model(id=package_id, version_rank=rank))
+            if changed:
+                self.bulk_update(changed, fields=['version_rank'])
+
+            return self.update_latest_version(type, namespace, name)
+
+    def rank_version(self, package):
+        """
+        Set the `version_rank` of `package` between the ranks of its previous
+        and next versions, without changing the ranks of the other versions,
+        and update the LatestPackageVersion of its versions.
+        All the versions are ranked again if some versions have no rank or if
+        there is no free rank left.
+        """
+        type, namespace, name = package.type, package.namespace, package.name
+        with transaction.atomic(using=self.db):
+            self.lock_versions(type, namespace, name)
+            other_versions = self.filter(
+                type=type,
+                namespace=namespace,
+                name=name,
+            ).exclude(id=package.id)
+
+            rank = None
+            if not other_versions.filter(version_rank__isnull=True).exists():
+                ranked_versions = list(
+                    other_versions
+                    .order_by('version_rank', 'id')
+                    .values_list('version', 'version_rank')
+                )
+                version_sort_key = get_version_sort_key(type)
+                rank = get_new_version_rank(package.version, ranked_versions, version_sort_key)
+
+            if rank is None:
+                self.update_version_ranks(type, namespace, name)
+                rank = self.filter(id=package.id).values_list('version_rank', flat=True).get()
+            else:
+                self.filter(id=package.id).update(version_rank=rank)
+                self.update_latest_version(type, namespace, name)
+
+        package.version_rank = rank
+
+    def update_latest_version(self, type, namespace, name):
+        """
+        Point the LatestPackageVersion of the Packages with `type`, `namespace`
+        and `name` to the ranked Package with the latest version. The latest
+        of several Packages with the same version is the last one created.
+
+        Return the latest version Package id or None if there are no Packages.
+        """
+        with transaction.atomic(using=self.db):
+            self.lock_versions(type, namespace, name)
+            latest_id = (
+                self.filter(
+                    type=type,
+                    namespace=namespace,
+                    name=name,
+                    version_rank__isnull=False,
+                )
+                .order_by('-version_rank', '-id')
+                .values_list('id', flat=True)
+                .first()
+            )
+            latest_versions = LatestPackageVersion.objects.filter(
+                type=type,
+                namespace=namespace,
+                name=name,
+            )
+            if not latest_id:
+                latest_versions.delete()
+            elif not latest_versions.filter(package_id=latest_id).exists():
+                LatestPackageVersion.objects.update_or_create(
+                    type=type,
+                    namespace=namespace,
+                    name=name,
+                    defaults={'package_id': latest_id},
+                )
+            return latest_id
+
+    def lookup_purls(self, purls, limit=None):
+        """
+        Return a mapping of {purl: [Package, ...]} for each purl string of the
+        `purls` list, where the list of Packages is empty for a purl that does
+        not match any Package, or None for an invalid purl.
+
+        As with `purl_to_lookups`, the empty fields of a purl are ignored: a
+        purl without a version matches all the versions of a Package. If a
+        `limit` is provided, each purl matches at most the `limit` Packages
+        with the smallest ids. All the purls are matched at once by joining
+        the Packages with the unnested arrays of the purl fields, rather than
+        with one query per purl.
+        """
+        purl_fields = ['type', 'namespace', 'name', 'version', 'qualifiers', 'subpath']
+        lookup_indexes = []
+        lookup_columns = {field: [] for field in purl_fields}
+        matches_by_purl = {}
+        for purl in purls:
+            if purl in matches_by_purl:
+                continue
+            lookups = purl_to_lookups(purl)
+            if not lookups:
+                matches_by_purl[purl] = None
+                continue
+            matches_by_purl[purl] = []
+            lookup_indexes.append(len(lookup_indexes))
+            for field in purl_fields:
+                lookup_columns[field].append(lookups.get(field))
+
+        if not lookup_indexes:
+            return matches_by_purl
+
+        package_table = self.model._meta.db_table
+        query = f"""
+            SELECT lookup.idx, package.id,
+                   row_number() OVER (PARTITION BY lookup.idx ORDER BY package.id) AS rank
+            FROM unnest(
+                %s::integer[], %s::text[], %s::text[], %s::text[],
+                %s::text[], %s::text[], %s::text[]
+            ) AS lookup (idx, type, namespace, name, version, qualifiers, subpath)
+            JOIN {package_table} AS package
+              ON package.type = lookup.type
+             AND package.name = lookup.name
+             AND (lookup.namespace IS NULL OR package.namespace = lookup.namespace)
+             AND (lookup.version IS NULL OR package.version = lookup.version)
+             AND (lookup.qualifiers IS NULL OR package.qualifiers = lookup.qualifiers)
+             AND (lookup.subpath IS NULL OR package.subpath = lookup.subpath)
+        """
+        params = [lookup_indexes] + [lookup_columns[field] for field in purl_fields]
+        if limit is not None:
+            query = f'SELECT idx, id, rank FROM ({query}) AS match WHERE rank <= %s'
+            params.append(limit)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(query, params)
+            package_ids_by_index = {}
+            for index, package_id, _ in cursor.fetchall():
+                package_ids_by_index.setdefault(index, []).append(package_id)
+
+        package_ids = {
+            package_id
+            for package_ids in package_ids_by_index.values()
+            for package_id in package_ids
+        }
+        packages_by_id = {
+            package.id: package
+            for package in self.filter(id__in=package_ids)
+        }
+
+        valid_purls = [purl for purl, matches in matches_by_purl.items() if matches is not None]
+        for index, purl in enumerate(valid_purls):
+            matches = matches_by_purl[purl]
+            for package_id in package_ids_by_index.get(index, []):
+                package = packages_by_id.get(package_id)
+                if package:
+                    matches.append(package)
+            matches.sort(key=lambda package: package.id)
+
+        return matches_by_purl
+
 
 VCS_CHOICES = [
     ('git', 'git'),
@@ -491,6 +811,13 @@ class Package(
         blank=True,
         help_text='Indexing errors messages. When present this means the indexing has failed.',
     )
+    indexed_resources_digest = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+        help_text='MD5 digest of the path, SHA1 and size of the Resources of this '
+                  'Package at the last indexing. Used to detect Resource changes.',
+    )
     package_set = models.UUIDField(
         null=True,
         blank=True,
@@ -516,6 +843,17 @@ class Package(
 
     search_vector = SearchVectorField(null=True)
 
+    version_rank = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text=_(
+            'Sparse rank of the version of this Package among all the versions '
+            'of the Packages with the same type, namespace and name, sorted '
+            'using the version scheme of the package type. Only the order of '
+            'the ranks is meaningful.'
+        ),
+    )
+
     objects = PackageQuerySet.as_manager()
 
     # TODO: Think about ordering, unique together, indexes, etc.
@@ -553,11 +891,58 @@ class Package(
             models.Index(fields=['sha1']),
             models.Index(fields=['sha256']),
             models.Index(fields=['sha512']),
+            # index to sort all the versions of a package
+            models.Index(fields=['type', 'namespace', 'name', 'version_rank']),
         ]
 
     def __str__(self):
         return self.package_url
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        package = super().from_db(db, field_names, values)
+        # Keep track of the loaded version to update the version ranks on save
+        if all(field in field_names for field in VERSION_FIELDS):
+            package._loaded_version_fields = package.get_version_fields()
+        # Keep track of the loaded package set to invalidate it on save
+        if 'package_set' in field_names:
+            package._loaded_package_set = package.package_set
+        return package
+
+    def get_version_fields(self):
+        return tuple(getattr(self, field) for field in VERSION_FIELDS)
+
+    def has_version_changed(self, update_fields=None):
+        """
+        Return True if this Package is new or if its type, namespace, name or
+        version has changed since it was loaded and is saved with
+        `update_fields`.
+        """
+        if update_fields is not None and not set(update_fields).intersection(VERSION_FIELDS):
+            return False
+        if self._state.adding:
+            return True
+        loaded_version_fields = getattr(self, '_loaded_version_fields', None)
+        return bool(loaded_version_fields) and loaded_version_fields != self.get_version_fields()
+
+    def save(self, *args, **kwargs):
+        """
+        Save this Package and update the version ranks of all its versions
+        when this Package is new or its version has changed. Other saves do
+        not lock nor query the versions.
+        """
+        version_changed = self.has_version_changed(kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
+
+        if version_changed:
+            loaded_version_fields = getattr(self, '_loaded_version_fields', None)
+            version_fields = self.get_version_fields()
+            manager = self.__class__.objects
+            manager.rank_version(self)
+            if loaded_version_fields and loaded_version_fields[:3] != version_fields[:3]:
+                manager.update_latest_version(*loaded_version_fields[:3])
+            self._loaded_version_fields = version_fields
+
     @property
     def purl(self):
         return self.package_url
@@ -588,10 +973,57 @@ class Package(
     def get_latest_version(self):
         """
         Return the latest version of this Package.
+
+        The latest version is read from the LatestPackageVersion of this
+        Package. If some versions are not ranked yet, see the
+        `rank_package_versions` command, the versions are sorted in memory
+        instead. The database is not updated.
         """
-        sorted_versions = sort_version(self.get_all_versions())
-        if sorted_versions:
-            return sorted_versions[-1]
+        versions = self.get_all_versions()
+        if not versions.filter(version_rank__isnull=True).exists():
+            latest = (
+                LatestPackageVersion.objects
+                .filter(type=self.type, namespace=self.namespace, name=self.name)
+                .select_related('package')
+                .first()
+            )
+            return latest and latest.package
+
+        version_sort_key = get_version_sort_key(self.type)
+        # The latest of several Packages with the same version is the last one created
+        return max(versions, key=lambda package: (version_sort_key(package.version), package.id))
+
+    def get_sorted_versions(self):
+        """
+        Return a QuerySet of all the versions of this Package sorted by version
+        rank. Versions that are not ranked yet come last, see the
+        `rank_package_versions` command.
+        """
+        return self.get_all_versions().order_by(
+            models.F('version_rank').asc(nulls_last=True),
+            'id',
+        )
+
+
+class LatestPackageVersion(models.Model):
+    """
+    A pointer to the Package with the latest version among all the Packages
+    with the same type, namespace and name.
+    """
+    type = models.CharField(max_length=16, blank=True)
+    namespace = models.CharField(max_length=255, blank=True)
+    name = models.CharField(max_length=100, blank=True)
+    package = models.ForeignKey(
+        Package,
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        unique_together = ['type', 'namespace', 'name']
+
+    def __str__(self):
+        return f'{self.type}/{self.namespace}/{self.name}: {self.package}'
 
 
 party_person = 'person'
@@ -981,3 +1413,48 @@ def make_relationship(
         to_package=to_package,
         relationship=relationship,
     )
+
+
+@receiver(post_delete, sender=Package)
+def update_deleted_package_latest_version(sender, instance, **kwargs):
+    """
+    Point the LatestPackageVersion of the versions of a deleted Package to
+    their new latest version.
+    """
+    Package.objects.update_latest_version(instance.type, instance.namespace, instance.name)
+
+
+@receiver(post_save, sender=Package)
+@receiver(post_delete, sender=Package)
+def invalidate_package_package_set(sender, instance, **kwargs):
+    """
+    Invalidate the cached enhanced package data of the package set of a saved
+    or deleted Package, and of its previous package set if it has changed.
+    """
+    if get_enhanced_package_cache() is None:
+        return
+    invalidate_package_set(instance.package_set)
+    loaded_package_set = getattr(instance, '_loaded_package_set', None)
+    if loaded_package_set != instance.package_set:
+        invalidate_package_set(loaded_package_set)
+        instance._loaded_package_set = instance.package_set
+
+
+@receiver(post_save, sender=Party)
+@receiver(post_delete, sender=Party)
+@receiver(post_save, sender=DependentPackage)
+@receiver(post_delete, sender=DependentPackage)
+def invalidate_related_package_set(sender, instance, **kwargs):
+    """
+    Invalidate the cached enhanced package data of the package set of the
+    Package of a saved or deleted Party or DependentPackage.
+    """
+    if get_enhanced_package_cache() is None:
+        return
+    package_set = (
+        Package.objects
+        .filter(id=instance.package_id)
+        .values_list('package_set', flat=True)
+        .first()
+    )
+    invalidate_package_set(package_set)
@@ -7,12 +7,15 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+from rest_framework.serializers import BooleanField
 from rest_framework.serializers import CharField
 from rest_framework.serializers import HyperlinkedIdentityField
 from rest_framework.serializers import HyperlinkedModelSerializer
 from rest_framework.serializers import HyperlinkedRelatedField
 from rest_framework.serializers import JSONField
+from rest_framework.serializers import ListField
 from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import Serializer
 from rest_framework.serializers import SerializerMethodField
 
 from packagedb.models import DependentPackage
@@ -253,3 +256,29 @@ class PackageMetadataSerializer(ModelSerializer):
 
     def get_package_content(self, obj):
         return obj.get_package_content_display()
+
+
+# Maximum number of purls in a bulk lookup request
+MAX_BULK_LOOKUP_SIZE = 50000
+
+# Maximum number of Packages returned for each purl of a bulk lookup request,
+# such as for a purl without a version that matches many versions
+MAX_BULK_LOOKUP_PACKAGES = 100
+
+
+class PackageBulkLookupSerializer(Serializer):
+    """
+    Validate the JSON body of a bulk Package lookup request.
+    """
+    purls = ListField(
+        child=CharField(),
+        allow_empty=False,
+        max_length=MAX_BULK_LOOKUP_SIZE,
+        help_text='Package URLs to look up.',
+    )
+    enqueue_missing = BooleanField(
+        required=False,
+        default=False,
+        help_text='If true, request the collection of the Package data of the '
+                  'valid purls that are not found.',
+    )
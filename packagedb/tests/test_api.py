@@ -7,13 +7,17 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+from unittest import mock
 from uuid import uuid4
+import gzip
 import json
 import os
 
 from django.contrib.postgres.search import SearchVector
+from django.core.cache import caches
 from django.urls import reverse
 from django.test import TestCase
+from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -73,6 +77,24 @@ class ResourceAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(2, response.data.get('count'))
 
+    def test_api_resource_list_endpoint_cursor_pagination(self):
+        response = self.client.get('/api/resources/?pagination=cursor&page_size=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        self.assertEqual([self.resource1.sha1], [r['sha1'] for r in response.data['results']])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([self.resource2.sha1], [r['sha1'] for r in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+    def test_api_resource_export_endpoint(self):
+        response = self.client.get(f'/api/resources/export/?package={self.package1.uuid}&fields=path,sha1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([{'path': self.resource1.path, 'sha1': self.resource1.sha1}], rows)
+
     def test_api_resource_retrieve_endpoint(self):
         response = self.client.get('/api/resources/{}/'.format(self.resource1.sha1))
 
@@ -349,6 +371,49 @@ class PackageApiTestCase(TestCase):
         for result, i in zip(response.data, range(0, 10)):
             self.assertEqual(result.get('path'), 'path{}/'.format(i))
 
+    def test_api_package_resources_action_cursor_pagination(self):
+        for i in range(0, 10):
+            Resource.objects.create(package=self.package, path='path{}/'.format(i))
+
+        url = reverse('api:package-resources', args=[self.package.uuid])
+        paths = []
+        response = self.client.get(f'{url}?pagination=cursor&page_size=4')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            paths.extend(result.get('path') for result in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(['path{}/'.format(i) for i in range(0, 10)], paths)
+
+    def test_api_package_list_endpoint_cursor_pagination(self):
+        uuids = []
+        response = self.client.get('/api/packages/?pagination=cursor&page_size=2&sort=-name')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            uuids.extend(result.get('uuid') for result in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        expected = [str(uuid) for uuid in Package.objects.order_by('id').values_list('uuid', flat=True)]
+        self.assertEqual(expected, uuids)
+
+    def test_api_package_export_endpoint(self):
+        response = self.client.get('/api/packages/export/?fields=purl,uuid&compression=gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = gzip.decompress(b''.join(response.streaming_content))
+        rows = [json.loads(line) for line in content.splitlines()]
+        expected = [
+            {'purl': package.purl, 'uuid': str(package.uuid)}
+            for package in Package.objects.order_by('id')
+        ]
+        self.assertEqual(expected, rows)
+
+        response = self.client.get('/api/packages/export/?fields=purl,unknown')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_api_package_list_endpoint_multiple_char_filters(self):
         filters = f'?md5={self.package.md5}&md5={self.package2.md5}'
         response = self.client.get(f'/api/packages/{filters}')
@@ -565,6 +630,91 @@ class PackageApiPurlFilterTestCase(JsonBasedTesting, TestCase):
         self.assertEqual(1, PriorityResourceURI.objects.all().count())
         self.assertEqual({}, response.data)
 
+    def test_package_api_bulk_lookup(self):
+        from minecode.models import PriorityResourceURI
+
+        purls = [
+            self.purl1,
+            'pkg:maven/org.apache.commons/io',
+            'pkg:maven/test@1.0.0?classifier=sources',
+            self.missing_purl,
+            '11111',
+        ]
+        response = self.client.post(
+            '/api/packages/bulk_lookup/', data={'purls': purls}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(purls, list(results))
+
+        self.assertEqual('found', results[self.purl1]['status'])
+        self.assertEqual(
+            [str(self.package1.uuid)],
+            [p['uuid'] for p in results[self.purl1]['packages']],
+        )
+        self.assertEqual(
+            [str(self.package1.uuid), str(self.package2.uuid)],
+            [p['uuid'] for p in results['pkg:maven/org.apache.commons/io']['packages']],
+        )
+        self.assertEqual(
+            [str(self.package4.uuid)],
+            [p['uuid'] for p in results['pkg:maven/test@1.0.0?classifier=sources']['packages']],
+        )
+        self.assertFalse(results['pkg:maven/org.apache.commons/io']['truncated'])
+        self.assertEqual(
+            {'status': 'not_found', 'packages': [], 'truncated': False},
+            results[self.missing_purl],
+        )
+        self.assertEqual(
+            {'status': 'invalid', 'packages': [], 'truncated': False},
+            results['11111'],
+        )
+
+        expected_summary = {'found': 3, 'not_found': 1, 'invalid': 1, 'enqueued': 0}
+        self.assertEqual(expected_summary, response.data['summary'])
+        self.assertEqual(0, PriorityResourceURI.objects.all().count())
+
+    def test_package_api_bulk_lookup_enqueue_missing(self):
+        from minecode.models import PriorityResourceURI
+
+        purl = 'pkg:maven/org.apache.twill/twill-core@0.12.0'
+        data = {'purls': [self.purl1, purl, self.missing_purl], 'enqueue_missing': True}
+        response = self.client.post('/api/packages/bulk_lookup/', data=data, format='json')
+        self.assertEqual(2, response.data['summary']['enqueued'])
+        self.assertEqual(
+            sorted([purl, self.missing_purl]),
+            sorted(PriorityResourceURI.objects.values_list('package_url', flat=True)),
+        )
+
+        # Pending requests are not enqueued again
+        response = self.client.post('/api/packages/bulk_lookup/', data=data, format='json')
+        self.assertEqual(0, response.data['summary']['enqueued'])
+        self.assertEqual(2, PriorityResourceURI.objects.all().count())
+
+    def test_package_api_bulk_lookup_limits_packages_per_purl(self):
+        purl = 'pkg:maven/org.apache.commons/io'
+        matches = Package.objects.lookup_purls([purl, self.purl1], limit=1)
+        self.assertEqual([self.package1], matches[purl])
+        self.assertEqual([self.package1], matches[self.purl1])
+
+        with mock.patch('packagedb.api.MAX_BULK_LOOKUP_PACKAGES', 1):
+            response = self.client.post(
+                '/api/packages/bulk_lookup/', data={'purls': [purl, self.purl1]}, format='json'
+            )
+        results = response.data['results']
+        self.assertEqual(
+            [str(self.package1.uuid)],
+            [p['uuid'] for p in results[purl]['packages']],
+        )
+        self.assertTrue(results[purl]['truncated'])
+        self.assertFalse(results[self.purl1]['truncated'])
+
+    def test_package_api_bulk_lookup_invalid_request(self):
+        response = self.client.post('/api/packages/bulk_lookup/', data={}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/packages/bulk_lookup/', data={'purls': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_package_api_get_or_fetch_package(self):
         purl_str = 'pkg:maven/org.apache.twill/twill-core@0.12.0'
         download_url = 'https://repo1.maven.org/maven2/org/apache/twill/twill-core/0.12.0/twill-core-0.12.0.jar'
@@ -597,6 +747,34 @@ class PackageApiPurlFilterTestCase(JsonBasedTesting, TestCase):
         expected = self.get_test_loc('api/enhanced_package.json')
         self.check_expected_results(result, expected, fields_to_remove=['package_set'], regen=False)
 
+    @override_settings(PACKAGEDB_ENHANCED_PACKAGE_CACHE_BACKEND='default')
+    def test_package_api_get_enhanced_package_cached(self):
+        from packagedb.models import Party
+
+        caches['default'].clear()
+        url = reverse('api:package-get-enhanced-package-data', args=[self.package3.uuid])
+        expected = self.client.get(url).data
+
+        # The enhanced data of the whole package set are cached: only the
+        # Package is queried, in the savepoint of the atomic request
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api:package-get-enhanced-package-data', args=[self.package4.uuid]))
+        self.assertEqual('apache-2.0', response.data['declared_license_expression'])
+        with self.assertNumQueries(3):
+            self.assertEqual(expected, self.client.get(url).data)
+
+        # Saving a Party of a Package of the package set invalidates the cache
+        # and the package set is queried with its parties and dependencies
+        Party.objects.create(package=self.package4, name='example corp.', role='owner', type='organization')
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertEqual(['example corp.'], [party['name'] for party in response.data['parties']])
+
+        self.package4.declared_license_expression = 'mit'
+        self.package4.save()
+        self.assertEqual('mit', self.client.get(url).data['declared_license_expression'])
+        caches['default'].clear()
+
 
 class ResourceApiTestCase(TestCase):
 
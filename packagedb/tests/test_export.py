@@ -0,0 +1,155 @@
+#
+# Copyright (c) nexB Inc. and others. All rights reserved.
+# purldb is a trademark of nexB Inc.
+# SPDX-License-Identifier: Apache-2.0
+# See http://www.apache.org/licenses/LICENSE-2.0 for the license text.
+# See https://github.com/nexB/purldb for support or download.
+# See https://aboutcode.org for more information about nexB OSS projects.
+#
+
+import gzip
+import json
+import os
+
+from django.core import management
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.test import TransactionTestCase
+
+from minecode.management.commands.dump_purls import dump_purls
+from minecode.utils import get_temp_dir
+from packagedb.export import export
+from packagedb.models import Package
+from packagedb.models import Resource
+
+
+def load_ndjson(location):
+    opener = gzip.open if location.endswith('.gz') else open
+    with opener(location, 'rt') as f:
+        return [json.loads(line) for line in f]
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        self.package1 = Package.objects.create(
+            type='maven',
+            namespace='org.apache',
+            name='foo',
+            version='1.0',
+            download_url='https://example.com/foo-1.0.jar',
+        )
+        self.package2 = Package.objects.create(
+            type='maven',
+            namespace='org.apache',
+            name='foo',
+            version='2.0',
+            download_url='https://example.com/foo-2.0.jar',
+        )
+        self.package3 = Package.objects.create(
+            type='npm',
+            name='bar',
+            version='1.0',
+            download_url='https://example.com/bar-1.0.tgz',
+        )
+        self.resource = Resource.objects.create(
+            package=self.package3,
+            path='package/index.js',
+            sha1='a' * 40,
+        )
+
+    def test_export_packages_by_type_and_shard(self):
+        output_dir = get_temp_dir('export')
+        results = export(
+            'packages',
+            output_dir,
+            columns=['purl', 'download_url'],
+            shard_size=1,
+        )
+        self.assertEqual(['maven', 'npm'], [package_type for package_type, _, _ in results])
+        self.assertEqual([2, 1], [count for _, count, _ in results])
+
+        _, _, maven_locations = results[0]
+        self.assertEqual(
+            ['packages-maven-00000.ndjson', 'packages-maven-00001.ndjson'],
+            [os.path.basename(location) for location in maven_locations],
+        )
+        rows = [row for location in maven_locations for row in load_ndjson(location)]
+        expected = [
+            {'purl': 'pkg:maven/org.apache/foo@1.0', 'download_url': 'https://example.com/foo-1.0.jar'},
+            {'purl': 'pkg:maven/org.apache/foo@2.0', 'download_url': 'https://example.com/foo-2.0.jar'},
+        ]
+        self.assertEqual(expected, rows)
+
+    def test_export_resources_gzip(self):
+        output_dir = get_temp_dir('export')
+        results = export(
+            'resources',
+            output_dir,
+            package_types=['npm'],
+            compression='gzip',
+        )
+        [(package_type, count, [location])] = results
+        self.assertEqual(1, count)
+        self.assertTrue(location.endswith('resources-npm-00000.ndjson.gz'))
+        [row] = load_ndjson(location)
+        self.assertEqual('pkg:npm/bar@1.0', row['purl'])
+        self.assertEqual(str(self.package3.uuid), row['package_uuid'])
+        self.assertEqual('package/index.js', row['path'])
+        self.assertEqual('a' * 40, row['sha1'])
+        self.assertNotIn('id', row)
+
+    def test_export_unknown_columns(self):
+        with self.assertRaises(ValueError):
+            export('packages', get_temp_dir('export'), columns=['purl', 'unknown'])
+
+    def test_bulk_export_command(self):
+        output_dir = get_temp_dir('export')
+        management.call_command(
+            'bulk_export', 'packages', output_dir, '--type', 'npm', '--fields', 'purl', 'uuid'
+        )
+        rows = load_ndjson(os.path.join(output_dir, 'packages-npm-00000.ndjson'))
+        self.assertEqual([{'purl': 'pkg:npm/bar@1.0', 'uuid': str(self.package3.uuid)}], rows)
+
+        with self.assertRaises(CommandError):
+            management.call_command('bulk_export', 'packages', output_dir, '--fields', 'unknown')
+
+    def test_dump_purls(self):
+        output = os.path.join(get_temp_dir('export'), 'purls')
+        [location] = dump_purls('maven', output)
+        rows = load_ndjson(location)
+        self.assertEqual(
+            ['pkg:maven/org.apache/foo@1.0', 'pkg:maven/org.apache/foo@2.0'],
+            [row['purl'] for row in rows],
+        )
+
+
+class ExportStreamingTestCase(TransactionTestCase):
+
+    def test_api_package_export_is_streamed_in_a_transaction(self):
+        for version in ('1.0', '2.0', '3.0'):
+            Package.objects.create(
+                type='npm',
+                name='bar',
+                version=version,
+                download_url=f'https://example.com/bar-{version}.tgz',
+            )
+        response = self.client.get('/api/packages/export/?fields=purl')
+        self.assertFalse(connection.in_atomic_block)
+
+        # The rows are read while the response is streamed, in a transaction
+        # that stays open until the last row is read
+        lines = iter(response.streaming_content)
+        first_line = next(lines)
+        self.assertTrue(connection.in_atomic_block)
+        other_lines = list(lines)
+        self.assertFalse(connection.in_atomic_block)
+
+        rows = [json.loads(line) for line in b''.join([first_line] + other_lines).splitlines()]
+        expected = [
+            {'purl': 'pkg:npm/bar@1.0'},
+            {'purl': 'pkg:npm/bar@2.0'},
+            {'purl': 'pkg:npm/bar@3.0'},
+        ]
+        self.assertEqual(expected, rows)
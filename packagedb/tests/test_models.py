@@ -7,8 +7,11 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+from django.core import management
 from django.db import IntegrityError
+from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from packagedb.models import Package
@@ -153,3 +156,130 @@ class PackageModelTestCase(TransactionTestCase):
         self.assertEqual(p3, p2.get_latest_version())
         self.assertEqual(p3, p3.get_latest_version())
         self.assertEqual(p4, p4.get_latest_version())
+
+    def test_packagedb_package_model_version_ranks(self):
+        p1 = Package.objects.create(download_url='http://a.a', type='generic', name='name', version='1.10')
+        p2 = Package.objects.create(download_url='http://b.b', type='generic', name='name', version='1.2')
+        p3 = Package.objects.create(download_url='http://c.c', type='generic', name='name', version='1.9')
+        self.assertEqual([p2, p3, p1], list(p1.get_sorted_versions()))
+        self.assertEqual(p1, p2.get_latest_version())
+
+        # The latest version is read from the LatestPackageVersion pointer
+        with self.assertNumQueries(2):
+            self.assertEqual(p1, p3.get_latest_version())
+
+        p3.version = '2.0'
+        p3.save()
+        self.assertEqual(p3, p1.get_latest_version())
+        self.assertEqual([p2, p1, p3], list(p1.get_sorted_versions()))
+
+        p3.delete()
+        self.assertEqual(p1, p2.get_latest_version())
+
+    def test_packagedb_package_model_save_without_version_change_does_not_rank(self):
+        Package.objects.create(download_url='http://a.a', type='generic', name='name', version='1.0')
+        package = Package.objects.get(download_url='http://a.a')
+
+        package.description = 'changed'
+        with CaptureQueriesContext(connection) as queries:
+            package.save()
+            package.save(update_fields=['description'])
+        sqls = [query['sql'] for query in queries.captured_queries]
+        # Only the Package rows are updated
+        self.assertEqual({'UPDATE'}, set(sql.split()[0] for sql in sqls))
+
+        package.version = '2.0'
+        with CaptureQueriesContext(connection) as queries:
+            package.save(update_fields=['description'])
+        self.assertFalse([q for q in queries.captured_queries if 'pg_advisory_xact_lock' in q['sql']])
+        package.save()
+        self.assertEqual(package, package.get_latest_version())
+
+    def test_packagedb_package_model_version_ranks_do_not_change_other_versions(self):
+        p1 = Package.objects.create(download_url='http://a.a', type='generic', name='name', version='3.0')
+        p2 = Package.objects.create(download_url='http://b.b', type='generic', name='name', version='1.0')
+        ranks = dict(Package.objects.values_list('id', 'version_rank'))
+
+        # Older versions are ranked between or before the existing versions
+        p3 = Package.objects.create(download_url='http://c.c', type='generic', name='name', version='2.0')
+        p4 = Package.objects.create(download_url='http://d.d', type='generic', name='name', version='0.1')
+        self.assertEqual(ranks, dict(Package.objects.filter(id__in=ranks).values_list('id', 'version_rank')))
+        self.assertEqual([p4, p2, p3, p1], list(p1.get_sorted_versions()))
+        self.assertEqual(p1, p4.get_latest_version())
+
+        # Packages with the same version have the same rank
+        p5 = Package.objects.create(download_url='http://e.e', type='generic', name='name', version='2.0')
+        self.assertEqual(p3.version_rank, p5.version_rank)
+
+    def test_packagedb_package_model_version_ranks_without_free_rank(self):
+        p1 = Package.objects.create(download_url='http://a.a', type='generic', name='name', version='1.0')
+        p2 = Package.objects.create(download_url='http://b.b', type='generic', name='name', version='3.0')
+        Package.objects.filter(id=p2.id).update(version_rank=p1.version_rank + 1)
+
+        # All the versions are ranked again when there is no free rank left
+        p3 = Package.objects.create(download_url='http://c.c', type='generic', name='name', version='2.0')
+        self.assertEqual([p1, p3, p2], list(p1.get_sorted_versions()))
+        self.assertEqual(p2, p1.get_latest_version())
+
+    def test_packagedb_package_model_version_ranks_use_version_scheme(self):
+        versions = ['1.0.1', '1.0', '1.0-SNAPSHOT', '1.0-alpha-1']
+        for i, version in enumerate(versions):
+            Package.objects.create(
+                download_url=f'http://example.com/{i}',
+                type='maven',
+                namespace='org.example',
+                name='name',
+                version=version,
+            )
+        package = Package.objects.get(version='1.0')
+        # Maven alpha releases come before snapshots, unlike with a natural sort
+        self.assertEqual(
+            ['1.0-alpha-1', '1.0-SNAPSHOT', '1.0', '1.0.1'],
+            [p.version for p in package.get_sorted_versions()],
+        )
+        self.assertEqual('1.0.1', package.get_latest_version().version)
+
+        versions = ['1.0.0', '1.0.0-rc.1', '1.0.0-beta.11', '1.0.0-beta.2']
+        for i, version in enumerate(versions):
+            Package.objects.create(
+                download_url=f'http://example.com/npm/{i}',
+                type='npm',
+                name='name',
+                version=version,
+            )
+        package = Package.objects.get(type='npm', version='1.0.0')
+        # Semver pre-releases come before their release
+        self.assertEqual(
+            ['1.0.0-beta.2', '1.0.0-beta.11', '1.0.0-rc.1', '1.0.0'],
+            [p.version for p in package.get_sorted_versions()],
+        )
+        self.assertEqual(package, package.get_latest_version())
+
+    def test_packagedb_package_model_version_ranks_bulk_created_packages(self):
+        p1 = Package.objects.create(download_url='http://a.a', type='generic', name='name', version='1.0')
+        p2, p3 = Package.objects.bulk_create([
+            Package(download_url='http://c.c', type='generic', name='name', version='3.0'),
+            Package(download_url='http://b.b', type='generic', name='name', version='2.0'),
+        ])
+        # Bulk-created Packages are ranked at write time
+        self.assertIsNotNone(p2.version_rank)
+        self.assertEqual(p2, p1.get_latest_version())
+        self.assertEqual([p1, p3, p2], list(p1.get_sorted_versions()))
+
+    def test_packagedb_package_model_version_getters_are_read_only(self):
+        p1 = Package.objects.create(download_url='http://a.a', type='generic', name='name', version='1.0')
+        p2 = Package.objects.create(download_url='http://b.b', type='generic', name='name', version='2.0')
+        p3 = Package.objects.create(download_url='http://c.c', type='generic', name='name', version='1.5')
+        # Packages created before the versions were ranked
+        Package.objects.filter(id__in=[p2.id, p3.id]).update(version_rank=None)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(p2, p1.get_latest_version())
+            self.assertEqual([p1, p2, p3], list(p1.get_sorted_versions()))
+        self.assertEqual({'SELECT'}, set(q['sql'].split()[0] for q in queries.captured_queries))
+
+        management.call_command('rank_package_versions')
+        self.assertEqual(0, Package.objects.filter(version_rank__isnull=True).count())
+        self.assertEqual([p1, p3, p2], list(p1.get_sorted_versions()))
+        with self.assertNumQueries(2):
+            self.assertEqual(p2, p1.get_latest_version())
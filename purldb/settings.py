@@ -52,6 +52,26 @@ SCANCODEIO_API_KEY = env.str("SCANCODEIO_API_KEY", "")
 
 PURLDB_LOG_LEVEL = env.str("PURLDB_LOG_LEVEL", "INFO")
 
+# MatchCode
+
+# Directory of the memory-mapped SHA1 snapshots of the file indexes. Snapshots
+# are not used when empty.
+MATCHCODE_SNAPSHOT_DIR = env.str("MATCHCODE_SNAPSHOT_DIR", "")
+
+# Directory of the SHA1 Bloom filters of the file indexes. Bloom filters are not
+# used when empty.
+MATCHCODE_BLOOM_FILTER_DIR = env.str("MATCHCODE_BLOOM_FILTER_DIR", "")
+
+# How exact file matches are read: from the ExactFileIndex "rows", from the
+# ExactFilePackageSet "package_sets", or from both with "dual" while the
+# package sets are being populated.
+MATCHCODE_FILE_INDEX_READ_MODE = env.str("MATCHCODE_FILE_INDEX_READ_MODE", "dual")
+
+# Persist the halohash column sums of the directories of the indexed Packages
+# such that their directory fingerprints are updated incrementally when their
+# files change, at the cost of about 1KB of storage per directory.
+MATCHCODE_DIRECTORY_COLUMN_SUMS = env.bool("MATCHCODE_DIRECTORY_COLUMN_SUMS", False)
+
 # Application definition
 
 INSTALLED_APPS = (
@@ -163,6 +183,30 @@ CACHES = {
     }
 }
 
+# Maximum number of match results of the matchcode indexes cached in each
+# process, such as 10000. Match results are not cached when 0.
+MATCHCODE_MATCH_CACHE_SIZE = env.int("MATCHCODE_MATCH_CACHE_SIZE", 0)
+
+# Optional alias of a shared cache of CACHES, such as a memcached or redis
+# cache, where match results are also cached
+MATCHCODE_MATCH_CACHE_BACKEND = env.str("MATCHCODE_MATCH_CACHE_BACKEND", "")
+
+# Expiration in seconds of the match results in the shared cache
+MATCHCODE_MATCH_CACHE_TIMEOUT = env.int("MATCHCODE_MATCH_CACHE_TIMEOUT", 3600)
+
+# Maximum time in seconds before cached match results are invalidated once an
+# index is updated
+MATCHCODE_MATCH_CACHE_GENERATION_TTL = env.int("MATCHCODE_MATCH_CACHE_GENERATION_TTL", 10)
+
+# Alias of a cache of CACHES where the enhanced data of the Packages of a
+# package set are cached. Use a shared cache, such as a memcached or redis
+# cache, as cached data are only invalidated in the process that modifies a
+# package set. Enhanced package data are not cached when empty.
+PACKAGEDB_ENHANCED_PACKAGE_CACHE_BACKEND = env.str("PACKAGEDB_ENHANCED_PACKAGE_CACHE_BACKEND", "")
+
+# Expiration in seconds of the cached enhanced package data
+PACKAGEDB_ENHANCED_PACKAGE_CACHE_TIMEOUT = env.int("PACKAGEDB_ENHANCED_PACKAGE_CACHE_TIMEOUT", 3600)
+
 # Logging
 
 LOGGING = {
@@ -236,7 +280,7 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'packagedb.api_custom.PageSizePagination',
+    'DEFAULT_PAGINATION_CLASS': 'packagedb.api_custom.PageSizeOrCursorPagination',
     # Limit the load on the Database returning a small number of records by default. https://github.com/nexB/vulnerablecode/issues/819
     "PAGE_SIZE": 10,
 }
@@ -18,7 +18,9 @@ from packagedb.api import ResourceViewSet
 from matchcode.api import ApproximateDirectoryContentIndexViewSet
 from matchcode.api import ApproximateDirectoryStructureIndexViewSet
 from matchcode.api import ExactFileIndexViewSet
+from matchcode.api import ExactGitBlobIndexViewSet
 from matchcode.api import ExactPackageArchiveIndexViewSet
+from matchcode.api import MatchViewSet
 from minecode.api import PriorityResourceURIViewSet
 
 
@@ -28,7 +30,9 @@ api_router.register(r'resources', ResourceViewSet)
 api_router.register(r'approximate_directory_content_index', ApproximateDirectoryContentIndexViewSet)
 api_router.register(r'approximate_directory_structure_index', ApproximateDirectoryStructureIndexViewSet)
 api_router.register(r'exact_file_index', ExactFileIndexViewSet)
+api_router.register(r'exact_git_blob_index', ExactGitBlobIndexViewSet)
 api_router.register(r'exact_package_archive_index', ExactPackageArchiveIndexViewSet)
+api_router.register(r'match', MatchViewSet, 'match')
 api_router.register(r'cditems', CDitemViewSet, 'cditems')
 api_router.register(r'on_demand_queue', PriorityResourceURIViewSet)
 